@@ -45,8 +45,14 @@ def create_app():
                 "X-Requested-With",
                 "Accept",
                 "Origin",
+                "Idempotency-Key",
+            ],
+            expose_headers=[
+                "Content-Type",
+                "Authorization",
+                "X-Requested-With",
+                "Idempotent-Replayed",
             ],
-            expose_headers=["Content-Type", "Authorization", "X-Requested-With"],
             max_age=3600,
         )
     else:
@@ -71,8 +77,14 @@ def create_app():
                 "X-Requested-With",
                 "Accept",
                 "Origin",
+                "Idempotency-Key",
+            ],
+            expose_headers=[
+                "Content-Type",
+                "Authorization",
+                "X-Requested-With",
+                "Idempotent-Replayed",
             ],
-            expose_headers=["Content-Type", "Authorization", "X-Requested-With"],
             max_age=3600,
         )
 
@@ -107,7 +119,9 @@ def create_app():
 
     # Pre-compute authorized parties list for Clerk and store in config
     authorized_parties = [
-        origin.strip() for origin in clerk_authorized_parties.split(",") if origin.strip()
+        origin.strip()
+        for origin in clerk_authorized_parties.split(",")
+        if origin.strip()
     ]
     if not authorized_parties:
         raise ValueError(
@@ -117,6 +131,21 @@ def create_app():
     app.config["AUTHORIZED_PARTIES"] = authorized_parties
     app.logger.info(f"Configured AUTHORIZED_PARTIES: {authorized_parties}")
 
+    # Optionally verify session tokens locally against a cached JWKS instead
+    # of through the Clerk SDK on every request
+    from clerk_jwt import (
+        CLERK_JWT_VERIFICATION,
+        ClerkJWTVerifier,
+        JWKSCache,
+        clerk_jwks_fetcher,
+    )
+
+    if CLERK_JWT_VERIFICATION == "local":
+        app.config["CLERK_JWT_VERIFIER"] = ClerkJWTVerifier(
+            JWKSCache(clerk_jwks_fetcher(clerk_secret_key)), authorized_parties
+        )
+        app.logger.info("Verifying Clerk session tokens locally")
+
     vercel_function_url = os.environ.get("VERCEL_FUNCTION_URL")
     if not vercel_function_url:
         raise ValueError(
@@ -149,7 +178,12 @@ def create_app():
 
     # Import all models to ensure SQLAlchemy can resolve string references in relationships
     # This must happen after db.init_app() but before blueprints are registered
+    from models.analysis_lease import AnalysisLease  # noqa: F401
     from models.assignment import Assignment  # noqa: F401
+    from models.clerk_webhook_delivery import ClerkWebhookDelivery  # noqa: F401
+    from models.idempotency_key import IdempotencyKey  # noqa: F401
+    from models.receipt_field_boxes import ReceiptFieldBoxes  # noqa: F401
+    from models.receipt_image_hash import ReceiptImageHash  # noqa: F401
     from models.receipt_line_item import ReceiptLineItem  # noqa: F401
     from models.receipt_user import ReceiptUser  # noqa: F401
     from models.user import User  # noqa: F401
@@ -166,6 +200,24 @@ def create_app():
     migrations_dir = os.path.join(os.path.dirname(__file__), "migrations")
     migrate = Migrate(app, db, directory=migrations_dir)
 
+    # ============================================================================
+    # Observability
+    # ============================================================================
+    from memory_tracking import init_memory_tracking
+    from metrics import init_metrics
+    from profiling import init_profiling
+    from query_stats import init_query_stats
+    from server_timing import init_server_timing
+    from tracing import init_tracing
+
+    # Profiling, then tracing, first, so they cover the other hooks.
+    init_profiling(app)
+    init_tracing(app)
+    init_memory_tracking(app)
+    init_metrics(app)
+    init_server_timing(app)
+    init_query_stats(app)
+
     # ============================================================================
     # Blueprints Registration
     # ============================================================================
@@ -174,4 +226,15 @@ def create_app():
     app.register_blueprint(webhooks.webhooks_bp)
     app.register_blueprint(receipts.receipts_bp)
 
+    from clerk_webhooks import init_clerk_webhooks
+
+    init_clerk_webhooks(app)
+
+    # ============================================================================
+    # CLI Commands
+    # ============================================================================
+    from clerk_backfill import users_cli
+
+    app.cli.add_command(users_cli)
+
     return app
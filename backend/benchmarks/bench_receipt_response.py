@@ -0,0 +1,97 @@
+"""
+Micro-benchmark for serializing /api/analyze-receipt responses.
+
+Compares jsonify(model.model_dump()) with serializing the response envelope
+straight to JSON bytes through pydantic-core, for receipts of several sizes.
+Both start from an already validated RegularReceiptResponse.
+
+Usage (from backend/):
+    python -m benchmarks.bench_receipt_response [--repeat 7]
+"""
+
+import argparse
+import statistics
+import timeit
+import uuid
+from datetime import datetime, timezone
+
+from flask import Flask, jsonify
+from pydantic_core import to_json
+
+from schemas.receipt import ReceiptAnalysisResponse, RegularReceiptResponse
+
+
+SIZES = (5, 25, 100, 300)
+
+
+def build_receipt(items: int) -> RegularReceiptResponse:
+    now = datetime.now(timezone.utc)
+    line_items = [
+        {
+            "id": uuid.uuid4(),
+            "created_at": now,
+            "name": f"Item {index}",
+            "quantity": 1 + index % 3,
+            "price_per_item": f"{1 + index % 50}.99",
+            "assignments": [
+                {
+                    "id": f"01J{index:023d}",
+                    "receipt_user_id": f"01K{index:023d}",
+                    "display_name": "Alex",
+                    "receipt_line_item_id": uuid.uuid4(),
+                    "created_at": now,
+                    "share_percentage": "50.00",
+                }
+            ],
+        }
+        for index in range(items)
+    ]
+    return RegularReceiptResponse.model_validate(
+        {
+            "id": 1,
+            "merchant": "Benchmark Market",
+            "date": "2025-06-08",
+            "line_items": line_items,
+            "tax": "4.20",
+        }
+    )
+
+
+def via_jsonify(receipt: RegularReceiptResponse):
+    return jsonify(
+        {"success": True, "is_receipt": True, "receipt_data": receipt.model_dump()}
+    ).get_data()
+
+
+def via_pydantic_core(receipt: RegularReceiptResponse):
+    return to_json(ReceiptAnalysisResponse.model_construct(receipt_data=receipt))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--number", type=int, default=50)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    with app.app_context():
+        for items in SIZES:
+            receipt = build_receipt(items)
+            results = {}
+            for name, serialize in (
+                ("jsonify", via_jsonify),
+                ("pydantic-core", via_pydantic_core),
+            ):
+                timings = timeit.repeat(
+                    lambda: serialize(receipt), repeat=args.repeat, number=args.number
+                )
+                results[name] = statistics.median(timings) / args.number * 1000
+            print(
+                f"{items:>4} line items: "
+                + ", ".join(f"{name} {ms:.3f} ms" for name, ms in results.items())
+                + f" ({results['jsonify'] / results['pydantic-core']:.1f}x)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Micro-benchmark for receipt schema validation.
+
+Validates a synthetic analyzer payload with N line items through the same
+models the analyze route uses: RegularReceipt (model output), then
+UserReceiptCreate and ReceiptLineItemCreate (database rows).
+
+Usage (from backend/):
+    python -m benchmarks.bench_receipt_schemas [--items 200] [--repeat 7]
+"""
+
+import argparse
+import random
+import statistics
+import timeit
+
+from schemas.receipt import ReceiptLineItemCreate, RegularReceipt, UserReceiptCreate
+
+
+def build_payload(items: int, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    line_items = []
+    for index in range(items):
+        quantity = rng.choice([1, 1, 1, 2, 3, 0.5])
+        price = f"{rng.randint(50, 4999) / 100:.2f}"
+        line_items.append(
+            {
+                "name": f"Item {index}",
+                "quantity": quantity,
+                "price_per_item": price,
+                # Half of the items leave the total to the validator.
+                "total_price": 0 if index % 2 else f"{float(price) * quantity:.2f}",
+            }
+        )
+    return {
+        "is_receipt": True,
+        "merchant": "Benchmark Market",
+        "line_items": line_items,
+        "tax": "12.34",
+        "tip": "5.00",
+    }
+
+
+def validate(payload: dict) -> None:
+    receipt = RegularReceipt.model_validate(payload)
+    UserReceiptCreate.model_validate(receipt)
+    for item in receipt.line_items:
+        ReceiptLineItemCreate.model_validate(item)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--items", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--number", type=int, default=50)
+    args = parser.parse_args()
+
+    payload = build_payload(args.items)
+    timings = timeit.repeat(
+        lambda: validate(payload), repeat=args.repeat, number=args.number
+    )
+    per_call = [t / args.number * 1000 for t in timings]
+    print(
+        f"{args.items} line items: median {statistics.median(per_call):.3f} ms, "
+        f"best {min(per_call):.3f} ms per receipt"
+    )
+
+
+if __name__ == "__main__":
+    main()
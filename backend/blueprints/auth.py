@@ -1,13 +1,18 @@
 import os
 
+import jwt
 from clerk_backend_api.security.types import AuthenticateRequestOptions
 from flask import current_app, request
 
-_is_dev = os.environ.get("VERCEL_ENV", "production") != "production"
-
 from models.user import User
+from principal_cache import cache_user, get_cached_user
+from server_timing import timed
+
+
+_is_dev = os.environ.get("VERCEL_ENV", "production") != "production"
 
 
+@timed("auth", "Authentication")
 def get_current_user():
     """
     Authenticate the current request using Clerk and return the associated User.
@@ -76,23 +81,35 @@ def get_current_user():
                     auth_header[:20],
                 )
 
-        try:
-            request_state = sdk.authenticate_request(
-                request,
-                AuthenticateRequestOptions(authorized_parties=authorized_parties),
-            )
-            current_app.logger.debug(
-                "[auth.get_current_user] Clerk authentication successful"
-            )
-        except Exception as clerk_error:
-            current_app.logger.warning(
-                f"[auth.get_current_user] Clerk authentication error: {clerk_error}",
-                exc_info=True,
-            )
-            return None
+        verifier = current_app.config.get("CLERK_JWT_VERIFIER")
+        if verifier is not None:
+            # CLERK_JWT_VERIFICATION=local: checked against the cached JWKS
+            try:
+                payload = verifier.verify(auth_header.removeprefix("Bearer ").strip())
+            except jwt.InvalidTokenError as token_error:
+                current_app.logger.warning(
+                    f"[auth.get_current_user] Session token rejected: {token_error}"
+                )
+                return None
+        else:
+            try:
+                request_state = sdk.authenticate_request(
+                    request,
+                    AuthenticateRequestOptions(authorized_parties=authorized_parties),
+                )
+                current_app.logger.debug(
+                    "[auth.get_current_user] Clerk authentication successful"
+                )
+            except Exception as clerk_error:
+                current_app.logger.warning(
+                    "[auth.get_current_user] Clerk authentication error: "
+                    f"{clerk_error}",
+                    exc_info=True,
+                )
+                return None
 
-        # Extract the user ID from the authenticated request
-        payload = getattr(request_state, "payload", None) or {}
+            # Extract the user ID from the authenticated request
+            payload = getattr(request_state, "payload", None) or {}
         current_app.logger.debug(
             f"[auth.get_current_user] Extracted payload keys: {list(payload.keys())}"
         )
@@ -109,6 +126,14 @@ def get_current_user():
             f"[auth.get_current_user] Found Clerk user ID: {clerk_user_id}"
         )
 
+        # The token was verified above; only the user lookup is cached.
+        user = get_cached_user(clerk_user_id)
+        if user is not None:
+            current_app.logger.debug(
+                f"[auth.get_current_user] Principal cache hit: user_id={user.id}"
+            )
+            return user
+
         # Look up the user in the database by auth_user_id
         user = User.query.filter_by(auth_user_id=clerk_user_id, deleted_at=None).first()
         if not user:
@@ -122,6 +147,7 @@ def get_current_user():
             f"[auth.get_current_user] User authenticated successfully: "
             f"user_id={user.id}, auth_user_id={user.auth_user_id}"
         )
+        cache_user(clerk_user_id, user, payload.get("exp"))
         return user
 
     except KeyError as e:
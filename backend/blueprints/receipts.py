@@ -1,25 +1,57 @@
+import base64
+import hashlib
 import os
 import time
+from datetime import datetime
 
 import requests
 from flask import Blueprint, current_app, jsonify, request
+from pydantic_core import to_json
+from sqlalchemy import and_, func, insert, or_
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 from werkzeug.utils import secure_filename
 
 from blueprints.auth import get_current_user
+from field_boxes import record_fields_metadata
+from idempotency import run_idempotent
 from image_analyzer import ImageAnalysisError, ImageAnalyzer, ImageAnalyzerConfigError
+from image_quality import check_image_quality
+from metrics import record_blob_upload_failure
 from models import db
+from models.assignment import Assignment
 from models.receipt_line_item import ReceiptLineItem
+from models.receipt_user import ReceiptUser
 from models.user_receipt import UserReceipt
+from near_duplicates import (
+    RECEIPT_NEAR_DUP_ENABLED,
+    find_near_duplicate,
+    image_hashes,
+    record_hashes,
+)
 from schemas.receipt import (
+    ReceiptAnalysisResponse,
+    ReceiptDetailResponse,
+    ReceiptHistoryResponse,
     ReceiptLineItemCreate,
+    ReceiptSummaryResponse,
     RegularReceiptResponse,
     UserReceiptCreate,
 )
+from server_timing import timed
+from single_flight import SingleFlightTimeout, analyze_once
+from tracing import inject_headers
 
 
 receipts_bp = Blueprint("receipts", __name__)
 
+# Page size of GET /api/receipts, and the most a client may ask for
+RECEIPT_HISTORY_PAGE_SIZE = 20
+RECEIPT_HISTORY_MAX_PAGE_SIZE = 100
+
 
+@timed("blob", "Blob upload")
 def upload_to_blob_storage(image_data, filename, content_type):
     """
     Upload binary image data to Vercel blob storage via the Vercel function
@@ -56,7 +88,9 @@ def upload_to_blob_storage(image_data, filename, content_type):
         files = {"file": (safe_filename, image_data, safe_content_type)}
 
         # Make the request to the Vercel function
-        response = requests.post(vercel_function_url, files=files, timeout=30)
+        response = requests.post(
+            vercel_function_url, files=files, headers=inject_headers({}), timeout=30
+        )
 
         # Raise HTTPError for bad HTTP status codes (4xx, 5xx)
         response.raise_for_status()
@@ -100,6 +134,16 @@ def upload_to_blob_storage(image_data, filename, content_type):
         return None
 
 
+def _json_bytes_response(model, status=200, **dump_options):
+    """
+    JSON response serialized directly to bytes by pydantic-core, skipping
+    model_dump() and the stdlib encoder behind jsonify.
+    """
+    return current_app.response_class(
+        to_json(model, **dump_options), status=status, mimetype="application/json"
+    )
+
+
 @receipts_bp.route("/api/analyze-receipt", methods=["POST"])
 def analyze_receipt():
     # ============================================================================
@@ -129,9 +173,138 @@ def analyze_receipt():
             len(image_data),
         )
 
+    # ============================================================================
+    # Quality Gate
+    # ============================================================================
+    # Blurry, dark and blank photos are turned away before they cost an
+    # upload and a model call.
+    quality_report = check_image_quality(image_data)
+    if quality_report is not None:
+        return jsonify(
+            {
+                "success": False,
+                "error": quality_report.messages[0],
+                "quality_issues": quality_report.reasons,
+            }
+        ), 422
+
+    image_sha256 = hashlib.sha256(image_data).hexdigest()
+
+    # Clients resend with force_analysis=true when the suggested near-duplicate
+    # was not the receipt they photographed.
+    force_analysis = request.form.get("force_analysis", "").strip().lower() in (
+        "1",
+        "true",
+        "yes",
+    )
+
+    # ============================================================================
+    # Idempotency
+    # ============================================================================
+    # Mobile clients on flaky networks resend the same upload; with an
+    # Idempotency-Key the first request's response is replayed instead of
+    # repeating the upload, the analysis and the receipt insert.
+    idempotency_key = request.headers.get("Idempotency-Key")
+    if idempotency_key is not None:
+        return run_idempotent(
+            idempotency_key,
+            scope=str(current_user.id) if current_user is not None else "anonymous",
+            fingerprint=f"{image_sha256}:force" if force_analysis else image_sha256,
+            handler=lambda: _analyze_and_store(
+                current_user, file, image_data, image_sha256, force_analysis
+            ),
+        )
+
+    return _analyze_and_store(
+        current_user, file, image_data, image_sha256, force_analysis
+    )
+
+
+def _find_near_duplicate(image_data, current_user, force_analysis):
+    """
+    Perceptual hashes of the upload and a recent receipt of the same user it
+    duplicates, if any. Returns (hashes, receipt); either may be None.
+    """
+    if not RECEIPT_NEAR_DUP_ENABLED:
+        return None, None
+    hashes = image_hashes(image_data)
+    if hashes is None or force_analysis or current_user is None:
+        return hashes, None
+    try:
+        return hashes, find_near_duplicate(hashes, current_user.id)
+    except SQLAlchemyError:
+        # Deduplication is an optimisation; analyze normally without it.
+        db.session.rollback()
+        current_app.logger.exception("[receipt] Near-duplicate lookup failed")
+        return hashes, None
+
+
+def _insert_receipt(receipt_create_data, line_items):
+    """
+    Insert a receipt and its line items with one INSERT ... RETURNING each.
+    The line items go out as a single multi-row statement, and the returned
+    rows are attached to the receipt as already-loaded state, so building the
+    response afterwards does not query the database again.
+    """
+    new_receipt = db.session.scalars(
+        insert(UserReceipt)
+        .values(receipt_create_data.model_dump())
+        .returning(UserReceipt)
+    ).one()
+
+    rows = [
+        {
+            **ReceiptLineItemCreate.model_validate(item).model_dump(
+                exclude={"assignments"}
+            ),
+            "receipt_id": new_receipt.id,
+        }
+        for item in line_items
+    ]
+    new_line_items = (
+        db.session.scalars(
+            insert(ReceiptLineItem).returning(
+                ReceiptLineItem, sort_by_parameter_order=True
+            ),
+            rows,
+        ).all()
+        if rows
+        else []
+    )
+
+    set_committed_value(new_receipt, "line_items", new_line_items)
+    for line_item in new_line_items:
+        # New line items have no assignments yet.
+        set_committed_value(line_item, "assignments", [])
+    return new_receipt
+
+
+def _analyze_and_store(
+    current_user, file, image_data, image_sha256, force_analysis=False
+):
+    """
+    Upload, analyze and persist an already-read receipt image.
+    Returns a Flask view result (JSON body, optionally with a status code).
+    """
+    hashes, near_duplicate = _find_near_duplicate(
+        image_data, current_user, force_analysis
+    )
+    if near_duplicate is not None:
+        # The user saved another photo of this receipt recently. Nothing is
+        # uploaded or saved until they confirm: they open that receipt, or
+        # resend with force_analysis to analyze this photo anyway.
+        return jsonify(
+            {
+                "success": False,
+                "error": "This receipt looks like one you saved recently",
+                "near_duplicate_of": near_duplicate.id,
+            }
+        ), 409
+
     # Upload to blob storage using binary data
     blob_url = upload_to_blob_storage(image_data, file.filename, file.content_type)
     if not blob_url:
+        record_blob_upload_failure()
         return jsonify(
             {"success": False, "error": "Failed to upload image to blob storage"}
         ), 500
@@ -144,21 +317,41 @@ def analyze_receipt():
 
         try:
             _t0 = time.monotonic()
-            receipt_model = analyzer.analyze_image(
-                image_data, mime_type=file.content_type or "image/jpeg"
-            )
+            with timed("analyze", "Receipt analysis"):
+                # Identical images analyzed concurrently share a single model
+                # call; each request still creates its own receipt row below.
+                receipt_model = analyze_once(
+                    image_sha256,
+                    lambda: analyzer.analyze_image(
+                        image_data, mime_type=file.content_type or "image/jpeg"
+                    ),
+                )
             if current_app.debug:
                 current_app.logger.debug(
                     "[receipt] Gemini analysis took %.2fs, result type: %s",
                     time.monotonic() - _t0,
                     type(receipt_model).__name__,
                 )
-                if hasattr(receipt_model, "is_receipt") and not receipt_model.is_receipt:
+                if (
+                    hasattr(receipt_model, "is_receipt")
+                    and not receipt_model.is_receipt
+                ):
                     reason = getattr(receipt_model, "reason", None)
                     current_app.logger.debug(
                         "[receipt] NotAReceipt returned. Reason: %s",
                         reason or "none provided",
                     )
+        except SingleFlightTimeout:
+            # The same image is still being analyzed for another request; its
+            # result stays readable briefly once it finishes.
+            response = jsonify(
+                {
+                    "success": False,
+                    "error": "This image is already being analyzed, try again",
+                }
+            )
+            response.headers["Retry-After"] = "5"
+            return response, 503
         except ImageAnalyzerConfigError as config_error:
             current_app.logger.error(
                 f"Image analyzer configuration error: {str(config_error)}"
@@ -213,42 +406,38 @@ def analyze_receipt():
             receipt_create_data.original_tip = receipt_create_data.tip
             receipt_create_data.original_tax = receipt_create_data.tax
 
-            # Create the SQLAlchemy model instance
-            new_receipt = UserReceipt(**receipt_create_data.model_dump())
-            db.session.add(new_receipt)
-
-            if hasattr(receipt_model, "line_items") and receipt_model.line_items:
-                for item in receipt_model.line_items:
-                    # Use Pydantic model_validate to automatically map fields
-                    line_item_data = ReceiptLineItemCreate.model_validate(item)
-
-                    # Create the SQLAlchemy model instance
-                    line_item = ReceiptLineItem(**line_item_data.model_dump())
-
-                    # Use the relationship to automatically set the foreign key
-                    new_receipt.line_items.append(line_item)
+            with timed("db", "Receipt insert and commit"):
+                new_receipt = _insert_receipt(
+                    receipt_create_data,
+                    getattr(receipt_model, "line_items", None) or [],
+                )
+                if hashes is not None:
+                    record_hashes(new_receipt, hashes)
+                # Kept for PII redaction and field highlighting without
+                # another model call.
+                record_fields_metadata(
+                    new_receipt, getattr(receipt_model, "fields_metadata", None)
+                )
 
-            db.session.commit()
+                # Built from the inserted rows before commit, which would
+                # expire them and reload the receipt and every line item on
+                # access.
+                receipt_data = RegularReceiptResponse.model_validate(new_receipt)
+                db.session.commit()
 
             current_app.logger.info(
                 "[receipt] Receipt saved successfully: id=%s",
-                new_receipt.id,
+                receipt_data.id,
             )
             current_app.logger.debug(
-                "[receipt] Receipt details: store=%s, total=%s, user_id=%s",
-                getattr(new_receipt, "store_name", None),
-                getattr(new_receipt, "total", None),
-                getattr(new_receipt, "user_id", None),
+                "[receipt] Receipt details: merchant=%s, total=%s, user_id=%s",
+                receipt_data.merchant,
+                receipt_data.total,
+                receipt_create_data.user_id,
             )
 
-            return jsonify(
-                {
-                    "success": True,
-                    "is_receipt": True,
-                    "receipt_data": RegularReceiptResponse.model_validate(
-                        new_receipt
-                    ).model_dump(),
-                }
+            return _json_bytes_response(
+                ReceiptAnalysisResponse.model_construct(receipt_data=receipt_data)
             )
         else:
             # ====================================================================
@@ -274,6 +463,131 @@ def analyze_receipt():
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+def _load_receipt(receipt_id):
+    """
+    A receipt with its live line items, assignments and receipt users, or
+    None if it does not exist or was deleted. Mirrors the receipt.byId Zero
+    query: soft-deleted rows are filtered in SQL at every level, and the
+    whole tree loads in three queries however many line items and
+    assignments there are.
+    """
+    return db.session.scalars(
+        db.select(UserReceipt)
+        .where(UserReceipt.id == receipt_id, UserReceipt.deleted_at.is_(None))
+        .options(
+            selectinload(
+                UserReceipt.line_items.and_(ReceiptLineItem.deleted_at.is_(None))
+            )
+            .selectinload(
+                ReceiptLineItem.assignments.and_(Assignment.deleted_at.is_(None))
+            )
+            .joinedload(Assignment.receipt_user.and_(ReceiptUser.deleted_at.is_(None)))
+            .joinedload(ReceiptUser.user)
+        )
+    ).one_or_none()
+
+
+@receipts_bp.route("/api/receipts/<int:receipt_id>", methods=["GET"])
+def get_receipt(receipt_id):
+    """Fetch a receipt with its line items and their assignments."""
+    receipt = _load_receipt(receipt_id)
+    if receipt is None:
+        return jsonify({"success": False, "error": "Receipt not found"}), 404
+
+    return _json_bytes_response(
+        ReceiptDetailResponse.model_construct(
+            receipt_data=RegularReceiptResponse.model_validate(receipt)
+        )
+    )
+
+
+def _encode_history_cursor(created_at, receipt_id):
+    """Opaque cursor pointing just past a receipt in the history order."""
+    raw = f"{created_at.isoformat()}|{receipt_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_history_cursor(cursor):
+    """(created_at, receipt_id) of a cursor, or None if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, receipt_id = raw.decode().rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(receipt_id)
+    except ValueError:
+        return None
+
+
+@receipts_bp.route("/api/receipts", methods=["GET"])
+def list_receipts():
+    """
+    The current user's receipts, newest first, as summary rows.
+    Keyset-paginated on (created_at DESC, id): pass the previous page's
+    next_cursor as ?cursor= to continue. Served by the
+    ix_user_receipts_user_history index, so a deep page costs the same as
+    the first one.
+    """
+    current_user = get_current_user()
+    if current_user is None:
+        return jsonify({"success": False, "error": "Authentication required"}), 401
+
+    limit = request.args.get("limit", RECEIPT_HISTORY_PAGE_SIZE, type=int)
+    limit = min(max(limit, 1), RECEIPT_HISTORY_MAX_PAGE_SIZE)
+
+    item_count = (
+        db.select(func.count(ReceiptLineItem.id))
+        .where(
+            ReceiptLineItem.receipt_id == UserReceipt.id,
+            ReceiptLineItem.deleted_at.is_(None),
+        )
+        .scalar_subquery()
+    )
+    query = db.select(
+        UserReceipt.id,
+        UserReceipt.merchant,
+        UserReceipt.date,
+        UserReceipt.total,
+        UserReceipt.created_at,
+        item_count.label("item_count"),
+    ).where(
+        UserReceipt.user_id == current_user.id,
+        UserReceipt.deleted_at.is_(None),
+    )
+
+    cursor = request.args.get("cursor")
+    if cursor:
+        position = _decode_history_cursor(cursor)
+        if position is None:
+            return jsonify({"success": False, "error": "Invalid cursor"}), 400
+        created_at, receipt_id = position
+        query = query.where(
+            or_(
+                UserReceipt.created_at < created_at,
+                and_(
+                    UserReceipt.created_at == created_at,
+                    UserReceipt.id > receipt_id,
+                ),
+            )
+        )
+
+    # One extra row tells whether there is a next page.
+    rows = db.session.execute(
+        query.order_by(UserReceipt.created_at.desc(), UserReceipt.id).limit(limit + 1)
+    ).all()
+    page = rows[:limit]
+    next_cursor = (
+        _encode_history_cursor(page[-1].created_at, page[-1].id)
+        if len(rows) > limit
+        else None
+    )
+
+    return _json_bytes_response(
+        ReceiptHistoryResponse.model_construct(
+            receipts=[ReceiptSummaryResponse.model_validate(row) for row in page],
+            next_cursor=next_cursor,
+        )
+    )
+
+
 @receipts_bp.route("/api/health", methods=["GET"])
 def health_check():
     """Simple health check endpoint"""
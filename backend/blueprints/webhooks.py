@@ -1,9 +1,15 @@
+import json
+
 from flask import Blueprint, current_app, jsonify, request
-from sqlalchemy.exc import IntegrityError
-from svix.webhooks import Webhook, WebhookVerificationError
+from sqlalchemy.exc import SQLAlchemyError
+from svix.webhooks import WebhookVerificationError
 
-from models import db
-from models.user import User
+from clerk_webhooks import (
+    USER_EVENT_TYPES,
+    get_webhook,
+    record_delivery,
+    schedule_processing,
+)
 
 
 webhooks_bp = Blueprint("webhooks", __name__, url_prefix="/api")
@@ -12,8 +18,10 @@ webhooks_bp = Blueprint("webhooks", __name__, url_prefix="/api")
 @webhooks_bp.route("/webhooks/clerk", methods=["POST"])
 def clerk_webhook():
     """
-    Handle Clerk webhook events, specifically user.created events.
-    Creates a new user record in the database with the Clerk user ID.
+    Handle Clerk webhook events.
+    user.created, user.updated and user.deleted deliveries are recorded by
+    svix-id and acknowledged with 202; the clerk_webhooks batcher applies
+    them to the users table. A repeated svix-id is acknowledged with 200.
     """
     # Get webhook secret from app config (validated at startup)
     webhook_secret = current_app.config.get("CLERK_WEBHOOK_SECRET")
@@ -32,13 +40,13 @@ def clerk_webhook():
 
     # Verify webhook signature
     try:
-        webhook = Webhook(webhook_secret)
+        webhook = get_webhook(webhook_secret)
         headers = {
             "svix-id": svix_id,
             "svix-timestamp": svix_timestamp,
             "svix-signature": svix_signature,
         }
-        msg = webhook.verify(payload, headers)
+        webhook.verify(payload, headers)
     except WebhookVerificationError as e:
         current_app.logger.warning(f"Webhook verification failed: {str(e)}")
         return jsonify({"error": "Invalid signature"}), 401
@@ -47,41 +55,30 @@ def clerk_webhook():
         return jsonify({"error": "Verification error"}), 500
 
     # Parse the verified payload
-    # webhook.verify() returns a dict directly
-    event_data = msg
+    # (webhook.verify() returns None as of svix 2.x, so parse it here)
+    event_data = json.loads(payload)
     event_type = event_data.get("type")
 
-    # Only handle user.created events
-    if event_type != "user.created":
+    if event_type not in USER_EVENT_TYPES:
         current_app.logger.info(f"Ignoring webhook event type: {event_type}")
         return jsonify({"message": "Event type not handled"}), 200
 
-    # Extract user ID from the webhook data
-    try:
-        user_data = event_data.get("data", {})
-        clerk_user_id = user_data.get("id")
-        if not clerk_user_id:
-            current_app.logger.error("Missing user ID in webhook data")
-            return jsonify({"error": "Missing user ID"}), 400
-    except Exception as e:
-        current_app.logger.error(f"Failed to extract user ID: {str(e)}")
-        return jsonify({"error": "Invalid user data"}), 400
+    clerk_user_id = (event_data.get("data") or {}).get("id")
+    if not clerk_user_id:
+        current_app.logger.error("Missing user ID in webhook data")
+        return jsonify({"error": "Missing user ID"}), 400
 
-    # Create new user record
+    # Record the delivery and acknowledge; the batcher applies it
     try:
-        new_user = User(auth_user_id=clerk_user_id)
-        db.session.add(new_user)
-        db.session.commit()
-
-        current_app.logger.info(f"Created user with auth_user_id: {clerk_user_id}")
-        return jsonify({"success": True, "user_id": new_user.id}), 200
-    except IntegrityError:
-        db.session.rollback()
-        current_app.logger.warning(
-            f"User with auth_user_id {clerk_user_id} already exists"
-        )
-        return jsonify({"error": "User already exists"}), 409
-    except Exception as e:
-        db.session.rollback()
-        current_app.logger.error(f"Failed to create user: {str(e)}")
-        return jsonify({"error": "Failed to create user"}), 500
+        accepted = record_delivery(svix_id, event_type, clerk_user_id)
+    except SQLAlchemyError as e:
+        # Not acknowledged, so Svix retries the delivery
+        current_app.logger.error(f"Failed to record webhook delivery: {str(e)}")
+        return jsonify({"error": "Failed to record event"}), 500
+
+    if not accepted:
+        current_app.logger.info(f"Ignoring repeated webhook delivery {svix_id}")
+        return jsonify({"success": True, "duplicate": True}), 200
+
+    schedule_processing(current_app._get_current_object())
+    return jsonify({"success": True}), 202
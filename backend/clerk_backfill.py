@@ -0,0 +1,248 @@
+"""
+Reconciliation of the users table with Clerk: `flask users backfill`.
+
+Users are normally created by the Clerk webhook (see clerk_webhooks); when a
+delivery is lost, get_current_user finds no row for a signed-in user. This
+command pages through Clerk's user list, oldest first with several pages in
+flight, and upserts each page into users with
+INSERT ... ON CONFLICT (auth_user_id) DO NOTHING RETURNING, reporting the
+users it had to create. The Clerk ids seen are staged in a temporary table,
+so live users that no longer exist in Clerk are found at the end with one
+anti-join. Memory is bounded by the pages in flight, however many users
+there are.
+
+Clerk pages by offset: users deleted in Clerk while the command runs can
+shift later pages and hide a few users from this run. Running it again
+picks them up.
+"""
+
+import os
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Iterable, Iterator
+
+import click
+import requests
+from flask import current_app
+from flask.cli import AppGroup
+from requests.adapters import HTTPAdapter
+from sqlalchemy import Column, MetaData, Table, Text, exists, select
+
+from models import db, dialect_insert
+from models.user import User
+
+
+# Base URL of the Clerk Backend API.
+CLERK_API_URL: str = os.getenv("CLERK_API_URL", "https://api.clerk.com/v1")
+
+# Largest `limit` the Clerk user list accepts.
+CLERK_USER_PAGE_SIZE = 500
+
+_MAX_ATTEMPTS = 5
+_TIMEOUT_SECONDS = 30
+
+_users = User.__table__
+
+# Per connection, so concurrent runs do not see each other's ids.
+_seen = Table(
+    "clerk_backfill_seen",
+    MetaData(),
+    Column("auth_user_id", Text, primary_key=True),
+    prefixes=["TEMPORARY"],
+)
+
+users_cli = AppGroup("users", help="Manage users.")
+
+
+class ClerkUserPages:
+    """Ids of all Clerk users, fetched a page at a time from the Backend API."""
+
+    def __init__(
+        self,
+        secret_key: str,
+        api_url: str = CLERK_API_URL,
+        page_size: int = CLERK_USER_PAGE_SIZE,
+        concurrency: int = 4,
+    ):
+        self._url = f"{api_url.rstrip('/')}/users"
+        self._headers = {
+            "Accept": "application/json",
+            "Authorization": f"Bearer {secret_key}",
+        }
+        self._page_size = page_size
+        self._concurrency = concurrency
+        self._session = requests.Session()
+        self._session.mount(api_url, HTTPAdapter(pool_maxsize=concurrency))
+
+    def fetch(self, offset: int) -> list[str]:
+        """Ids of one page of users, retrying rate limits and server errors."""
+        for attempt in range(1, _MAX_ATTEMPTS + 1):
+            response = self._session.get(
+                self._url,
+                params={
+                    "limit": self._page_size,
+                    "offset": offset,
+                    "order_by": "+created_at",
+                },
+                headers=self._headers,
+                timeout=_TIMEOUT_SECONDS,
+            )
+            retryable = response.status_code == 429 or response.status_code >= 500
+            if not retryable or attempt == _MAX_ATTEMPTS:
+                break
+            retry_after = response.headers.get("Retry-After", "")
+            time.sleep(float(retry_after) if retry_after.isdigit() else 2**attempt)
+        response.raise_for_status()
+        return [user["id"] for user in response.json()]
+
+    def __iter__(self) -> Iterator[list[str]]:
+        """
+        Pages in completion order, with up to `concurrency` requests in
+        flight, until Clerk returns a short page.
+        """
+        with ThreadPoolExecutor(
+            max_workers=self._concurrency, thread_name_prefix="clerk-backfill"
+        ) as pool:
+            next_offset = 0
+            in_flight = set()
+            exhausted = False
+
+            def submit():
+                nonlocal next_offset
+                in_flight.add(pool.submit(self.fetch, next_offset))
+                next_offset += self._page_size
+
+            for _ in range(self._concurrency):
+                submit()
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    in_flight.discard(future)
+                    page = future.result()
+                    if len(page) < self._page_size:
+                        exhausted = True
+                    elif not exhausted:
+                        submit()
+                    yield page
+
+
+def backfill_users(
+    pages: Iterable[list[str]],
+    dry_run: bool = False,
+    report: Callable[[str, str], None] = lambda side, auth_user_id: None,
+) -> Counter:
+    """
+    Create a user for every Clerk id missing from the users table and report
+    the users found on one side only, as report("clerk", id) for Clerk users
+    without a row and report("database", id) for live rows without a Clerk
+    user. Returns counts of Clerk users, rows created and rows missing from
+    Clerk. With dry_run, nothing is created.
+    """
+    counts = Counter(clerk=0, created=0, database_only=0)
+    with db.engine.connect() as conn:
+        _seen.create(conn)
+        conn.commit()
+        try:
+            for page in pages:
+                if not page:
+                    continue
+                with conn.begin():
+                    missing = _upsert_page(conn, page, dry_run)
+                counts["clerk"] += len(page)
+                counts["created"] += len(missing)
+                for auth_user_id in missing:
+                    report("clerk", auth_user_id)
+
+            with conn.begin():
+                database_only = conn.execute(
+                    select(_users.c.auth_user_id)
+                    .where(
+                        _users.c.deleted_at.is_(None),
+                        ~exists().where(_seen.c.auth_user_id == _users.c.auth_user_id),
+                    )
+                    .order_by(_users.c.id),
+                    execution_options={"yield_per": 1000},
+                ).scalars()
+                for auth_user_id in database_only:
+                    counts["database_only"] += 1
+                    report("database", auth_user_id)
+        finally:
+            if conn.in_transaction():
+                conn.rollback()
+            _seen.drop(conn)
+            conn.commit()
+    return counts
+
+
+def _upsert_page(conn, page: list[str], dry_run: bool) -> list[str]:
+    """Stage a page of Clerk ids; return those that had no user row."""
+    conn.execute(
+        dialect_insert(_seen)
+        .values([{"auth_user_id": auth_user_id} for auth_user_id in page])
+        .on_conflict_do_nothing(index_elements=["auth_user_id"])
+    )
+    if dry_run:
+        existing = set(
+            conn.scalars(
+                select(_users.c.auth_user_id).where(_users.c.auth_user_id.in_(page))
+            )
+        )
+        return [auth_user_id for auth_user_id in page if auth_user_id not in existing]
+    return list(
+        conn.scalars(
+            dialect_insert(_users)
+            .values([{"auth_user_id": auth_user_id} for auth_user_id in page])
+            .on_conflict_do_nothing(index_elements=["auth_user_id"])
+            .returning(_users.c.auth_user_id)
+        )
+    )
+
+
+@users_cli.command("backfill")
+@click.option(
+    "--concurrency",
+    type=click.IntRange(1, 16),
+    default=4,
+    show_default=True,
+    help="Clerk pages fetched in parallel.",
+)
+@click.option(
+    "--page-size",
+    type=click.IntRange(1, CLERK_USER_PAGE_SIZE),
+    default=CLERK_USER_PAGE_SIZE,
+    show_default=True,
+    help="Users per Clerk request.",
+)
+@click.option(
+    "--api-url",
+    default=CLERK_API_URL,
+    show_default=True,
+    help="Clerk Backend API base URL.",
+)
+@click.option(
+    "--dry-run", is_flag=True, help="Report differences without creating users."
+)
+def backfill_command(concurrency, page_size, api_url, dry_run):
+    """Create users missing from the database and report users on one side only."""
+    pages = ClerkUserPages(
+        current_app.config["CLERK_SECRET_KEY"],
+        api_url=api_url,
+        page_size=page_size,
+        concurrency=concurrency,
+    )
+
+    def report(side, auth_user_id):
+        if side == "clerk":
+            click.echo(
+                f"only in Clerk: {auth_user_id}" + ("" if dry_run else " (created)")
+            )
+        else:
+            click.echo(f"only in database: {auth_user_id}")
+
+    counts = backfill_users(pages, dry_run=dry_run, report=report)
+    click.echo(
+        f"{counts['clerk']} Clerk users, "
+        f"{counts['created']} {'missing' if dry_run else 'created'}, "
+        f"{counts['database_only']} live users not in Clerk"
+    )
@@ -0,0 +1,201 @@
+"""
+Local verification of Clerk session tokens.
+
+With CLERK_JWT_VERIFICATION=local, get_current_user checks the session JWT
+itself with PyJWT instead of going through sdk.authenticate_request: the
+RS256 signature against Clerk's JWKS, exp/nbf/iat with
+CLERK_JWT_LEEWAY_SECONDS of clock skew, and, as the SDK does, that the azp
+claim is one of AUTHORIZED_PARTIES.
+
+The JWKS is fetched once per process and refreshed by a daemon thread every
+CLERK_JWKS_REFRESH_SECONDS. A token signed with a kid missing from the
+cached set (Clerk rotated its signing key) triggers an immediate refetch, at
+most once per _MIN_REFETCH_SECONDS so made-up kids cannot hammer Clerk.
+Verified tokens are remembered in an LRU until they expire, so in the
+steady state authentication is a dictionary lookup.
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Optional
+
+import jwt
+import requests
+from cachetools import LRUCache
+
+
+logger = logging.getLogger(__name__)
+
+# "sdk" verifies through sdk.authenticate_request; "local" uses this module.
+CLERK_JWT_VERIFICATION: str = os.getenv("CLERK_JWT_VERIFICATION", "sdk").strip().lower()
+
+# JWKS endpoint of the Clerk Backend API (authenticated with the secret key).
+CLERK_JWKS_URL: str = os.getenv("CLERK_JWKS_URL", "https://api.clerk.com/v1/jwks")
+
+# Background refresh interval of the cached JWKS; 0 disables the thread.
+CLERK_JWKS_REFRESH_SECONDS: float = float(
+    os.getenv("CLERK_JWKS_REFRESH_SECONDS", "3600")
+)
+
+# Allowed clock skew between Clerk and this server for exp/nbf/iat.
+CLERK_JWT_LEEWAY_SECONDS: float = float(os.getenv("CLERK_JWT_LEEWAY_SECONDS", "5"))
+
+# Verified tokens remembered per process until they expire; 0 disables.
+CLERK_VERIFIED_TOKEN_CACHE_SIZE: int = int(
+    os.getenv("CLERK_VERIFIED_TOKEN_CACHE_SIZE", "4096")
+)
+
+_MIN_REFETCH_SECONDS = 30
+_JWKS_TIMEOUT_SECONDS = 10
+
+
+def clerk_jwks_fetcher(secret_key: str) -> Callable[[], dict]:
+    """A function fetching the JWKS document from CLERK_JWKS_URL."""
+
+    def fetch() -> dict:
+        response = requests.get(
+            CLERK_JWKS_URL,
+            headers={
+                "Accept": "application/json",
+                "Authorization": f"Bearer {secret_key}",
+            },
+            timeout=_JWKS_TIMEOUT_SECONDS,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    return fetch
+
+
+class JWKSCache:
+    """Signing keys by kid, fetched on first use and kept fresh in the background."""
+
+    def __init__(
+        self,
+        fetch: Callable[[], dict],
+        refresh_seconds: float = CLERK_JWKS_REFRESH_SECONDS,
+    ):
+        self._fetch = fetch
+        self._refresh_seconds = refresh_seconds
+        self._keys: dict[str, Any] = {}
+        self._fetched_at = float("-inf")
+        self._fetch_lock = threading.Lock()
+        self._refresher_pid: Optional[int] = None
+
+    def get_key(self, kid: Optional[str]) -> Any:
+        """Public key for a kid; raises jwt.InvalidTokenError if there is none."""
+        self._ensure_refresher()
+        key = self._keys.get(kid)
+        if key is None:
+            self._refetch_for(kid)
+            key = self._keys.get(kid)
+        if key is None:
+            raise jwt.InvalidTokenError(f"Unknown signing key {kid!r}")
+        return key
+
+    def refresh(self) -> None:
+        """Replace the cached keys with a freshly fetched set."""
+        with self._fetch_lock:
+            self._refresh_locked()
+
+    def _refresh_locked(self) -> None:
+        self._fetched_at = time.monotonic()
+        keys = {}
+        for jwk in self._fetch().get("keys", []):
+            try:
+                key = jwt.PyJWK(jwk)
+            except (jwt.PyJWKError, jwt.InvalidKeyError):
+                logger.warning("[auth] Skipping unusable JWK %r", jwk.get("kid"))
+                continue
+            if key.key_id:
+                keys[key.key_id] = key.key
+        if not keys:
+            # Keep the current keys rather than locking every user out.
+            raise ValueError("Clerk JWKS has no usable signing keys")
+        self._keys = keys
+        logger.info("[auth] Loaded %d Clerk signing keys", len(keys))
+
+    def _refetch_for(self, kid: Optional[str]) -> None:
+        with self._fetch_lock:
+            # Another thread may have fetched it while this one waited.
+            if kid in self._keys:
+                return
+            if time.monotonic() - self._fetched_at < _MIN_REFETCH_SECONDS:
+                return
+            try:
+                self._refresh_locked()
+            except Exception:
+                logger.exception("[auth] Fetching the Clerk JWKS failed")
+
+    def _ensure_refresher(self) -> None:
+        # Per process: a refresher started before a gunicorn fork does not
+        # survive into the workers.
+        if self._refresh_seconds <= 0 or self._refresher_pid == os.getpid():
+            return
+        with self._fetch_lock:
+            if self._refresher_pid == os.getpid():
+                return
+            self._refresher_pid = os.getpid()
+        threading.Thread(
+            target=self._refresh_loop, name="clerk-jwks-refresh", daemon=True
+        ).start()
+
+    def _refresh_loop(self) -> None:
+        while True:
+            time.sleep(self._refresh_seconds)
+            try:
+                self.refresh()
+            except Exception:
+                logger.warning(
+                    "[auth] Refreshing the Clerk JWKS failed; keeping %d cached keys",
+                    len(self._keys),
+                    exc_info=True,
+                )
+
+
+class ClerkJWTVerifier:
+    """Verifies Clerk session tokens locally against a JWKSCache."""
+
+    def __init__(
+        self,
+        jwks: JWKSCache,
+        authorized_parties: list[str],
+        leeway: float = CLERK_JWT_LEEWAY_SECONDS,
+        cache_size: int = CLERK_VERIFIED_TOKEN_CACHE_SIZE,
+    ):
+        self._jwks = jwks
+        self._authorized_parties = frozenset(authorized_parties)
+        self._leeway = leeway
+        self._verified: LRUCache = LRUCache(maxsize=cache_size)
+        self._verified_lock = threading.Lock()
+
+    def verify(self, token: str) -> dict:
+        """Claims of a valid session token; raises jwt.InvalidTokenError."""
+        with self._verified_lock:
+            claims = self._verified.get(token)
+        if claims is not None:
+            if claims["exp"] + self._leeway > time.time():
+                return claims
+            with self._verified_lock:
+                self._verified.pop(token, None)
+            raise jwt.ExpiredSignatureError("Signature has expired")
+
+        kid = jwt.get_unverified_header(token).get("kid")
+        claims = jwt.decode(
+            token,
+            self._jwks.get_key(kid),
+            algorithms=["RS256"],
+            leeway=self._leeway,
+            options={"require": ["exp", "iat", "sub"]},
+        )
+        if claims.get("azp") not in self._authorized_parties:
+            raise jwt.InvalidTokenError(
+                f"Token issued for unauthorized party {claims.get('azp')!r}"
+            )
+
+        if self._verified.maxsize:
+            with self._verified_lock:
+                self._verified[token] = claims
+        return claims
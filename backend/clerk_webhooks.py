@@ -0,0 +1,264 @@
+"""
+Asynchronous ingestion of Clerk user webhooks.
+
+The webhook endpoint only verifies the Svix signature and records the
+delivery in clerk_webhook_deliveries, keyed by its svix-id, before
+acknowledging. A delivery Svix retries (or replays) hits the primary key
+and is acknowledged again without being queued twice. Recording a delivery
+is a single-row insert, so a Clerk bulk import costs one short statement
+per event instead of a user transaction each.
+
+A daemon thread in each gunicorn worker applies the recorded deliveries to
+the users table in batches of up to CLERK_WEBHOOK_BATCH_SIZE: the last event
+per Clerk user wins, created/updated users are upserted with one
+INSERT ... ON CONFLICT DO NOTHING and deleted users are soft-deleted with
+one UPDATE. The batcher starts with the worker's first request and is woken
+by the endpoint, waiting CLERK_WEBHOOK_BATCH_LINGER_SECONDS so that a burst
+lands in one batch. It also sweeps when it starts and every
+CLERK_WEBHOOK_SWEEP_SECONDS, so deliveries left pending by a failed batch,
+or by a worker that died before applying them, are applied without waiting
+for another delivery. Batches are claimed with FOR UPDATE SKIP LOCKED, so
+batchers in different workers never apply the same delivery.
+
+Processed deliveries are kept for CLERK_WEBHOOK_DEDUP_SECONDS to recognise
+retries, then pruned.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Optional
+
+from flask import Flask
+from sqlalchemy import delete, select, update
+from svix.webhooks import Webhook
+
+from models import db, dialect_insert
+from models.clerk_webhook_delivery import ClerkWebhookDelivery
+from models.user import User
+from principal_cache import invalidate_user
+from tracing import current_traceparent, span
+
+
+logger = logging.getLogger(__name__)
+
+# Start a batcher thread per worker. With it disabled deliveries are only
+# recorded and must be applied with drain_pending_deliveries().
+CLERK_WEBHOOK_BATCHER_ENABLED: bool = os.getenv(
+    "CLERK_WEBHOOK_BATCHER_ENABLED", "true"
+).strip().lower() in ("1", "true", "yes")
+
+# Most deliveries applied in one transaction.
+CLERK_WEBHOOK_BATCH_SIZE: int = int(os.getenv("CLERK_WEBHOOK_BATCH_SIZE", "500"))
+
+# How long the batcher lets deliveries accumulate after being woken.
+CLERK_WEBHOOK_BATCH_LINGER_SECONDS: float = float(
+    os.getenv("CLERK_WEBHOOK_BATCH_LINGER_SECONDS", "0.5")
+)
+
+# How often the batcher applies deliveries left pending without being woken.
+CLERK_WEBHOOK_SWEEP_SECONDS: float = float(
+    os.getenv("CLERK_WEBHOOK_SWEEP_SECONDS", "30")
+)
+
+# How long a processed svix-id is remembered. Svix retries a failed delivery
+# for a little over a day.
+CLERK_WEBHOOK_DEDUP_SECONDS: int = int(
+    os.getenv("CLERK_WEBHOOK_DEDUP_SECONDS", "259200")
+)
+
+USER_EVENT_TYPES = frozenset({"user.created", "user.updated", "user.deleted"})
+
+_table = ClerkWebhookDelivery.__table__
+_users = User.__table__
+
+_batcher_pid: Optional[int] = None
+_batcher_lock = threading.Lock()
+_wakeup = threading.Event()
+# Traceparents of the requests that woke the batcher, linked from its next
+# drain span.
+_pending_links: deque = deque(maxlen=128)
+
+_counts: Counter = Counter()
+_counts_lock = threading.Lock()
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _count(**increments: int) -> None:
+    with _counts_lock:
+        _counts.update(increments)
+
+
+@lru_cache(maxsize=4)
+def get_webhook(secret: str) -> Webhook:
+    """The Svix verifier for a webhook secret, built once per process."""
+    return Webhook(secret)
+
+
+def record_delivery(svix_id: str, event_type: str, clerk_user_id: str) -> bool:
+    """
+    Persist a verified delivery for the batcher.
+
+    Returns False if the svix-id has been recorded before, i.e. this is a
+    retry of a delivery that is already queued or applied.
+    """
+    now = _utcnow()
+    with db.engine.begin() as conn:
+        inserted = conn.execute(
+            dialect_insert(_table)
+            .values(
+                svix_id=svix_id,
+                event_type=event_type,
+                clerk_user_id=clerk_user_id,
+                received_at=now,
+                expires_at=now + timedelta(seconds=CLERK_WEBHOOK_DEDUP_SECONDS),
+            )
+            .on_conflict_do_nothing(index_elements=["svix_id"])
+        )
+    accepted = inserted.rowcount == 1
+    _count(**{"accepted" if accepted else "duplicates": 1})
+    return accepted
+
+
+def process_pending_deliveries(limit: int = CLERK_WEBHOOK_BATCH_SIZE) -> int:
+    """Apply one batch of recorded deliveries; returns how many it applied."""
+    now = _utcnow()
+    with db.engine.begin() as conn:
+        rows = conn.execute(
+            select(_table.c.svix_id, _table.c.event_type, _table.c.clerk_user_id)
+            .where(_table.c.processed_at.is_(None))
+            .order_by(_table.c.received_at, _table.c.svix_id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        ).all()
+        if not rows:
+            return 0
+
+        # Oldest first, so the latest event of each user overwrites the rest.
+        latest = {row.clerk_user_id: row.event_type for row in rows}
+        upserts = [uid for uid, event in latest.items() if event != "user.deleted"]
+        deletes = [uid for uid, event in latest.items() if event == "user.deleted"]
+
+        if upserts:
+            conn.execute(
+                dialect_insert(_users)
+                .values([{"auth_user_id": uid} for uid in upserts])
+                .on_conflict_do_nothing(index_elements=["auth_user_id"])
+            )
+        if deletes:
+            conn.execute(
+                update(_users)
+                .where(
+                    _users.c.auth_user_id.in_(deletes), _users.c.deleted_at.is_(None)
+                )
+                .values(deleted_at=now)
+            )
+        conn.execute(
+            update(_table)
+            .where(_table.c.svix_id.in_([row.svix_id for row in rows]))
+            .values(processed_at=now)
+        )
+
+    # After the commit, so a request in this worker cannot re-cache a row as
+    # it was before the batch.
+    for clerk_user_id in latest:
+        invalidate_user(clerk_user_id)
+    _count(batches=1, applied=len(rows))
+    logger.info(
+        "[clerk-webhooks] Applied %d deliveries: %d users upserted, %d deleted",
+        len(rows),
+        len(upserts),
+        len(deletes),
+    )
+    return len(rows)
+
+
+def drain_pending_deliveries() -> int:
+    """Apply batches until none are pending, then prune expired svix-ids."""
+    applied = 0
+    while True:
+        count = process_pending_deliveries()
+        applied += count
+        if count < CLERK_WEBHOOK_BATCH_SIZE:
+            break
+    with db.engine.begin() as conn:
+        conn.execute(
+            delete(_table).where(
+                _table.c.processed_at.is_not(None), _table.c.expires_at < _utcnow()
+            )
+        )
+    return applied
+
+
+def schedule_processing(app: Flask) -> None:
+    """Wake this process's batcher, starting it on first use."""
+    if not CLERK_WEBHOOK_BATCHER_ENABLED:
+        return
+    traceparent = current_traceparent()
+    if traceparent is not None:
+        _pending_links.append(traceparent)
+    _ensure_batcher(app)
+    _wakeup.set()
+
+
+def init_clerk_webhooks(app: Flask) -> None:
+    """Start this process's batcher with its first request, if enabled."""
+    if not CLERK_WEBHOOK_BATCHER_ENABLED:
+        return
+
+    @app.before_request
+    def _start_batcher() -> None:
+        _ensure_batcher(app)
+
+
+def _ensure_batcher(app: Flask) -> None:
+    # Per process: a thread started before a gunicorn fork does not survive
+    # into the workers.
+    global _batcher_pid
+    if _batcher_pid == os.getpid():
+        return
+    with _batcher_lock:
+        if _batcher_pid == os.getpid():
+            return
+        _batcher_pid = os.getpid()
+    threading.Thread(
+        target=_run_batcher, args=(app,), name="clerk-webhook-batcher", daemon=True
+    ).start()
+
+
+def _run_batcher(app: Flask) -> None:
+    while True:
+        links = []
+        while _pending_links:
+            links.append(_pending_links.popleft())
+        # Its own trace, linked to the webhook requests that queued the work.
+        with app.app_context(), span("clerk_webhooks.drain", links=links):
+            try:
+                drain_pending_deliveries()
+            except Exception:
+                # Left pending; the next wakeup or sweep tries the batch again.
+                logger.exception("[clerk-webhooks] Applying deliveries failed")
+        if _wakeup.wait(timeout=CLERK_WEBHOOK_SWEEP_SECONDS):
+            # Let the rest of a burst arrive so it lands in the same batch.
+            time.sleep(CLERK_WEBHOOK_BATCH_LINGER_SECONDS)
+        # Cleared before draining: a delivery recorded while the batch runs
+        # wakes the loop again instead of waiting for the next one.
+        _wakeup.clear()
+
+
+def get_clerk_webhook_counts() -> dict[str, int]:
+    """Snapshot of accepted and duplicate deliveries and applied batches."""
+    with _counts_lock:
+        return {
+            "accepted": _counts["accepted"],
+            "duplicates": _counts["duplicates"],
+            "batches": _counts["batches"],
+            "applied": _counts["applied"],
+        }
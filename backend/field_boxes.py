@@ -0,0 +1,182 @@
+"""
+Compact storage of the analyzer's field bounding boxes.
+
+fields_metadata has a bounding box and PII classification per extracted
+field, four or more entries per line item. It is only needed again for PII
+redaction and field highlighting, so instead of list-of-dicts JSON it is
+stored packed in receipt_field_boxes: a table written once per receipt,
+apart from the user_receipts rows that are edited and replicated to
+zero-cache. It is decoded back into ReceiptFieldsMetadata only when asked
+for (load_fields_metadata).
+
+Layout (little-endian), version 1:
+    header  B version, B flags, H entry count, H name count
+    names   per-record interned names, each H byte length + UTF-8
+    codes   H per entry: index into FIELD_NAMES, or NAME_TABLE_BIT | index
+            into the per-record names
+    items   H per entry: line item index, NO_ITEM for top-level fields
+    boxes   x, y, width, height per entry: H each when every value fits
+            (flags & WIDE_BOXES clear), else I
+    pii     B per entry: IS_PII_BIT | (1 + PII_CATEGORIES index), 0 for
+            no category
+
+Line item fields are interned by template ("line_items.*.name"), so a
+200-item receipt shares four name codes instead of repeating 800 names.
+"""
+
+import re
+import struct
+from typing import Optional
+
+from models import db
+from models.receipt_field_boxes import ReceiptFieldBoxes
+from models.user_receipt import UserReceipt
+from schemas.receipt import (
+    BoundingBox,
+    FieldMetadata,
+    PIICategory,
+    ReceiptFieldsMetadata,
+)
+
+
+FORMAT_VERSION = 1
+
+# Append-only: stored records refer to these by position.
+FIELD_NAMES = (
+    "merchant",
+    "date",
+    "subtotal",
+    "tax",
+    "tip",
+    "gratuity",
+    "total",
+    "payment_method",
+    "line_items.*.name",
+    "line_items.*.quantity",
+    "line_items.*.price_per_item",
+    "line_items.*.total_price",
+    "carrier",
+    "ticket_number",
+    "origin",
+    "destination",
+    "passenger",
+    "class",
+    "fare",
+    "taxes",
+    "currency",
+)
+PII_CATEGORIES = (
+    PIICategory.PAYMENT_CARD_DETAILS,
+    PIICategory.PERSONAL_NAMES,
+    PIICategory.CONTACT_INFO,
+    PIICategory.ACCOUNT_IDENTIFIERS,
+)
+
+NAME_TABLE_BIT = 0x8000
+NO_ITEM = 0xFFFF
+WIDE_BOXES = 0x01
+IS_PII_BIT = 0x80
+
+_HEADER = struct.Struct("<BBHH")
+_FIELD_CODES = {name: code for code, name in enumerate(FIELD_NAMES)}
+_PII_CODES = {category: code for code, category in enumerate(PII_CATEGORIES, 1)}
+_LINE_ITEM_FIELD = re.compile(r"line_items\.(\d+)\.(.+)")
+
+
+def _split_name(field_name: str) -> tuple[str, int]:
+    """(interned template, line item index) of a dot-path field name."""
+    match = _LINE_ITEM_FIELD.fullmatch(field_name)
+    if match and int(match.group(1)) < NO_ITEM:
+        return f"line_items.*.{match.group(2)}", int(match.group(1))
+    return field_name, NO_ITEM
+
+
+def pack_fields_metadata(metadata: ReceiptFieldsMetadata) -> bytes:
+    """Encode fields_metadata in the compact binary layout."""
+    names: dict[str, int] = {}
+    codes, items, boxes, pii = [], [], [], []
+    for entry in metadata.fields:
+        template, item = _split_name(entry.field_name)
+        code = _FIELD_CODES.get(template)
+        if code is None:
+            code = NAME_TABLE_BIT | names.setdefault(template, len(names))
+        codes.append(code)
+        items.append(item)
+        bbox = entry.bbox
+        boxes.extend((bbox.x, bbox.y, bbox.width, bbox.height))
+        pii.append(
+            (IS_PII_BIT if entry.is_pii else 0) | _PII_CODES.get(entry.pii_category, 0)
+        )
+
+    flags = WIDE_BOXES if boxes and max(boxes) > 0xFFFF else 0
+    count = len(codes)
+    parts = [_HEADER.pack(FORMAT_VERSION, flags, count, len(names))]
+    for name in names:
+        encoded = name.encode()
+        parts.append(struct.pack("<H", len(encoded)) + encoded)
+    parts.append(struct.pack(f"<{count}H{count}H", *codes, *items))
+    parts.append(struct.pack(f"<{4 * count}{'I' if flags else 'H'}", *boxes))
+    parts.append(bytes(pii))
+    return b"".join(parts)
+
+
+def unpack_fields_metadata(packed: bytes) -> ReceiptFieldsMetadata:
+    """Decode bytes produced by pack_fields_metadata."""
+    version, flags, count, name_count = _HEADER.unpack_from(packed)
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported field boxes format version {version}")
+    offset = _HEADER.size
+    names = []
+    for _ in range(name_count):
+        (length,) = struct.unpack_from("<H", packed, offset)
+        offset += 2
+        names.append(packed[offset : offset + length].decode())
+        offset += length
+    codes_and_items = struct.unpack_from(f"<{2 * count}H", packed, offset)
+    offset += 4 * count
+    box_format = f"<{4 * count}{'I' if flags & WIDE_BOXES else 'H'}"
+    boxes = struct.unpack_from(box_format, packed, offset)
+    offset += struct.calcsize(box_format)
+    pii = packed[offset : offset + count]
+
+    fields = []
+    for i in range(count):
+        code, item = codes_and_items[i], codes_and_items[count + i]
+        template = (
+            names[code & ~NAME_TABLE_BIT]
+            if code & NAME_TABLE_BIT
+            else FIELD_NAMES[code]
+        )
+        field_name = (
+            template if item == NO_ITEM else template.replace("*", str(item), 1)
+        )
+        category = pii[i] & ~IS_PII_BIT
+        x, y, width, height = boxes[4 * i : 4 * i + 4]
+        fields.append(
+            FieldMetadata(
+                field_name=field_name,
+                bbox=BoundingBox(x=x, y=y, width=width, height=height),
+                is_pii=bool(pii[i] & IS_PII_BIT),
+                pii_category=PII_CATEGORIES[category - 1] if category else None,
+            )
+        )
+    return ReceiptFieldsMetadata(fields=fields)
+
+
+def record_fields_metadata(
+    receipt: UserReceipt, metadata: Optional[ReceiptFieldsMetadata]
+) -> None:
+    """Add the packed metadata row for a receipt to the current session."""
+    if metadata is None or not metadata.fields:
+        return
+    db.session.add(
+        ReceiptFieldBoxes(receipt_id=receipt.id, packed=pack_fields_metadata(metadata))
+    )
+
+
+def load_fields_metadata(receipt_id: int) -> Optional[ReceiptFieldsMetadata]:
+    """Decoded fields_metadata of a receipt, or None if none was stored."""
+    row = db.session.get(ReceiptFieldBoxes, receipt_id)
+    if row is None:
+        return None
+    return unpack_fields_metadata(row.packed)
@@ -12,7 +12,34 @@ itself triggers the Obj-C initialization before any user code runs, so the env v
 already be present when the process is launched.
 """
 
+import os
+import tempfile
+
+
 bind = "localhost:5001"
 workers = 2
 # Gemini API calls with large images can take 30-60s — give generous headroom
 timeout = 120
+
+# Workers write their Prometheus metrics to files in this directory and
+# /metrics sums them (see metrics.py). Set here so it is inherited by every
+# worker before it imports prometheus_client.
+prometheus_multiproc_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR",
+    os.path.join(tempfile.gettempdir(), "splitzy-prometheus"),
+)
+
+
+def on_starting(server):
+    # Files left by a previous run would be added to this run's counters.
+    os.makedirs(prometheus_multiproc_dir, exist_ok=True)
+    for name in os.listdir(prometheus_multiproc_dir):
+        if name.endswith(".db"):
+            os.remove(os.path.join(prometheus_multiproc_dir, name))
+
+
+def child_exit(server, worker):
+    # Drop the exited worker's live gauges (in-flight requests, connections).
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,260 @@
+"""
+Idempotency-Key support for non-idempotent POST endpoints.
+
+The first request carrying a given key records an in-progress marker in
+Postgres. Concurrent duplicates poll that marker for up to
+IDEMPOTENCY_WAIT_SECONDS and then receive 409. Once the first request
+finishes, its response body is stored against the key and replayed verbatim
+to any duplicate until the key expires. Completed responses are also kept in
+an in-process cache so that replays on the same worker skip the database.
+"""
+
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Optional
+
+from cachetools import TTLCache
+from flask import current_app, jsonify
+from sqlalchemy import and_, delete, or_, select, update
+
+from models import db, dialect_insert
+from models.idempotency_key import IdempotencyKey
+
+
+logger = logging.getLogger(__name__)
+
+# How long a completed response is replayed for the same key.
+IDEMPOTENCY_TTL_SECONDS: int = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+
+# How long a concurrent duplicate waits for the first request before a 409.
+IDEMPOTENCY_WAIT_SECONDS: float = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "10"))
+
+# Lease on an in-progress marker. Must exceed the gunicorn worker timeout so
+# that only markers left behind by a killed worker are ever taken over.
+IDEMPOTENCY_LOCK_SECONDS: int = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "180"))
+
+MAX_KEY_LENGTH = 255
+_POLL_INTERVAL_SECONDS = 0.25
+
+_STATUS_IN_PROGRESS = "in_progress"
+_STATUS_COMPLETED = "completed"
+
+_table = IdempotencyKey.__table__
+
+
+@dataclass
+class _StoredResponse:
+    fingerprint: str
+    status: str
+    response_status: Optional[int] = None
+    response_body: Any = None
+
+
+# Completed responses only; in-progress state always lives in the database.
+_completed_cache: TTLCache = TTLCache(maxsize=1024, ttl=IDEMPOTENCY_TTL_SECONDS)
+_cache_lock = threading.Lock()
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _cache_get(scoped_key: str) -> Optional[_StoredResponse]:
+    with _cache_lock:
+        return _completed_cache.get(scoped_key)
+
+
+def _cache_put(scoped_key: str, stored: _StoredResponse) -> None:
+    with _cache_lock:
+        _completed_cache[scoped_key] = stored
+
+
+def _claim(scoped_key: str, fingerprint: str) -> Optional[_StoredResponse]:
+    """
+    Try to record an in-progress marker for *scoped_key*.
+
+    Returns None when this request now owns the key, otherwise the record
+    currently stored for it. Runs in its own short transaction so the marker
+    is visible to other workers immediately.
+    """
+    now = _utcnow()
+    with db.engine.begin() as conn:
+        # Expired keys and abandoned in-progress markers are free to reuse.
+        conn.execute(
+            delete(_table).where(
+                _table.c.key == scoped_key,
+                or_(
+                    _table.c.expires_at < now,
+                    and_(
+                        _table.c.status == _STATUS_IN_PROGRESS,
+                        _table.c.locked_until < now,
+                    ),
+                ),
+            )
+        )
+        inserted = conn.execute(
+            dialect_insert(_table)
+            .values(
+                key=scoped_key,
+                request_fingerprint=fingerprint,
+                status=_STATUS_IN_PROGRESS,
+                created_at=now,
+                locked_until=now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS),
+                expires_at=now + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS),
+            )
+            .on_conflict_do_nothing(index_elements=["key"])
+        )
+        if inserted.rowcount == 1:
+            return None
+
+        row = conn.execute(
+            select(
+                _table.c.request_fingerprint,
+                _table.c.status,
+                _table.c.response_status,
+                _table.c.response_body,
+            ).where(_table.c.key == scoped_key)
+        ).first()
+
+    if row is None:
+        # Deleted between our insert and select; report it as in progress so
+        # the caller polls and claims it on the next attempt.
+        return _StoredResponse(fingerprint=fingerprint, status=_STATUS_IN_PROGRESS)
+    return _StoredResponse(
+        fingerprint=row.request_fingerprint,
+        status=row.status,
+        response_status=row.response_status,
+        response_body=row.response_body,
+    )
+
+
+def _complete(scoped_key: str, response_status: int, response_body: Any) -> None:
+    now = _utcnow()
+    with db.engine.begin() as conn:
+        conn.execute(
+            update(_table)
+            .where(_table.c.key == scoped_key)
+            .values(
+                status=_STATUS_COMPLETED,
+                response_status=response_status,
+                response_body=response_body,
+                expires_at=now + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS),
+            )
+        )
+
+
+def _release(scoped_key: str) -> None:
+    """Drop an in-progress marker so a client retry re-executes the request."""
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(
+                delete(_table).where(
+                    _table.c.key == scoped_key,
+                    _table.c.status == _STATUS_IN_PROGRESS,
+                )
+            )
+    except Exception:
+        # The lease expires on its own; never mask the original error.
+        logger.exception("[idempotency] Failed to release key %s", scoped_key)
+
+
+def _replay(stored: _StoredResponse):
+    response = jsonify(stored.response_body)
+    response.status_code = stored.response_status or 200
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+def run_idempotent(
+    idempotency_key: str,
+    scope: str,
+    fingerprint: str,
+    handler: Callable[[], Any],
+):
+    """
+    Execute *handler* at most once per (scope, idempotency_key).
+
+    Args:
+        idempotency_key: Raw Idempotency-Key header value from the client
+        scope: Namespace for the key, normally the authenticated user id
+        fingerprint: Hash of the request payload
+        handler: Zero-argument callable returning a Flask view result
+    Returns a Flask response: the handler's own, a replay of a stored one,
+    or a 409/422/400 error describing why the request was not executed.
+    """
+    idempotency_key = idempotency_key.strip()
+    if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+        return jsonify(
+            {
+                "success": False,
+                "error": f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters",
+            }
+        ), 400
+
+    scoped_key = f"{scope}:{idempotency_key}"
+
+    stored = _cache_get(scoped_key)
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    while stored is None or stored.status != _STATUS_COMPLETED:
+        stored = _claim(scoped_key, fingerprint)
+        if stored is None:
+            break  # we own the key
+        if stored.fingerprint != fingerprint:
+            break
+        if stored.status == _STATUS_COMPLETED:
+            _cache_put(scoped_key, stored)
+            break
+        if time.monotonic() >= deadline:
+            current_app.logger.info(
+                "[idempotency] Key %s still in progress after %.1fs; returning 409",
+                scoped_key,
+                IDEMPOTENCY_WAIT_SECONDS,
+            )
+            return jsonify(
+                {
+                    "success": False,
+                    "error": "A request with this Idempotency-Key is in progress",
+                }
+            ), 409
+        time.sleep(_POLL_INTERVAL_SECONDS)
+
+    if stored is not None:
+        if stored.fingerprint != fingerprint:
+            return jsonify(
+                {
+                    "success": False,
+                    "error": "Idempotency-Key was used with a different request",
+                }
+            ), 422
+        current_app.logger.info(
+            "[idempotency] Replaying stored response for %s", scoped_key
+        )
+        return _replay(stored)
+
+    try:
+        response = current_app.make_response(handler())
+    except Exception:
+        _release(scoped_key)
+        raise
+
+    if response.status_code >= 500:
+        # Server-side failures are retryable; do not pin them to the key.
+        _release(scoped_key)
+        return response
+
+    body = response.get_json(silent=True)
+    _complete(scoped_key, response.status_code, body)
+    _cache_put(
+        scoped_key,
+        _StoredResponse(
+            fingerprint=fingerprint,
+            status=_STATUS_COMPLETED,
+            response_status=response.status_code,
+            response_body=body,
+        ),
+    )
+    return response
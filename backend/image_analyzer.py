@@ -1,15 +1,29 @@
+import io
 import json
 import logging
 import os
 import re
-from dataclasses import dataclass, field
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, replace
 from decimal import Decimal
 from pathlib import Path
 from typing import Optional
 
 import google.generativeai as genai
 from dotenv import load_dotenv
-
+from PIL import Image
+from pydantic import TypeAdapter
+
+from metrics import record_gemini_usage, record_reconciliation
+from pdf_receipts import count_pages, is_pdf, submit_page_renders
+from receipt_crop import RECEIPT_AUTO_CROP_ENABLED, crop_receipt
+from receipt_tiling import (
+    RECEIPT_TILING_ENABLED,
+    Segment,
+    merge_segment_payloads,
+    split_tall_image,
+)
+from schemas.money import from_cents, to_cents
 from schemas.receipt import (
     FieldMetadata,
     NotAReceipt,
@@ -17,6 +31,8 @@ from schemas.receipt import (
     RegularReceipt,
     TransportationTicket,
 )
+from server_timing import timed
+from tracing import in_current_context, span
 
 
 # Set up module-level logger
@@ -31,6 +47,10 @@ _is_dev = os.environ.get("VERCEL_ENV", "production") != "production"
 # per-line rounding on receipts that independently round unit×qty.
 RECONCILIATION_TOLERANCE = Decimal("0.05")
 
+# Built once; validates one fields_metadata entry at a time so that invalid
+# entries can be dropped individually.
+_FIELD_METADATA_ADAPTER = TypeAdapter(FieldMetadata)
+
 
 @dataclass
 class _SuspectItem:
@@ -71,6 +91,8 @@ load_dotenv(env_path)
 # hints. Disable during incident response without a code deploy.
 RECEIPT_RETRY_ON_MISMATCH: bool = os.getenv("RECEIPT_RETRY_ON_MISMATCH", "true").strip().lower() in ("1", "true", "yes")
 
+GEMINI_MODEL_NAME = "models/gemini-2.5-flash-lite"
+
 # Module-level flag to track if configuration has been done
 _configured = False
 
@@ -124,6 +146,8 @@ class ImageAnalyzer:
         """
         try:
             return self._analyze_image_with_gemini(image_data_or_path, mime_type)
+        except ImageAnalysisError:
+            raise
         except (FileNotFoundError, json.JSONDecodeError, ValueError) as e:
             # Handle expected exceptions with specific error messages
             logger.error(f"Image analysis failed: {str(e)}")
@@ -147,8 +171,35 @@ class ImageAnalyzer:
             with open(image_data_or_path, "rb") as image_file:
                 image_data = image_file.read()
 
+        if is_pdf(image_data, mime_type):
+            return self._analyze_pdf(image_data)
+
+        image_label = (
+            image_data_or_path if isinstance(image_data_or_path, str) else "<bytes>"
+        )
+        if RECEIPT_AUTO_CROP_ENABLED:
+            cropped = crop_receipt(image_data)
+            if cropped is not None:
+                # Bounding boxes come back relative to the crop; map them onto
+                # the uploaded photo.
+                return cropped.map_to_original(
+                    self._analyze_receipt_image(
+                        cropped.data, cropped.mime_type, image_label
+                    )
+                )
+        return self._analyze_receipt_image(image_data, mime_type, image_label)
+
+    def _analyze_receipt_image(self, image_data, mime_type, image_label):
+        """Analyze one image: in segments when it is tall, else in a single call."""
+        if RECEIPT_TILING_ENABLED:
+            segments = split_tall_image(image_data)
+            if segments:
+                tiled_model = self._analyze_tall_receipt(segments)
+                if tiled_model is not None:
+                    return tiled_model
+
         # Create the model
-        model = genai.GenerativeModel("models/gemini-2.5-flash-lite")
+        model = genai.GenerativeModel(GEMINI_MODEL_NAME)
 
         # --- First pass ---
         content_parts = [
@@ -156,7 +207,10 @@ class ImageAnalyzer:
             "Analyze this image and extract all relevant payment information. This might be a receipt, invoice, or transportation ticket. Pay special attention to any monetary amounts shown.",
             {"mime_type": mime_type, "data": image_data},
         ]
-        response = model.generate_content(content_parts)
+        with timed("gemini", "Gemini first pass"):
+            response = self._generate(
+                model, content_parts, "first_pass", len(image_data)
+            )
 
         logger.debug("[analyzer] Gemini response length: %d", len(response.text))
         if _is_dev:
@@ -177,6 +231,7 @@ class ImageAnalyzer:
                     reconciliation.delta,
                     getattr(receipt_model, "merchant", None),
                 )
+                record_reconciliation("retried")
                 try:
                     retry_parts = [
                         self._get_system_prompt(),
@@ -184,7 +239,16 @@ class ImageAnalyzer:
                         {"mime_type": mime_type, "data": image_data},
                         retry_hint,
                     ]
-                    retry_response = model.generate_content(retry_parts)
+                    with timed("gemini-retry", "Gemini retry"):
+                        retry_response = self._generate(
+                            model,
+                            retry_parts,
+                            "retry",
+                            len(image_data),
+                            retry_reason=(
+                                f"totals mismatch (delta={reconciliation.delta})"
+                            ),
+                        )
                     logger.debug(
                         "[analyzer] Retry Gemini response length: %d",
                         len(retry_response.text),
@@ -197,8 +261,10 @@ class ImageAnalyzer:
                                 "[analyzer] Reconciled on retry. merchant=%s",
                                 getattr(retry_model, "merchant", None),
                             )
+                            record_reconciliation("reconciled_on_retry")
                             return retry_model
                         else:
+                            record_reconciliation("unreconciled")
                             logger.error(
                                 "[analyzer] Unreconciled after retry (delta=%s); "
                                 "falling back to first response. merchant=%s",
@@ -213,27 +279,256 @@ class ImageAnalyzer:
                             retry_model.__class__.__name__,
                             receipt_model.__class__.__name__,
                             getattr(retry_model, "merchant", None),
-                            image_data_or_path
-                            if isinstance(image_data_or_path, str)
-                            else "<bytes>",
+                            image_label,
                         )
                         return retry_model
                 except Exception as retry_err:
+                    record_reconciliation("unreconciled")
                     logger.error(
                         "[analyzer] Retry response processing failed: %s; "
                         "falling back to first response.",
                         retry_err,
                     )
-            elif _is_dev:
-                logger.debug(
-                    "[analyzer] Totals reconciled (items_sum=%s, subtotal=%s). merchant=%s",
-                    reconciliation.items_sum,
-                    reconciliation.printed_subtotal,
-                    getattr(receipt_model, "merchant", None),
+            else:
+                record_reconciliation("ok")
+                if _is_dev:
+                    logger.debug(
+                        "[analyzer] Totals reconciled (items_sum=%s, subtotal=%s). merchant=%s",
+                        reconciliation.items_sum,
+                        reconciliation.printed_subtotal,
+                        getattr(receipt_model, "merchant", None),
+                    )
+
+        return receipt_model
+
+    def _analyze_tall_receipt(self, segments: list[Segment]):
+        """
+        Analyze the segments of a tall receipt concurrently and merge them.
+        Returns a RegularReceipt, or None when the caller should fall back to
+        analyzing the whole image (a segment failed, nothing was extracted, or
+        the merged receipt does not reconcile).
+        """
+        with ThreadPoolExecutor(
+            max_workers=len(segments), thread_name_prefix="receipt-segment"
+        ) as executor:
+            futures = [
+                executor.submit(
+                    in_current_context(self._analyze_segment),
+                    segment,
+                    self._get_segment_prompt(segment.index, len(segments)),
+                )
+                for segment in segments
+            ]
+            try:
+                payloads = [future.result() for future in futures]
+            except Exception as e:
+                logger.warning(
+                    "[analyzer] Segment analysis failed (%s); analyzing whole image",
+                    e,
                 )
+                return None
 
+        merged = merge_segment_payloads(segments, payloads)
+        if merged is None:
+            logger.warning(
+                "[analyzer] No line items found in %d segments; analyzing whole image",
+                len(segments),
+            )
+            return None
+
+        receipt_model = self._with_structured_output(json.dumps(merged))
+        if not hasattr(receipt_model, "line_items"):
+            return None
+
+        reconciliation = self._validate_totals(receipt_model)
+        if not reconciliation.ok and RECEIPT_RETRY_ON_MISMATCH:
+            logger.warning(
+                "[analyzer] Merged segments do not reconcile (delta=%s); "
+                "analyzing whole image. merchant=%s",
+                reconciliation.delta,
+                getattr(receipt_model, "merchant", None),
+            )
+            return None
+
+        record_reconciliation("ok" if reconciliation.ok else "unreconciled")
+        logger.info(
+            "[analyzer] Analyzed tall receipt in %d segments (%d line items). "
+            "merchant=%s",
+            len(segments),
+            len(receipt_model.line_items),
+            getattr(receipt_model, "merchant", None),
+        )
         return receipt_model
 
+    def _analyze_pdf(self, pdf_data: bytes):
+        """
+        Analyze a PDF receipt or invoice page by page and merge the pages.
+        Each page's model call starts as soon as that page has been rendered.
+        Bounding boxes of a multi-page PDF are in the coordinates of the
+        rendered pages stacked top to bottom.
+        """
+        page_count = count_pages(pdf_data)
+        render_futures = submit_page_renders(pdf_data, page_count)
+
+        if page_count == 1:
+            try:
+                page_data = render_futures[0].result()
+            except Exception as e:
+                raise ImageAnalysisError(f"PDF page could not be rendered: {e}") from e
+            # A single page is just an image: keep tiling and the totals retry.
+            return self._analyze_image_with_gemini(page_data, "image/jpeg")
+
+        with ThreadPoolExecutor(
+            max_workers=page_count, thread_name_prefix="receipt-page"
+        ) as executor:
+            futures = [
+                executor.submit(
+                    in_current_context(self._analyze_pdf_page),
+                    render_future,
+                    page_index,
+                    page_count,
+                )
+                for page_index, render_future in enumerate(render_futures)
+            ]
+            try:
+                pages = [future.result() for future in futures]
+            except Exception as e:
+                # A page that failed to render or to analyze fails the PDF:
+                # a merge without it would silently drop its line items.
+                logger.warning("[analyzer] PDF page analysis failed: %s", e)
+                raise ImageAnalysisError(f"PDF page analysis failed: {e}") from e
+
+        segments = []
+        top = 0
+        for segment, _ in pages:
+            segments.append(replace(segment, top=top, bottom=top + segment.bottom))
+            top += segment.bottom
+        payloads = [payload for _, payload in pages]
+
+        merged = merge_segment_payloads(segments, payloads, dedupe_overlap=False)
+        if merged is None:
+            # Nothing itemized on any page; let the first page decide the type.
+            return self._with_structured_output(json.dumps(payloads[0]))
+
+        receipt_model = self._with_structured_output(json.dumps(merged))
+        reconciliation = self._validate_totals(receipt_model)
+        record_reconciliation("ok" if reconciliation.ok else "unreconciled")
+        if not reconciliation.ok:
+            logger.warning(
+                "[analyzer] Merged PDF pages do not reconcile (delta=%s). merchant=%s",
+                reconciliation.delta,
+                getattr(receipt_model, "merchant", None),
+            )
+        logger.info(
+            "[analyzer] Analyzed %d-page PDF (%d line items). merchant=%s",
+            page_count,
+            len(receipt_model.line_items),
+            getattr(receipt_model, "merchant", None),
+        )
+        return receipt_model
+
+    def _analyze_pdf_page(
+        self, render_future: Future, page_index: int, page_count: int
+    ) -> tuple[Segment, dict]:
+        """Wait for one page to render, then analyze it."""
+        page_data = render_future.result()
+        with Image.open(io.BytesIO(page_data)) as page_image:
+            height = page_image.height
+        segment = Segment(index=page_index, top=0, bottom=height, data=page_data)
+        payload = self._analyze_segment(
+            segment, self._get_page_prompt(page_index, page_count)
+        )
+        return segment, payload
+
+    def _analyze_segment(self, segment: Segment, instructions: str) -> dict:
+        """Run one Gemini call on a receipt segment and return its raw JSON."""
+        model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+        response = self._generate(
+            model,
+            [
+                self._get_system_prompt(),
+                instructions,
+                {"mime_type": segment.mime_type, "data": segment.data},
+            ],
+            "segment",
+            len(segment.data),
+        )
+        logger.debug(
+            "[analyzer] Segment %d response length: %d",
+            segment.index,
+            len(response.text),
+        )
+        analysis_text = self._strip_markdown_fences(response.text)
+        try:
+            payload = json.loads(analysis_text)
+        except json.JSONDecodeError:
+            json_match = re.search(r"\{.*\}", analysis_text, re.DOTALL)
+            if not json_match:
+                raise
+            payload = json.loads(json_match.group())
+        if not isinstance(payload, dict):
+            raise ValueError("Segment response is not a JSON object")
+        return payload
+
+    def _generate(
+        self,
+        model,
+        content_parts: list,
+        call: str,
+        image_bytes: int,
+        retry_reason: Optional[str] = None,
+    ):
+        """One generate_content call, traced and counted in the token metrics."""
+        attributes = {
+            "gen_ai.request.model": GEMINI_MODEL_NAME,
+            "gemini.call": call,
+            "gemini.image_bytes": image_bytes,
+        }
+        if retry_reason is not None:
+            attributes["gemini.retry_reason"] = retry_reason
+        with span("gemini.generate_content", **attributes) as call_span:
+            response = model.generate_content(content_parts)
+            usage = getattr(response, "usage_metadata", None)
+            if call_span is not None and usage is not None:
+                for kind in ("prompt", "candidates", "total"):
+                    count = getattr(usage, f"{kind}_token_count", None)
+                    if isinstance(count, int):
+                        call_span.set_attribute(f"gemini.tokens.{kind}", count)
+        record_gemini_usage(response, call)
+        return response
+
+    def _get_segment_prompt(self, index: int, count: int) -> str:
+        """Instructions for analyzing one segment of a tiled tall receipt"""
+        return f"""
+        This image is segment {index + 1} of {count} of ONE long receipt that was
+        cut into overlapping horizontal strips, from top to bottom. Use the JSON
+        format described above, with these differences:
+        - Always set "is_receipt" to true and treat it as a regular receipt, even
+          if this segment shows no merchant or totals.
+        - Extract only line items whose text is fully visible in this segment.
+          Skip any line cut off at the top or bottom edge; the neighbouring
+          segment contains it.
+        - Report merchant, date, payment_method, subtotal, tax, tip, gratuity and
+          total only if they are printed in this segment. Otherwise use null. Do
+          not compute or estimate them from the line items.
+        - Bounding boxes are relative to this segment image.
+        """
+
+    def _get_page_prompt(self, index: int, count: int) -> str:
+        """Instructions for analyzing one page of a multi-page PDF"""
+        return f"""
+        This image is page {index + 1} of {count} of ONE multi-page PDF document,
+        such as a long receipt or an invoice. Use the JSON format described above,
+        with these differences:
+        - Decide "is_receipt" for the document as a whole; a continuation page of
+          a receipt or invoice is still a receipt.
+        - Extract only the line items printed on this page.
+        - Report merchant, date, payment_method, subtotal, tax, tip, gratuity and
+          total only if they are printed on this page. Otherwise use null. Do not
+          compute or estimate them from the line items.
+        - Bounding boxes are relative to this page image.
+        """
+
     def _validate_totals(self, receipt_model) -> "_ReconciliationResult":
         """
         Compare sum(line_item.total_price) against the printed subtotal.
@@ -243,20 +538,20 @@ class ImageAnalyzer:
         suspect line item responsible for the mismatch.
         """
         line_items = getattr(receipt_model, "line_items", [])
-        items_sum = sum(
-            (Decimal(str(item.total_price)) for item in line_items), Decimal("0")
-        ).quantize(Decimal("0.01"))
+        # Compared in integer cents; Decimal only for the result.
+        items_cents = sum(to_cents(item.total_price) for item in line_items)
 
         # Use the printed subtotal as the oracle. Fall back to total if absent.
         _subtotal = getattr(receipt_model, "subtotal", None)
         _total = getattr(receipt_model, "total", None)
-        printed_subtotal = Decimal(
-            str(_subtotal if _subtotal is not None else (_total if _total is not None else 0))
-        ).quantize(Decimal("0.01"))
+        printed_cents = to_cents(_subtotal if _subtotal is not None else _total)
 
-        delta = (items_sum - printed_subtotal).copy_abs()
+        delta_cents = abs(items_cents - printed_cents)
+        items_sum = from_cents(items_cents)
+        printed_subtotal = from_cents(printed_cents)
+        delta = from_cents(delta_cents)
 
-        if delta <= RECONCILIATION_TOLERANCE:
+        if delta_cents <= to_cents(RECONCILIATION_TOLERANCE):
             return _ReconciliationResult(
                 ok=True, items_sum=items_sum, printed_subtotal=printed_subtotal, delta=delta
             )
@@ -277,16 +572,19 @@ class ImageAnalyzer:
         suspect: Optional[_SuspectItem] = None
         for item in line_items:
             qty = item.quantity
-            unit = Decimal(str(item.price_per_item)).quantize(Decimal("0.01"))
-            total = Decimal(str(item.total_price)).quantize(Decimal("0.01"))
+            if qty <= 1:
+                continue
+            unit = to_cents(item.price_per_item)
             # Classic misread: unit price was used as total, so total = qty * unit
             # instead of the printed value. Extra amount = (qty - 1) * unit.
-            if qty > 1 and (Decimal(str(qty - 1)) * unit - delta).copy_abs() <= Decimal("0.02"):
-                suspect = _SuspectItem(name=item.name, qty=qty, unit_price=unit, total_price=total)
-                break
             # Alternate: the item is wholly spurious — qty × unit equals the full delta.
-            if qty > 1 and (Decimal(str(qty)) * unit - delta).copy_abs() <= Decimal("0.02"):
-                suspect = _SuspectItem(name=item.name, qty=qty, unit_price=unit, total_price=total)
+            if abs(unit * (qty - 1) - delta_cents) <= 2 or abs(unit * qty - delta_cents) <= 2:
+                suspect = _SuspectItem(
+                    name=item.name,
+                    qty=qty,
+                    unit_price=from_cents(unit),
+                    total_price=from_cents(to_cents(item.total_price)),
+                )
                 break
 
         return _ReconciliationResult(
@@ -333,6 +631,7 @@ class ImageAnalyzer:
         ]
         return "\n".join(lines)
 
+    @span("receipt.validate")
     def _with_structured_output(self, analysis_text: str):
         """
         Validate and structure the AI response using Pydantic models
@@ -455,10 +754,12 @@ class ImageAnalyzer:
 
     def _wrap_fields_metadata(self, json_response: dict) -> None:
         """
-        Convert a raw fields_metadata list from the Gemini response into the
-        nested ReceiptFieldsMetadata shape that Pydantic expects.
-        Mutates json_response in place. Silently clears the key on any parse
-        error so that core receipt extraction is never blocked by metadata issues.
+        Convert a raw fields_metadata list from the Gemini response into a
+        validated ReceiptFieldsMetadata.
+        Mutates json_response in place. Invalid entries are dropped and the key
+        is cleared when none remain, so that core receipt extraction is never
+        blocked by metadata issues. Each entry is validated exactly once; the
+        receipt model reuses the validated instance instead of re-parsing it.
         """
         raw = json_response.get("fields_metadata")
         if not raw:
@@ -471,25 +772,42 @@ class ImageAnalyzer:
                 pass  # already the expected shape
             else:
                 logger.warning(
-                    "fields_metadata is a dict without a 'fields' list; wrapping as single element"
+                    "fields_metadata is a dict without a 'fields' list; "
+                    "wrapping as single element"
                 )
                 json_response["fields_metadata"] = {"fields": [raw]}
         else:
-            logger.warning("fields_metadata has an unrecognised shape; ignoring metadata")
+            logger.warning(
+                "fields_metadata has an unrecognised shape; ignoring metadata"
+            )
             json_response.pop("fields_metadata", None)
             return
         valid_fields = []
         for entry in json_response["fields_metadata"]["fields"]:
             try:
-                if isinstance(entry, dict) and entry.get("field_name", "").startswith("items."):
-                    entry = {**entry, "field_name": "line_items." + entry["field_name"][len("items."):]}
-                FieldMetadata.model_validate(entry)
-                valid_fields.append(entry)
+                if isinstance(entry, dict) and entry.get("field_name", "").startswith(
+                    "items."
+                ):
+                    entry = {
+                        **entry,
+                        "field_name": "line_items."
+                        + entry["field_name"][len("items.") :],
+                    }
+                valid_fields.append(_FIELD_METADATA_ADAPTER.validate_python(entry))
             except Exception as e:
-                field_name = entry.get("field_name", "<unknown>") if isinstance(entry, dict) else "<non-dict>"
-                logger.warning("Dropping invalid fields_metadata entry field_name=%r: %s", field_name, e)
+                if not isinstance(entry, dict):
+                    field_name = "<non-dict>"
+                else:
+                    field_name = entry.get("field_name", "<unknown>")
+                logger.warning(
+                    "Dropping invalid fields_metadata entry field_name=%r: %s",
+                    field_name,
+                    e,
+                )
         if valid_fields:
-            json_response["fields_metadata"] = {"fields": valid_fields}
+            json_response["fields_metadata"] = ReceiptFieldsMetadata.model_construct(
+                fields=valid_fields
+            )
         else:
             logger.warning("No valid fields_metadata entries; ignoring metadata")
             json_response.pop("fields_metadata", None)
@@ -668,21 +986,11 @@ class ImageAnalyzer:
         ]
         """
 
+    @timed("parse", "Response parsing")
     def _process_response(self, analysis_text):
         """Process and validate the AI response using structured output"""
         try:
-            # Check if response is wrapped in markdown code blocks
-            if analysis_text.strip().startswith("```") and "```" in analysis_text:
-                parts = analysis_text.split("```", 2)
-                if len(parts) >= 3:
-                    potential_json = parts[1]
-                    if "\n" in potential_json:
-                        potential_json = potential_json.split("\n", 1)[1]
-                    analysis_text = potential_json.strip()
-                else:
-                    match = re.search(r"```(?:json)?\s*([\s\S]*?)\s*```", analysis_text)
-                    if match:
-                        analysis_text = match.group(1).strip()
+            analysis_text = self._strip_markdown_fences(analysis_text)
 
             # Use structured output validation
             return self._with_structured_output(analysis_text)
@@ -690,3 +998,17 @@ class ImageAnalyzer:
         except Exception as e:
             logger.error(f"Error processing response: {str(e)}")
             raise ImageAnalysisError(f"Error processing response: {str(e)}") from e
+
+    def _strip_markdown_fences(self, analysis_text):
+        """Unwrap a response wrapped in markdown code blocks"""
+        if analysis_text.strip().startswith("```") and "```" in analysis_text:
+            parts = analysis_text.split("```", 2)
+            if len(parts) >= 3:
+                potential_json = parts[1]
+                if "\n" in potential_json:
+                    potential_json = potential_json.split("\n", 1)[1]
+                return potential_json.strip()
+            match = re.search(r"```(?:json)?\s*([\s\S]*?)\s*```", analysis_text)
+            if match:
+                return match.group(1).strip()
+        return analysis_text
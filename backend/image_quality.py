@@ -0,0 +1,203 @@
+"""
+Fast local quality gate for receipt photos.
+
+Blurry, dark or blank photos are caught before they cost a Gemini call. The
+checks run with NumPy on a small grayscale thumbnail and take a few
+milliseconds:
+
+- sharpness: variance of the Laplacian (low variance means blur)
+- exposure: share of near-black and near-white pixels in the luminance
+  histogram
+- edge density: share of pixels with a strong gradient (a blank page or a
+  table top has almost none, printed text has many)
+
+RECEIPT_QUALITY_GATE selects what happens to a failing image: "reject"
+returns 422 to the client, "warn" only logs, "off" skips the checks. Every
+failed check is counted in splitzy_image_quality_failures_total{check,mode},
+in both "warn" and "reject" modes, so thresholds can be tuned from /metrics
+before turning on rejection. An image over Pillow's decompression-bomb limit
+is rejected as unreadable in "warn" mode too, before anything decodes it.
+"""
+
+import io
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from metrics import record_image_quality_failure
+
+
+logger = logging.getLogger(__name__)
+
+QUALITY_GATE_OFF = "off"
+QUALITY_GATE_WARN = "warn"
+QUALITY_GATE_REJECT = "reject"
+
+RECEIPT_QUALITY_GATE: str = os.getenv("RECEIPT_QUALITY_GATE", "warn").strip().lower()
+
+# Longest side of the thumbnail the checks run on.
+RECEIPT_QUALITY_THUMBNAIL_SIZE: int = int(
+    os.getenv("RECEIPT_QUALITY_THUMBNAIL_SIZE", "512")
+)
+
+# Minimum variance of the Laplacian on the thumbnail.
+RECEIPT_QUALITY_MIN_SHARPNESS: float = float(
+    os.getenv("RECEIPT_QUALITY_MIN_SHARPNESS", "40")
+)
+
+# Maximum share of pixels darker than 40/255 (underexposed).
+RECEIPT_QUALITY_MAX_DARK_FRACTION: float = float(
+    os.getenv("RECEIPT_QUALITY_MAX_DARK_FRACTION", "0.85")
+)
+
+# Maximum share of pixels brighter than 245/255 (overexposed or blank).
+RECEIPT_QUALITY_MAX_BRIGHT_FRACTION: float = float(
+    os.getenv("RECEIPT_QUALITY_MAX_BRIGHT_FRACTION", "0.95")
+)
+
+# Minimum share of pixels on a strong edge.
+RECEIPT_QUALITY_MIN_EDGE_DENSITY: float = float(
+    os.getenv("RECEIPT_QUALITY_MIN_EDGE_DENSITY", "0.01")
+)
+
+_DARK_LEVEL = 40
+_BRIGHT_LEVEL = 245
+_EDGE_GRADIENT = 16.0
+
+REASON_BLURRY = "blurry"
+REASON_TOO_DARK = "too_dark"
+REASON_OVEREXPOSED = "overexposed"
+REASON_NO_CONTENT = "no_content"
+REASON_UNREADABLE = "unreadable"
+
+_REASON_MESSAGES = {
+    REASON_BLURRY: "The photo is too blurry to read",
+    REASON_TOO_DARK: "The photo is too dark",
+    REASON_OVEREXPOSED: "The photo is overexposed or blank",
+    REASON_NO_CONTENT: "No printed text was found in the photo",
+    REASON_UNREADABLE: "The image is too large to read",
+}
+
+
+@dataclass
+class QualityReport:
+    """Result of the quality checks on one image."""
+
+    sharpness: float = 0.0
+    dark_fraction: float = 0.0
+    bright_fraction: float = 0.0
+    edge_density: float = 0.0
+    reasons: list[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.reasons
+
+    @property
+    def messages(self) -> list[str]:
+        return [_REASON_MESSAGES[reason] for reason in self.reasons]
+
+
+def _load_thumbnail(image_data: bytes) -> Optional[np.ndarray]:
+    """Decode *image_data* into a small float32 luminance array."""
+    try:
+        with Image.open(io.BytesIO(image_data)) as image:
+            size = (RECEIPT_QUALITY_THUMBNAIL_SIZE, RECEIPT_QUALITY_THUMBNAIL_SIZE)
+            # For JPEG, let the decoder downscale by 1/2..1/8 while decoding.
+            image.draft("L", size)
+            image = ImageOps.exif_transpose(image).convert("L")
+            image.thumbnail(size)
+            return np.asarray(image, dtype=np.float32)
+    except (UnidentifiedImageError, OSError, ValueError):
+        return None
+
+
+def _laplacian_variance(gray: np.ndarray) -> float:
+    laplacian = (
+        gray[:-2, 1:-1]
+        + gray[2:, 1:-1]
+        + gray[1:-1, :-2]
+        + gray[1:-1, 2:]
+        - 4.0 * gray[1:-1, 1:-1]
+    )
+    return float(laplacian.var())
+
+
+def _edge_density(gray: np.ndarray) -> float:
+    dx = np.abs(gray[1:-1, 2:] - gray[1:-1, :-2])
+    dy = np.abs(gray[2:, 1:-1] - gray[:-2, 1:-1])
+    return float(np.count_nonzero((dx + dy) > _EDGE_GRADIENT) / dx.size)
+
+
+def assess_image(image_data: bytes) -> Optional[QualityReport]:
+    """
+    Run the quality checks on an image.
+    Returns None when the data cannot be decoded as an image (e.g. a PDF);
+    such uploads are left to the analyzer. An image over Pillow's pixel limit
+    (a decompression bomb) fails as unreadable.
+    """
+    try:
+        gray = _load_thumbnail(image_data)
+    except Image.DecompressionBombError:
+        return QualityReport(reasons=[REASON_UNREADABLE])
+    if gray is None or min(gray.shape) < 3:
+        return None
+
+    histogram = np.bincount(gray.astype(np.uint8).ravel(), minlength=256)
+    total = float(gray.size)
+    report = QualityReport(
+        sharpness=_laplacian_variance(gray),
+        dark_fraction=float(histogram[:_DARK_LEVEL].sum() / total),
+        bright_fraction=float(histogram[_BRIGHT_LEVEL + 1 :].sum() / total),
+        edge_density=_edge_density(gray),
+    )
+
+    if report.dark_fraction > RECEIPT_QUALITY_MAX_DARK_FRACTION:
+        report.reasons.append(REASON_TOO_DARK)
+    if report.bright_fraction > RECEIPT_QUALITY_MAX_BRIGHT_FRACTION:
+        report.reasons.append(REASON_OVEREXPOSED)
+    if report.edge_density < RECEIPT_QUALITY_MIN_EDGE_DENSITY:
+        report.reasons.append(REASON_NO_CONTENT)
+    elif report.sharpness < RECEIPT_QUALITY_MIN_SHARPNESS:
+        # A blank image has no edges and therefore no sharpness either; only
+        # call it blurry when there is content to be blurry.
+        report.reasons.append(REASON_BLURRY)
+    return report
+
+
+def check_image_quality(image_data: bytes) -> Optional[QualityReport]:
+    """
+    Apply the configured quality gate to an uploaded image.
+
+    Returns the failing report when the upload should be rejected, otherwise
+    None. Failures are counted and logged in both "warn" and "reject" modes;
+    an unreadable image is rejected in both.
+    """
+    if RECEIPT_QUALITY_GATE == QUALITY_GATE_OFF:
+        return None
+
+    report = assess_image(image_data)
+    if report is None or report.ok:
+        return None
+
+    for reason in report.reasons:
+        record_image_quality_failure(reason, RECEIPT_QUALITY_GATE)
+
+    logger.info(
+        "[quality] mode=%s reasons=%s sharpness=%.1f dark=%.3f bright=%.3f edges=%.4f",
+        RECEIPT_QUALITY_GATE,
+        ",".join(report.reasons),
+        report.sharpness,
+        report.dark_fraction,
+        report.bright_fraction,
+        report.edge_density,
+    )
+    if RECEIPT_QUALITY_GATE == QUALITY_GATE_REJECT or (
+        REASON_UNREADABLE in report.reasons
+    ):
+        return report
+    return None
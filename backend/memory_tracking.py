@@ -0,0 +1,216 @@
+"""
+Memory instrumentation for image-heavy requests.
+
+An analyzed upload is held as bytes, copied into the blob upload's
+multipart body and base64-encoded into every Gemini request, so one photo
+can cost several times its size. Two tools show where that goes.
+
+Allocation tracking (MEMORY_TRACKING_ENABLED, off by default) starts
+tracemalloc and measures, for every request and every server_timing phase
+in it (blob, analyze, gemini, db, ...), the peak of Python allocations above
+the level the phase started at. The peaks are logged at INFO and observed in
+the splitzy_phase_peak_memory_bytes histogram, with "request" for the whole
+request. tracemalloc traces the whole process, so a phase includes the
+analysis threads it waits on, and peaks are per request only under
+gunicorn's sync workers, which serve one request at a time. Tracing slows
+allocation-heavy code down: enable it to size workers, not permanently.
+
+The RSS watchdog is always on. It reads the worker's peak RSS (getrusage
+ru_maxrss) before and after each request: a request that raised it is one
+that grew the worker. Growth of MEMORY_RSS_GROWTH_MB or more is logged
+with the route and upload size and kept in recent_rss_growth(). All growth
+is counted per route in splitzy_rss_growth_bytes_total. When the worker's
+peak passes MEMORY_RSS_LIMIT_MB, the requests that grew it most are logged
+once.
+"""
+
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from flask import Flask, Response, g, has_request_context, request
+
+from metrics import observe_phase_memory, record_rss
+
+
+logger = logging.getLogger(__name__)
+
+# Trace Python allocations and report peak memory per request phase.
+MEMORY_TRACKING_ENABLED: bool = os.getenv(
+    "MEMORY_TRACKING_ENABLED", "false"
+).strip().lower() in ("1", "true", "yes")
+
+# Peak RSS growth in one request that is logged and kept as an event.
+MEMORY_RSS_GROWTH_MB: float = float(os.getenv("MEMORY_RSS_GROWTH_MB", "5"))
+
+# Worker peak RSS above which the largest growth events are logged; 0 never.
+MEMORY_RSS_LIMIT_MB: float = float(os.getenv("MEMORY_RSS_LIMIT_MB", "0"))
+
+_MB = 1024 * 1024
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+_MAXRSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+_recent_growth: deque = deque(maxlen=50)
+_growth_lock = threading.Lock()
+_limit_reported = False
+
+
+def _max_rss() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _MAXRSS_UNIT
+
+
+def _open_phases() -> Optional[list]:
+    if not (MEMORY_TRACKING_ENABLED and has_request_context()):
+        return None
+    if not tracemalloc.is_tracing():
+        return None
+    return g.get("memory_phases")
+
+
+def _fold_peak(phases: list) -> None:
+    # tracemalloc keeps one peak for the process, reset for every phase;
+    # carry it into the phases that are still open before it is lost.
+    peak = tracemalloc.get_traced_memory()[1]
+    for phase in phases:
+        phase[2] = max(phase[2], peak)
+
+
+def _enter(phases: list, name: str) -> list:
+    _fold_peak(phases)
+    current = tracemalloc.get_traced_memory()[0]
+    phase = [name, current, current]
+    phases.append(phase)
+    # Reported in the order the phases started.
+    g.memory_peaks.setdefault(name, 0)
+    tracemalloc.reset_peak()
+    return phase
+
+
+def _exit(phases: list, phase: list) -> None:
+    _fold_peak(phases)
+    phases.remove(phase)
+    name, start, peak = phase
+    peaks = g.memory_peaks
+    peaks[name] = max(peaks.get(name, 0), peak - start)
+
+
+@contextmanager
+def track_phase(name: str) -> Iterator[None]:
+    """Measure the block's peak allocations as a phase of the current request."""
+    phases = _open_phases()
+    if phases is None:
+        yield
+        return
+    phase = _enter(phases, name)
+    try:
+        yield
+    finally:
+        _exit(phases, phase)
+
+
+def recent_rss_growth() -> list[dict]:
+    """This worker's latest requests that grew its peak RSS, oldest first."""
+    with _growth_lock:
+        return list(_recent_growth)
+
+
+def _route() -> str:
+    rule = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    return f"{request.method} {rule}"
+
+
+def _start_request() -> None:
+    g.memory_rss_start = _max_rss()
+    if MEMORY_TRACKING_ENABLED and tracemalloc.is_tracing():
+        g.memory_phases = []
+        g.memory_peaks = {}
+        g.memory_request = _enter(g.memory_phases, "request")
+
+
+def _report_allocations(response: Response) -> Response:
+    phases = g.pop("memory_phases", None)
+    request_phase = g.pop("memory_request", None)
+    if phases is None or request_phase is None:
+        return response
+    _exit(phases, request_phase)
+    peaks = g.pop("memory_peaks")
+    for name, peak in peaks.items():
+        observe_phase_memory(name, peak)
+    logger.info(
+        "[memory] %s %s: peak %.1f MB (%s)",
+        request.method,
+        request.path,
+        peaks["request"] / _MB,
+        ", ".join(
+            f"{name} {peak / _MB:.1f} MB"
+            for name, peak in peaks.items()
+            if name != "request"
+        ),
+    )
+    return response
+
+
+def _check_rss(_error) -> None:
+    global _limit_reported
+    start = g.pop("memory_rss_start", None)
+    if start is None:
+        return
+    max_rss = _max_rss()
+    growth = max_rss - start
+    route = _route()
+    record_rss(route, growth, max_rss)
+    if growth >= MEMORY_RSS_GROWTH_MB * _MB:
+        event = {
+            "time": time.time(),
+            "route": route,
+            "content_length": request.content_length or 0,
+            "growth_bytes": growth,
+            "max_rss_bytes": max_rss,
+        }
+        with _growth_lock:
+            _recent_growth.append(event)
+        logger.warning(
+            "[memory] %s grew worker peak RSS by %.1f MB to %.1f MB "
+            "(request body %s bytes)",
+            route,
+            growth / _MB,
+            max_rss / _MB,
+            request.content_length or 0,
+        )
+    if (
+        MEMORY_RSS_LIMIT_MB
+        and not _limit_reported
+        and max_rss > MEMORY_RSS_LIMIT_MB * _MB
+    ):
+        _limit_reported = True
+        largest = sorted(
+            recent_rss_growth(), key=lambda event: event["growth_bytes"], reverse=True
+        )[:5]
+        logger.error(
+            "[memory] Worker peak RSS %.1f MB passed MEMORY_RSS_LIMIT_MB=%s; "
+            "largest recent growth: %s",
+            max_rss / _MB,
+            MEMORY_RSS_LIMIT_MB,
+            "; ".join(
+                f"{event['route']} +{event['growth_bytes'] / _MB:.1f} MB"
+                for event in largest
+            )
+            or "none recorded",
+        )
+
+
+def init_memory_tracking(app: Flask) -> None:
+    """Watch worker RSS per request and, if enabled, trace allocations."""
+    if MEMORY_TRACKING_ENABLED and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    app.before_request(_start_request)
+    app.after_request(_report_allocations)
+    app.teardown_request(_check_rss)
@@ -0,0 +1,257 @@
+"""
+Prometheus metrics, served at GET /metrics.
+
+Under gunicorn every worker keeps its own metric values. With
+PROMETHEUS_MULTIPROC_DIR set (gunicorn.conf.py sets it for the master and
+its workers) prometheus_client writes them to mmap'ed files in that
+directory, and /metrics aggregates the files of all workers, so any worker
+can answer the scrape. Without it (flask run, tests) the values of the
+current process are served.
+
+Metrics:
+    splitzy_phase_duration_seconds{phase}     phases timed with server_timing.timed
+    splitzy_http_request_duration_seconds     per endpoint, method and status
+    splitzy_http_requests_in_progress         requests being handled, all workers
+    splitzy_gemini_tokens_total{call,kind}    usage_metadata of each Gemini call
+    splitzy_reconciliation_total{outcome}     ok, retried, reconciled_on_retry,
+                                              unreconciled
+    splitzy_blob_upload_failures_total        uploads that returned no blob URL
+    splitzy_image_quality_failures_total{check,mode}
+                                              failed quality checks per
+                                              RECEIPT_QUALITY_GATE mode
+    splitzy_principal_cache_lookups_total{result}
+                                              hit or miss per authenticated
+                                              request
+    splitzy_principal_cache_invalidations_total
+                                              principals evicted by Clerk webhooks
+    splitzy_db_pool_checkouts_total           connections checked out of the pool
+    splitzy_db_connections_checked_out        connections in use, all workers
+    splitzy_phase_peak_memory_bytes{phase}    peak allocations per phase, with
+                                              MEMORY_TRACKING_ENABLED
+    splitzy_rss_growth_bytes_total{endpoint}  worker peak RSS growth per route
+    splitzy_worker_max_rss_bytes{pid}         peak RSS of each worker
+
+If METRICS_TOKEN is set, /metrics requires it as a bearer token.
+"""
+
+import hmac
+import os
+import time
+
+from flask import Flask, Response, abort, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+
+from models import db
+
+
+# Bearer token a scraper must send to /metrics; unset leaves it open.
+METRICS_TOKEN: str = os.getenv("METRICS_TOKEN", "")
+
+# Model calls take tens of seconds, so the buckets reach well past the
+# prometheus_client defaults.
+_DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120,
+)  # fmt: skip
+
+PHASE_DURATION = Histogram(
+    "splitzy_phase_duration_seconds",
+    "Duration of a timed request phase (auth, blob, analyze, gemini, parse, db).",
+    ["phase"],
+    buckets=_DURATION_BUCKETS,
+)
+REQUEST_DURATION = Histogram(
+    "splitzy_http_request_duration_seconds",
+    "Duration of HTTP requests.",
+    ["endpoint", "method", "status"],
+    buckets=_DURATION_BUCKETS,
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "splitzy_http_requests_in_progress",
+    "HTTP requests being handled.",
+    ["endpoint"],
+    multiprocess_mode="livesum",
+)
+GEMINI_TOKENS = Counter(
+    "splitzy_gemini_tokens",
+    "Gemini tokens reported by usage_metadata.",
+    ["call", "kind"],
+)
+RECONCILIATION = Counter(
+    "splitzy_reconciliation",
+    "Outcomes of checking line items against the printed subtotal.",
+    ["outcome"],
+)
+BLOB_UPLOAD_FAILURES = Counter(
+    "splitzy_blob_upload_failures",
+    "Receipt image uploads to blob storage that returned no URL.",
+)
+IMAGE_QUALITY_FAILURES = Counter(
+    "splitzy_image_quality_failures",
+    "Uploaded photos that failed a local quality check.",
+    ["check", "mode"],
+)
+PRINCIPAL_CACHE_LOOKUPS = Counter(
+    "splitzy_principal_cache_lookups",
+    "Principal cache lookups of authenticated requests.",
+    ["result"],
+)
+PRINCIPAL_CACHE_INVALIDATIONS = Counter(
+    "splitzy_principal_cache_invalidations",
+    "Cached principals evicted after a Clerk user event.",
+)
+DB_POOL_CHECKOUTS = Counter(
+    "splitzy_db_pool_checkouts",
+    "Connections checked out of the SQLAlchemy pool.",
+)
+DB_CONNECTIONS_CHECKED_OUT = Gauge(
+    "splitzy_db_connections_checked_out",
+    "SQLAlchemy pool connections currently checked out.",
+    multiprocess_mode="livesum",
+)
+
+# Powers of two from 64 KB to 1 GB.
+_MEMORY_BUCKETS = tuple(2**exponent for exponent in range(16, 31))
+
+PHASE_PEAK_MEMORY = Histogram(
+    "splitzy_phase_peak_memory_bytes",
+    "Peak Python allocations of a request phase above its starting level.",
+    ["phase"],
+    buckets=_MEMORY_BUCKETS,
+)
+RSS_GROWTH = Counter(
+    "splitzy_rss_growth_bytes",
+    "Growth of a worker's peak RSS during requests.",
+    ["endpoint"],
+)
+WORKER_MAX_RSS = Gauge(
+    "splitzy_worker_max_rss_bytes",
+    "Peak resident set size of the worker.",
+    multiprocess_mode="liveall",
+)
+
+_TOKEN_KINDS = {
+    "prompt": "prompt_token_count",
+    "candidates": "candidates_token_count",
+    "total": "total_token_count",
+}
+
+
+def observe_phase(phase: str, seconds: float) -> None:
+    """Record the duration of one timed phase."""
+    PHASE_DURATION.labels(phase=phase).observe(seconds)
+
+
+def record_gemini_usage(response, call: str) -> None:
+    """Count the tokens of a Gemini response (`call`: first_pass, retry, segment)."""
+    usage = getattr(response, "usage_metadata", None)
+    for kind, attr in _TOKEN_KINDS.items():
+        count = getattr(usage, attr, None)
+        if isinstance(count, int) and count > 0:
+            GEMINI_TOKENS.labels(call=call, kind=kind).inc(count)
+
+
+def record_reconciliation(outcome: str) -> None:
+    """Count a reconciliation outcome."""
+    RECONCILIATION.labels(outcome=outcome).inc()
+
+
+def record_blob_upload_failure() -> None:
+    BLOB_UPLOAD_FAILURES.inc()
+
+
+def record_image_quality_failure(check: str, mode: str) -> None:
+    IMAGE_QUALITY_FAILURES.labels(check=check, mode=mode).inc()
+
+
+def record_principal_cache_lookup(hit: bool) -> None:
+    PRINCIPAL_CACHE_LOOKUPS.labels(result="hit" if hit else "miss").inc()
+
+
+def record_principal_cache_invalidation() -> None:
+    PRINCIPAL_CACHE_INVALIDATIONS.inc()
+
+
+def observe_phase_memory(phase: str, peak_bytes: int) -> None:
+    PHASE_PEAK_MEMORY.labels(phase=phase).observe(peak_bytes)
+
+
+def record_rss(endpoint: str, growth_bytes: int, max_rss_bytes: int) -> None:
+    """Record a request's growth of the worker's peak RSS."""
+    if growth_bytes > 0:
+        RSS_GROWTH.labels(endpoint=endpoint).inc(growth_bytes)
+    WORKER_MAX_RSS.set(max_rss_bytes)
+
+
+def _registry() -> CollectorRegistry:
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def metrics_view() -> Response:
+    if METRICS_TOKEN:
+        supplied = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if not hmac.compare_digest(supplied.encode(), METRICS_TOKEN.encode()):
+            abort(401)
+    return Response(generate_latest(_registry()), mimetype=CONTENT_TYPE_LATEST)
+
+
+def _endpoint() -> str:
+    # The route rule, not the path: receipt ids must not become label values.
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+
+def _start_request() -> None:
+    g.metrics_endpoint = _endpoint()
+    g.metrics_start = time.perf_counter()
+    REQUESTS_IN_PROGRESS.labels(endpoint=g.metrics_endpoint).inc()
+
+
+def _observe_request(response: Response) -> Response:
+    start = g.get("metrics_start")
+    if start is not None:
+        REQUEST_DURATION.labels(
+            endpoint=g.metrics_endpoint,
+            method=request.method,
+            status=str(response.status_code),
+        ).observe(time.perf_counter() - start)
+    return response
+
+
+def _end_request(_error) -> None:
+    endpoint = g.pop("metrics_endpoint", None)
+    g.pop("metrics_start", None)
+    if endpoint is not None:
+        REQUESTS_IN_PROGRESS.labels(endpoint=endpoint).dec()
+
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy) -> None:
+    DB_POOL_CHECKOUTS.inc()
+    DB_CONNECTIONS_CHECKED_OUT.inc()
+
+
+def _on_checkin(dbapi_connection, connection_record) -> None:
+    DB_CONNECTIONS_CHECKED_OUT.dec()
+
+
+def init_metrics(app: Flask) -> None:
+    """Instrument the app's requests and database pool and serve /metrics."""
+    app.before_request(_start_request)
+    app.after_request(_observe_request)
+    app.teardown_request(_end_request)
+    app.add_url_rule("/metrics", "metrics", metrics_view, methods=["GET"])
+    with app.app_context():
+        event.listen(db.engine, "checkout", _on_checkout)
+        event.listen(db.engine, "checkin", _on_checkin)
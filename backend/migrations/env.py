@@ -8,7 +8,12 @@ from flask import current_app
 # This ensures all models are registered with SQLAlchemy's metadata,
 # even if they're not imported elsewhere in the application code.
 # This is a common pattern to ensure new models are always discovered.
+from models.analysis_lease import AnalysisLease
 from models.assignment import Assignment
+from models.clerk_webhook_delivery import ClerkWebhookDelivery
+from models.idempotency_key import IdempotencyKey
+from models.receipt_field_boxes import ReceiptFieldBoxes
+from models.receipt_image_hash import ReceiptImageHash
 from models.receipt_line_item import ReceiptLineItem
 from models.receipt_user import ReceiptUser
 from models.user import User
@@ -0,0 +1,49 @@
+"""add receipt_image_hashes table
+
+Revision ID: 5d1e9a7c3b20
+Revises: 8f2d4b6a1c37
+Create Date: 2026-10-19 14:12:03.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d1e9a7c3b20'
+down_revision = '8f2d4b6a1c37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'receipt_image_hashes',
+        sa.Column('receipt_id', sa.BigInteger(), nullable=False),
+        sa.Column('phash', sa.BigInteger(), nullable=False),
+        sa.Column('band0', sa.Integer(), nullable=False),
+        sa.Column('band1', sa.Integer(), nullable=False),
+        sa.Column('band2', sa.Integer(), nullable=False),
+        sa.Column('band3', sa.Integer(), nullable=False),
+        sa.Column('detail_hash', sa.LargeBinary(), nullable=False),
+        sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('CURRENT_TIMESTAMP'), nullable=True),
+        sa.ForeignKeyConstraint(['receipt_id'], ['user_receipts.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('receipt_id'),
+    )
+    with op.batch_alter_table('receipt_image_hashes', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_receipt_image_hashes_band0'), ['band0'], unique=False)
+        batch_op.create_index(batch_op.f('ix_receipt_image_hashes_band1'), ['band1'], unique=False)
+        batch_op.create_index(batch_op.f('ix_receipt_image_hashes_band2'), ['band2'], unique=False)
+        batch_op.create_index(batch_op.f('ix_receipt_image_hashes_band3'), ['band3'], unique=False)
+        batch_op.create_index(batch_op.f('ix_receipt_image_hashes_created_at'), ['created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('receipt_image_hashes', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_receipt_image_hashes_created_at'))
+        batch_op.drop_index(batch_op.f('ix_receipt_image_hashes_band3'))
+        batch_op.drop_index(batch_op.f('ix_receipt_image_hashes_band2'))
+        batch_op.drop_index(batch_op.f('ix_receipt_image_hashes_band1'))
+        batch_op.drop_index(batch_op.f('ix_receipt_image_hashes_band0'))
+
+    op.drop_table('receipt_image_hashes')
@@ -0,0 +1,40 @@
+"""add analysis_leases table
+
+Revision ID: 8f2d4b6a1c37
+Revises: 3c9e1f7a2b64
+Create Date: 2026-10-19 10:41:27.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '8f2d4b6a1c37'
+down_revision = '3c9e1f7a2b64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'analysis_leases',
+        sa.Column('image_sha256', sa.Text(), nullable=False),
+        sa.Column('status', sa.Text(), nullable=False),
+        sa.Column('result_type', sa.Text(), nullable=True),
+        sa.Column('result', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+        sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('CURRENT_TIMESTAMP'), nullable=True),
+        sa.Column('locked_until', sa.TIMESTAMP(timezone=True), nullable=False),
+        sa.Column('expires_at', sa.TIMESTAMP(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('image_sha256'),
+    )
+    with op.batch_alter_table('analysis_leases', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_analysis_leases_expires_at'), ['expires_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('analysis_leases', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_analysis_leases_expires_at'))
+
+    op.drop_table('analysis_leases')
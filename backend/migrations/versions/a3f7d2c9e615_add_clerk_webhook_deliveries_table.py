@@ -0,0 +1,45 @@
+"""add clerk_webhook_deliveries table
+
+Revision ID: a3f7d2c9e615
+Revises: e91f5c2a7b48
+Create Date: 2026-10-19 21:04:51.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3f7d2c9e615'
+down_revision = 'e91f5c2a7b48'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'clerk_webhook_deliveries',
+        sa.Column('svix_id', sa.Text(), nullable=False),
+        sa.Column('event_type', sa.Text(), nullable=False),
+        sa.Column('clerk_user_id', sa.Text(), nullable=False),
+        sa.Column('received_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('CURRENT_TIMESTAMP'), nullable=False),
+        sa.Column('processed_at', sa.TIMESTAMP(timezone=True), nullable=True),
+        sa.Column('expires_at', sa.TIMESTAMP(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('svix_id'),
+    )
+    with op.batch_alter_table('clerk_webhook_deliveries', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_clerk_webhook_deliveries_expires_at'), ['expires_at'], unique=False)
+        batch_op.create_index(
+            'ix_clerk_webhook_deliveries_pending',
+            ['received_at'],
+            unique=False,
+            postgresql_where=sa.text('processed_at IS NULL'),
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('clerk_webhook_deliveries', schema=None) as batch_op:
+        batch_op.drop_index('ix_clerk_webhook_deliveries_pending')
+        batch_op.drop_index(batch_op.f('ix_clerk_webhook_deliveries_expires_at'))
+
+    op.drop_table('clerk_webhook_deliveries')
@@ -0,0 +1,31 @@
+"""add receipt_field_boxes table
+
+Revision ID: b7e3c1d9f2a4
+Revises: 5d1e9a7c3b20
+Create Date: 2026-10-19 16:40:27.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e3c1d9f2a4'
+down_revision = '5d1e9a7c3b20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'receipt_field_boxes',
+        sa.Column('receipt_id', sa.BigInteger(), nullable=False),
+        sa.Column('packed', sa.LargeBinary(), nullable=False),
+        sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('CURRENT_TIMESTAMP'), nullable=True),
+        sa.ForeignKeyConstraint(['receipt_id'], ['user_receipts.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('receipt_id'),
+    )
+
+
+def downgrade():
+    op.drop_table('receipt_field_boxes')
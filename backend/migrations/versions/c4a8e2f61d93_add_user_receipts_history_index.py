@@ -0,0 +1,34 @@
+"""add user_receipts history index
+
+Revision ID: c4a8e2f61d93
+Revises: b7e3c1d9f2a4
+Create Date: 2026-10-19 18:05:41.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4a8e2f61d93'
+down_revision = 'b7e3c1d9f2a4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Covers GET /api/receipts: keyset pagination on (created_at, id) per
+    # user over live receipts, with the summary columns included so pages are
+    # index-only scans.
+    op.create_index(
+        'ix_user_receipts_user_history',
+        'user_receipts',
+        ['user_id', sa.text('created_at DESC'), 'id'],
+        unique=False,
+        postgresql_include=['merchant', 'date', 'total'],
+        postgresql_where=sa.text('deleted_at IS NULL'),
+    )
+
+
+def downgrade():
+    op.drop_index('ix_user_receipts_user_history', table_name='user_receipts')
@@ -0,0 +1,66 @@
+"""add partial indexes for live rows
+
+Revision ID: e91f5c2a7b48
+Revises: c4a8e2f61d93
+Create Date: 2026-10-19 19:22:10.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e91f5c2a7b48'
+down_revision = 'c4a8e2f61d93'
+branch_labels = None
+depends_on = None
+
+
+# Hot lookups all filter on deleted_at IS NULL together with a foreign key
+# (see scripts/check_query_plans.py). Built CONCURRENTLY, outside the
+# migration transaction, so production tables stay writable while they build;
+# IF NOT EXISTS lets a rerun pick up after an interrupted build (drop any
+# INVALID leftover index first).
+INDEXES = (
+    ('ix_users_auth_user_id_live', 'users', ['auth_user_id']),
+    (
+        'ix_receipt_line_items_receipt_id_live',
+        'receipt_line_items',
+        ['receipt_id', 'id'],
+    ),
+    (
+        'ix_assignments_receipt_line_item_id_live',
+        'assignments',
+        ['receipt_line_item_id', 'receipt_user_id'],
+    ),
+    (
+        'ix_assignments_receipt_user_id_live',
+        'assignments',
+        ['receipt_user_id', 'receipt_line_item_id'],
+    ),
+)
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(
+                name,
+                table,
+                columns,
+                unique=False,
+                if_not_exists=True,
+                postgresql_where=sa.text('deleted_at IS NULL'),
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(
+                name,
+                table_name=table,
+                if_exists=True,
+                postgresql_concurrently=True,
+            )
@@ -1,4 +1,15 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects import postgresql, sqlite
 
 
 db = SQLAlchemy()
+
+
+def dialect_insert(table):
+    """
+    Return an INSERT construct for *table* that supports ON CONFLICT clauses
+    on the bound dialect (PostgreSQL in production, SQLite in development).
+    """
+    if db.engine.dialect.name == "sqlite":
+        return sqlite.insert(table)
+    return postgresql.insert(table)
@@ -0,0 +1,26 @@
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import JSONB
+
+from models import db
+
+
+class AnalysisLease(db.Model):
+    __tablename__ = "analysis_leases"
+
+    # sha256 of the uploaded image bytes
+    image_sha256 = db.Column(db.Text, primary_key=True)
+    status = db.Column(
+        db.Text, nullable=False, default="running"
+    )  # 'running' | 'completed'
+    # Pydantic class name of the shared result, e.g. 'RegularReceipt'
+    result_type = db.Column(db.Text, nullable=True)
+    result = db.Column(JSONB, nullable=True)
+    created_at = db.Column(
+        db.TIMESTAMP(timezone=True), server_default=text("CURRENT_TIMESTAMP")
+    )
+    # Lease held by the worker running the analysis
+    locked_until = db.Column(db.TIMESTAMP(timezone=True), nullable=False)
+    expires_at = db.Column(db.TIMESTAMP(timezone=True), nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<AnalysisLease {self.image_sha256} {self.status}>"
@@ -32,6 +32,26 @@ class Assignment(db.Model):
         "ReceiptUser", backref=db.backref("assignments", lazy=True), lazy="joined"
     )
 
+    __table_args__ = (
+        # Live assignments of a line item, and of a receipt user
+        db.Index(
+            "ix_assignments_receipt_line_item_id_live",
+            receipt_line_item_id,
+            receipt_user_id,
+            postgresql_where=text("deleted_at IS NULL"),
+        ),
+        db.Index(
+            "ix_assignments_receipt_user_id_live",
+            receipt_user_id,
+            receipt_line_item_id,
+            postgresql_where=text("deleted_at IS NULL"),
+        ),
+    )
+
+    @property
+    def display_name(self):
+        return self.receipt_user.display_name if self.receipt_user else None
+
     @property
     def user(self):
         return self.receipt_user.user if self.receipt_user else None
@@ -0,0 +1,35 @@
+from sqlalchemy import text
+
+from models import db
+
+
+class ClerkWebhookDelivery(db.Model):
+    __tablename__ = "clerk_webhook_deliveries"
+
+    # svix-id header; Svix reuses it when it retries a delivery
+    svix_id = db.Column(db.Text, primary_key=True)
+    event_type = db.Column(
+        db.Text, nullable=False
+    )  # 'user.created' | 'user.updated' | 'user.deleted'
+    clerk_user_id = db.Column(db.Text, nullable=False)
+    received_at = db.Column(
+        db.TIMESTAMP(timezone=True),
+        nullable=False,
+        server_default=text("CURRENT_TIMESTAMP"),
+    )
+    # Set once the batcher has applied the event to the users table
+    processed_at = db.Column(db.TIMESTAMP(timezone=True), nullable=True)
+    # Processed deliveries are kept until then to recognise Svix retries
+    expires_at = db.Column(db.TIMESTAMP(timezone=True), nullable=False, index=True)
+
+    __table_args__ = (
+        # Batcher: oldest deliveries not yet applied
+        db.Index(
+            "ix_clerk_webhook_deliveries_pending",
+            received_at,
+            postgresql_where=text("processed_at IS NULL"),
+        ),
+    )
+
+    def __repr__(self):
+        return f"<ClerkWebhookDelivery {self.svix_id} {self.event_type}>"
@@ -0,0 +1,27 @@
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import JSONB
+
+from models import db
+
+
+class IdempotencyKey(db.Model):
+    __tablename__ = "idempotency_keys"
+
+    # Scoped key: "<user id or 'anonymous'>:<Idempotency-Key header value>"
+    key = db.Column(db.Text, primary_key=True)
+    # sha256 of the request payload; a reused key with a different payload is rejected
+    request_fingerprint = db.Column(db.Text, nullable=False)
+    status = db.Column(
+        db.Text, nullable=False, default="in_progress"
+    )  # 'in_progress' | 'completed'
+    response_status = db.Column(db.Integer, nullable=True)
+    response_body = db.Column(JSONB, nullable=True)
+    created_at = db.Column(
+        db.TIMESTAMP(timezone=True), server_default=text("CURRENT_TIMESTAMP")
+    )
+    # In-progress lease; a marker whose lease has lapsed belongs to a dead worker
+    locked_until = db.Column(db.TIMESTAMP(timezone=True), nullable=False)
+    expires_at = db.Column(db.TIMESTAMP(timezone=True), nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<IdempotencyKey {self.key} {self.status}>"
@@ -0,0 +1,21 @@
+from sqlalchemy import text
+
+from models import db
+
+
+class ReceiptFieldBoxes(db.Model):
+    __tablename__ = "receipt_field_boxes"
+
+    receipt_id = db.Column(
+        db.BigInteger,
+        db.ForeignKey("user_receipts.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    # Packed fields_metadata (bounding boxes and PII flags); see field_boxes.py
+    packed = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(
+        db.TIMESTAMP(timezone=True), server_default=text("CURRENT_TIMESTAMP")
+    )
+
+    def __repr__(self):
+        return f"<ReceiptFieldBoxes {self.receipt_id} ({len(self.packed)} bytes)>"
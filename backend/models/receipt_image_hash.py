@@ -0,0 +1,30 @@
+from sqlalchemy import text
+
+from models import db
+
+
+class ReceiptImageHash(db.Model):
+    __tablename__ = "receipt_image_hashes"
+
+    receipt_id = db.Column(
+        db.BigInteger,
+        db.ForeignKey("user_receipts.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    # 64-bit dHash of the receipt image, stored as a signed BIGINT
+    phash = db.Column(db.BigInteger, nullable=False)
+    # The hash split into four 16-bit bands for multi-index Hamming lookups
+    band0 = db.Column(db.Integer, nullable=False, index=True)
+    band1 = db.Column(db.Integer, nullable=False, index=True)
+    band2 = db.Column(db.Integer, nullable=False, index=True)
+    band3 = db.Column(db.Integer, nullable=False, index=True)
+    # 256-bit dHash confirming candidates found through the bands
+    detail_hash = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(
+        db.TIMESTAMP(timezone=True),
+        server_default=text("CURRENT_TIMESTAMP"),
+        index=True,
+    )
+
+    def __repr__(self):
+        return f"<ReceiptImageHash {self.receipt_id} {self.phash:#x}>"
@@ -29,5 +29,15 @@ class ReceiptLineItem(db.Model):
         "Assignment", backref=db.backref("line_item", lazy=True)
     )
 
+    __table_args__ = (
+        # Live line items of a receipt, in UserReceipt.line_items order
+        db.Index(
+            "ix_receipt_line_items_receipt_id_live",
+            receipt_id,
+            id,
+            postgresql_where=text("deleted_at IS NULL"),
+        ),
+    )
+
     def __repr__(self):
         return f"<ReceiptLineItem {self.id} {self.receipt_id} {self.name}>"
@@ -14,5 +14,14 @@ class User(db.Model):
     )
     deleted_at = db.Column(db.TIMESTAMP(timezone=True), nullable=True, index=True)
 
+    __table_args__ = (
+        # get_current_user: live user by auth_user_id
+        db.Index(
+            "ix_users_auth_user_id_live",
+            auth_user_id,
+            postgresql_where=text("deleted_at IS NULL"),
+        ),
+    )
+
     def __repr__(self):
         return f"<User {self.display_name or self.auth_user_id}>"
@@ -0,0 +1,210 @@
+"""
+Near-duplicate detection for re-photographed receipts.
+
+When a user photographs a paper receipt they already saved (a retake, or a
+second upload after the first seemed to fail), the bytes differ and the
+exact-hash paths (idempotency, single-flight) do not match. Each saved
+receipt therefore also records difference hashes (dHash) of its image,
+computed on grayscale thumbnails of the cropped receipt region. A new upload
+that matches a receipt the same user saved in the last
+RECEIPT_NEAR_DUP_WINDOW_HOURS is neither uploaded nor analyzed: the client is
+pointed at the existing receipt and must confirm, either by opening it or by
+resending with force_analysis to analyze and save the photo anyway. Only the
+uploader's own receipts are candidates, so another group member
+photographing the same receipt is not detected.
+
+RECEIPT_NEAR_DUP_ENABLED is off by default: the upload client does not yet
+handle the 409 answer or resend with force_analysis.
+
+Lookups use multi-index hashing on the 64-bit hash (9x8 thumbnail): it is
+split into four 16-bit bands, each indexed. Two hashes within Hamming
+distance d share at least one band within distance d // 4, so the candidates
+are the rows whose band equals one of the few values within that radius of
+the query band. A 64-bit hash of a tall receipt mostly captures its layout,
+so receipts of one store look alike at that size; candidates must also match
+a 256-bit detail hash (9x32 thumbnail) before they are reused.
+"""
+
+import io
+import logging
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from itertools import combinations
+from typing import Optional
+
+import numpy as np
+from PIL import Image, ImageOps, UnidentifiedImageError
+from sqlalchemy import or_, select
+
+from models import db
+from models.receipt_image_hash import ReceiptImageHash
+from models.user_receipt import UserReceipt
+from receipt_crop import crop_receipt
+
+
+logger = logging.getLogger(__name__)
+
+# Hash saved receipts and answer 409 for near-duplicate uploads.
+RECEIPT_NEAR_DUP_ENABLED: bool = os.getenv(
+    "RECEIPT_NEAR_DUP_ENABLED", "false"
+).strip().lower() in ("1", "true", "yes")
+
+# Maximum Hamming distance between two dHashes of the same receipt.
+RECEIPT_NEAR_DUP_MAX_DISTANCE: int = int(
+    os.getenv("RECEIPT_NEAR_DUP_MAX_DISTANCE", "6")
+)
+
+# Maximum Hamming distance between the 256-bit detail hashes.
+RECEIPT_NEAR_DUP_MAX_DETAIL_DISTANCE: int = int(
+    os.getenv("RECEIPT_NEAR_DUP_MAX_DETAIL_DISTANCE", "4")
+)
+
+# Only receipts saved within this window are considered.
+RECEIPT_NEAR_DUP_WINDOW_HOURS: float = float(
+    os.getenv("RECEIPT_NEAR_DUP_WINDOW_HOURS", "72")
+)
+
+_BANDS = 4
+_BAND_BITS = 16
+_BAND_MASK = (1 << _BAND_BITS) - 1
+_DETAIL_ROWS = 32
+
+
+@dataclass(frozen=True)
+class ImageHashes:
+    phash: int  # signed 64-bit dHash, indexed for lookups
+    detail: bytes  # 256-bit dHash used to confirm candidates
+
+
+def _signed64(value: int) -> int:
+    """Unsigned 64-bit hash -> signed BIGINT."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _unsigned64(value: int) -> int:
+    return value & ((1 << 64) - 1)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (_unsigned64(a) ^ _unsigned64(b)).bit_count()
+
+
+def bands(phash: int) -> list[int]:
+    """The four 16-bit bands of a hash, lowest bits first."""
+    phash = _unsigned64(phash)
+    return [(phash >> (i * _BAND_BITS)) & _BAND_MASK for i in range(_BANDS)]
+
+
+def _band_neighbours(band: int, radius: int) -> list[int]:
+    """All 16-bit values within *radius* bits of *band*."""
+    values = [band]
+    for distance in range(1, radius + 1):
+        for bits in combinations(range(_BAND_BITS), distance):
+            flipped = band
+            for bit in bits:
+                flipped ^= 1 << bit
+            values.append(flipped)
+    return values
+
+
+def _dhash_bits(gray: Image.Image, rows: int) -> np.ndarray:
+    pixels = np.asarray(
+        gray.resize((9, rows), Image.Resampling.LANCZOS), dtype=np.int16
+    )
+    return (pixels[:, 1:] > pixels[:, :-1]).ravel()
+
+
+def image_hashes(image_data: bytes) -> Optional[ImageHashes]:
+    """
+    Difference hashes of the receipt in *image_data*.
+    The receipt region is cropped out first, so that two photos of the same
+    receipt on different tables hash alike. Returns None for undecodable data.
+    """
+    cropped = crop_receipt(image_data)
+    if cropped is not None:
+        image_data = cropped.data
+    try:
+        with Image.open(io.BytesIO(image_data)) as image:
+            image.draft("L", (256, 256))
+            gray = ImageOps.exif_transpose(image).convert("L")
+    except (UnidentifiedImageError, OSError, ValueError):
+        return None
+    phash = int(np.packbits(_dhash_bits(gray, 8)).view(">u8")[0])
+    return ImageHashes(
+        phash=_signed64(phash),
+        detail=np.packbits(_dhash_bits(gray, _DETAIL_ROWS)).tobytes(),
+    )
+
+
+def _detail_distance(a: bytes, b: bytes) -> int:
+    return int(
+        np.unpackbits(
+            np.frombuffer(a, dtype=np.uint8) ^ np.frombuffer(b, dtype=np.uint8)
+        ).sum()
+    )
+
+
+def find_near_duplicate(hashes: ImageHashes, user_id: int) -> Optional[UserReceipt]:
+    """
+    Most similar live receipt of the user saved within the window, or None.
+    Ties on distance go to the most recent receipt.
+    """
+    phash = hashes.phash
+    radius = RECEIPT_NEAR_DUP_MAX_DISTANCE // _BANDS
+    columns = [getattr(ReceiptImageHash, f"band{i}") for i in range(_BANDS)]
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=RECEIPT_NEAR_DUP_WINDOW_HOURS)
+
+    candidates = db.session.execute(
+        select(
+            ReceiptImageHash.receipt_id,
+            ReceiptImageHash.phash,
+            ReceiptImageHash.detail_hash,
+        )
+        .join(UserReceipt, UserReceipt.id == ReceiptImageHash.receipt_id)
+        .where(
+            ReceiptImageHash.created_at >= cutoff,
+            UserReceipt.user_id == user_id,
+            UserReceipt.deleted_at.is_(None),
+            or_(
+                *(
+                    column.in_(_band_neighbours(band, radius))
+                    for column, band in zip(columns, bands(phash))
+                )
+            ),
+        )
+    ).all()
+
+    matches = []
+    for candidate in candidates:
+        if hamming_distance(phash, candidate.phash) > RECEIPT_NEAR_DUP_MAX_DISTANCE:
+            continue
+        detail_distance = _detail_distance(hashes.detail, candidate.detail_hash)
+        if detail_distance <= RECEIPT_NEAR_DUP_MAX_DETAIL_DISTANCE:
+            matches.append((detail_distance, -candidate.receipt_id))
+    if not matches:
+        if candidates:
+            logger.debug(
+                "[near_dup] %d coarse candidate(s) rejected on detail hash",
+                len(candidates),
+            )
+        return None
+    distance, negative_id = min(matches)
+    logger.info(
+        "[near_dup] Upload matches receipt %s at detail distance %d",
+        -negative_id,
+        distance,
+    )
+    return db.session.get(UserReceipt, -negative_id)
+
+
+def record_hashes(receipt: UserReceipt, hashes: ImageHashes) -> None:
+    """Add the hash row for a receipt to the current session."""
+    db.session.add(
+        ReceiptImageHash(
+            receipt_id=receipt.id,
+            phash=hashes.phash,
+            detail_hash=hashes.detail,
+            **{f"band{i}": band for i, band in enumerate(bands(hashes.phash))},
+        )
+    )
@@ -0,0 +1,130 @@
+"""
+Rasterization of PDF receipts and invoices.
+
+Pages are rendered with pdfium in a process pool: rendering is CPU-bound and
+holds the GIL, so threads would serialize it behind the request threads. The
+analyzer submits every page up front and starts the model call for a page as
+soon as that page's render finishes (see ImageAnalyzer._analyze_pdf), so the
+first pages are being analyzed while later ones are still rendering.
+"""
+
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from typing import Optional
+
+import pypdfium2 as pdfium
+
+
+logger = logging.getLogger(__name__)
+
+PDF_MIME_TYPE = "application/pdf"
+
+# Pages beyond this are ignored; long statements are not receipts.
+PDF_MAX_PAGES: int = int(os.getenv("PDF_MAX_PAGES", "20"))
+
+# Render scale relative to 72 DPI; 2.0 renders at 144 DPI, plenty for OCR.
+PDF_RENDER_SCALE: float = float(os.getenv("PDF_RENDER_SCALE", "2.0"))
+
+# Size of the rasterization process pool. 0 renders in the calling process.
+PDF_RASTER_WORKERS: int = int(
+    os.getenv("PDF_RASTER_WORKERS", str(min(4, os.cpu_count() or 1)))
+)
+
+_PAGE_JPEG_QUALITY = 90
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+class PDFError(ValueError):
+    """Raised when a PDF cannot be opened or contains no pages"""
+
+    pass
+
+
+def is_pdf(data: bytes, mime_type: Optional[str] = None) -> bool:
+    """True if the upload is a PDF, by declared type or by magic bytes."""
+    return mime_type == PDF_MIME_TYPE or data[:5] == b"%PDF-"
+
+
+def count_pages(pdf_data: bytes) -> int:
+    """Number of pages that will be analyzed (capped at PDF_MAX_PAGES)."""
+    try:
+        document = pdfium.PdfDocument(pdf_data)
+    except pdfium.PdfiumError as e:
+        raise PDFError(f"Could not open PDF: {e}") from e
+    try:
+        page_count = len(document)
+    finally:
+        document.close()
+    if page_count == 0:
+        raise PDFError("PDF has no pages")
+    if page_count > PDF_MAX_PAGES:
+        logger.warning(
+            "[pdf] PDF has %d pages; analyzing the first %d",
+            page_count,
+            PDF_MAX_PAGES,
+        )
+    return min(page_count, PDF_MAX_PAGES)
+
+
+def render_page(pdf_data: bytes, page_index: int, scale: float) -> bytes:
+    """
+    Render one page to JPEG bytes.
+    Module-level so that it can be pickled into a worker process.
+    """
+    document = pdfium.PdfDocument(pdf_data)
+    try:
+        page = document[page_index]
+        try:
+            image = page.render(scale=scale).to_pil().convert("RGB")
+        finally:
+            page.close()
+    finally:
+        document.close()
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=_PAGE_JPEG_QUALITY)
+    return buffer.getvalue()
+
+
+def _get_pool() -> Optional[ProcessPoolExecutor]:
+    global _pool
+    if PDF_RASTER_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: gunicorn workers run request threads, and
+            # forking a threaded process can deadlock the child.
+            _pool = ProcessPoolExecutor(
+                max_workers=PDF_RASTER_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def submit_page_renders(
+    pdf_data: bytes, page_count: int, executor: Optional[Executor] = None
+) -> list[Future]:
+    """
+    Start rendering every page and return one future per page, in order.
+    Each future resolves to the page's JPEG bytes.
+    """
+    executor = executor or _get_pool()
+    futures = []
+    for page_index in range(page_count):
+        if executor is None:
+            future: Future = Future()
+            try:
+                future.set_result(render_page(pdf_data, page_index, PDF_RENDER_SCALE))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            future = executor.submit(
+                render_page, pdf_data, page_index, PDF_RENDER_SCALE
+            )
+        futures.append(future)
+    return futures
@@ -0,0 +1,105 @@
+"""
+Per-process cache of authenticated principals.
+
+get_current_user verifies the Clerk session token on every request and then
+looks the user up by auth_user_id. That lookup is a database round-trip
+returning the same row for the whole life of the token, so its result is
+cached here by token subject (`sub`): the user's column values, kept until
+the token's `exp` and at most PRINCIPAL_CACHE_MAX_TTL_SECONDS. The token
+itself is still verified on every request.
+
+The Clerk webhook batcher (clerk_webhooks) evicts a user's entry when the
+user is updated or deleted. Eviction only reaches the worker whose batcher
+applies the event; other gunicorn workers drop their copy when it expires,
+so PRINCIPAL_CACHE_MAX_TTL_SECONDS bounds how long they can keep serving a
+deleted user.
+
+Hits, misses and evictions are counted in the splitzy_principal_cache_*
+metrics.
+"""
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from cachetools import TLRUCache
+from sqlalchemy.orm import make_transient_to_detached
+
+from metrics import record_principal_cache_invalidation, record_principal_cache_lookup
+from models import db
+from models.user import User
+
+
+PRINCIPAL_CACHE_ENABLED: bool = os.getenv(
+    "PRINCIPAL_CACHE_ENABLED", "true"
+).strip().lower() in ("1", "true", "yes")
+
+# Most principals kept per process; least recently used ones go first.
+PRINCIPAL_CACHE_MAX_SIZE: int = int(os.getenv("PRINCIPAL_CACHE_MAX_SIZE", "10000"))
+
+# Upper bound on an entry's lifetime, whatever the token's exp says.
+PRINCIPAL_CACHE_MAX_TTL_SECONDS: float = float(
+    os.getenv("PRINCIPAL_CACHE_MAX_TTL_SECONDS", "60")
+)
+
+
+@dataclass(frozen=True)
+class _Principal:
+    columns: dict[str, Any]
+    expires_at: float
+
+
+_cache: TLRUCache = TLRUCache(
+    maxsize=PRINCIPAL_CACHE_MAX_SIZE,
+    ttu=lambda _sub, principal, _now: principal.expires_at,
+    timer=time.time,
+)
+_cache_lock = threading.Lock()
+
+
+def get_cached_user(sub: str) -> Optional[User]:
+    """
+    The cached user for a verified token subject, attached to the current
+    session without a query, or None on a miss.
+    """
+    if not PRINCIPAL_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        principal = _cache.get(sub)
+    record_principal_cache_lookup(principal is not None)
+    if principal is None:
+        return None
+    user = User(**principal.columns)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def cache_user(sub: str, user: User, token_exp: Optional[float]) -> None:
+    """Cache a user looked up for a verified token until the token expires."""
+    if not PRINCIPAL_CACHE_ENABLED or token_exp is None:
+        return
+    now = time.time()
+    expires_at = min(float(token_exp), now + PRINCIPAL_CACHE_MAX_TTL_SECONDS)
+    if expires_at <= now:
+        return
+    columns = {
+        attr.key: getattr(user, attr.key) for attr in User.__mapper__.column_attrs
+    }
+    with _cache_lock:
+        _cache[sub] = _Principal(columns=columns, expires_at=expires_at)
+
+
+def invalidate_user(sub: str) -> None:
+    """Drop the cached principal of a Clerk user, if any."""
+    with _cache_lock:
+        evicted = _cache.pop(sub, None) is not None
+    if evicted:
+        record_principal_cache_invalidation()
+
+
+def clear_principal_cache() -> None:
+    """Drop every cached principal."""
+    with _cache_lock:
+        _cache.clear()
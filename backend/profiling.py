@@ -0,0 +1,287 @@
+"""
+On-demand sampling profiler for live requests.
+
+A profiled request's thread is sampled every PROFILE_INTERVAL_MS by a
+per-worker sampler thread, which reads its Python stack from
+sys._current_frames(). Nothing is traced or instrumented, so the request
+runs at full speed between samples. Native code (pydantic-core, the json
+and decimal C modules) shows up as the Python frame that called into it,
+e.g. TypeAdapter.validate_python or json.loads. Only the request thread is
+sampled, not the threads of a segmented or multi-page analysis.
+
+A request is profiled in one of two ways:
+
+- It sends `X-Profile-Token: <PROFILE_TOKEN>`. The request's profile is
+  written to PROFILE_DIR as speedscope JSON, named after the time, route,
+  status and duration, and the response names the file in an X-Profile
+  header. Open it at https://www.speedscope.app.
+- PROFILE_SAMPLE_EVERY is N > 0 and the request is one of the 1-in-N picked
+  at random. Its stacks are added to a rolling profile of the worker's last
+  PROFILE_ROLLING_REQUESTS sampled requests, rewritten after each one as
+  PROFILE_DIR/worker-<pid>.collapsed. Each stack is rooted at the request's
+  route, so the flamegraph splits by endpoint first:
+
+      flamegraph.pl /tmp/splitzy-profiles/worker-*.collapsed > cpu.svg
+"""
+
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Optional
+
+from flask import Flask, Response, g, request
+
+
+# Token that profiles a request sent with it as X-Profile-Token; unset
+# disables on-demand profiling.
+PROFILE_TOKEN: str = os.getenv("PROFILE_TOKEN", "")
+
+# Profile one request in N at random into the rolling profile; 0 disables.
+PROFILE_SAMPLE_EVERY: int = int(os.getenv("PROFILE_SAMPLE_EVERY", "0"))
+
+# Where profiles are written.
+PROFILE_DIR: str = os.getenv(
+    "PROFILE_DIR", os.path.join(tempfile.gettempdir(), "splitzy-profiles")
+)
+
+# Time between two samples of a profiled request.
+PROFILE_INTERVAL_MS: float = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+
+# Sampled requests the rolling per-worker profile covers.
+PROFILE_ROLLING_REQUESTS: int = int(os.getenv("PROFILE_ROLLING_REQUESTS", "500"))
+
+_BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+_SITE_PACKAGES = re.compile(r"^.*[/\\](?:site|dist)-packages[/\\]")
+_UNSAFE_FILENAME = re.compile(r"[^\w.-]+")
+
+
+class Profile:
+    """Stack samples of one thread, as counts of (root, ..., leaf) frames."""
+
+    def __init__(self, thread_id: int):
+        self.thread_id = thread_id
+        self.stacks: Counter = Counter()
+        self.started = time.perf_counter()
+
+
+@lru_cache(maxsize=8192)
+def _frame_name(code) -> str:
+    filename = code.co_filename
+    if filename.startswith(_BACKEND_DIR):
+        filename = os.path.relpath(filename, _BACKEND_DIR)
+    else:
+        filename = _SITE_PACKAGES.sub("", filename)
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({filename}:{code.co_firstlineno})"
+
+
+def _stack(frame) -> tuple[str, ...]:
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    names.reverse()
+    return tuple(names)
+
+
+class _Sampler:
+    """Samples the stacks of the threads being profiled in this process."""
+
+    def __init__(self):
+        self._profiles: dict[int, Profile] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid: Optional[int] = None
+
+    def start(self) -> Profile:
+        """Start profiling the calling thread."""
+        profile = Profile(threading.get_ident())
+        with self._lock:
+            # Per process: a thread started before a gunicorn fork does not
+            # survive into the workers.
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(
+                    target=self._run, name="profile-sampler", daemon=True
+                ).start()
+            self._profiles[profile.thread_id] = profile
+        self._wakeup.set()
+        return profile
+
+    def stop(self, profile: Profile) -> None:
+        """Stop profiling; the profile is not sampled once this returns."""
+        with self._lock:
+            self._profiles.pop(profile.thread_id, None)
+
+    def _run(self) -> None:
+        interval = PROFILE_INTERVAL_MS / 1000
+        while True:
+            with self._lock:
+                profiles = list(self._profiles.values())
+                if not profiles:
+                    self._wakeup.clear()
+            if not profiles:
+                self._wakeup.wait()
+                continue
+            self._sample(profiles)
+            time.sleep(interval)
+
+    def _sample(self, profiles: list[Profile]) -> None:
+        frames = sys._current_frames()
+        samples = []
+        for profile in profiles:
+            frame = frames.get(profile.thread_id)
+            if frame is not None:
+                samples.append((profile, _stack(frame)))
+        del frames
+        with self._lock:
+            for profile, stack in samples:
+                # A profile stopped since the pass began is being read by its
+                # request; adding to it now could break that iteration.
+                if self._profiles.get(profile.thread_id) is profile:
+                    profile.stacks[stack] += 1
+
+
+_sampler = _Sampler()
+# Stacks of the last sampled requests, and their sum.
+_rolling: deque = deque(maxlen=PROFILE_ROLLING_REQUESTS)
+_rolling_total: Counter = Counter()
+_rolling_lock = threading.Lock()
+
+
+def to_speedscope(profile: Profile, name: str, duration_ms: float) -> dict:
+    """The profile in speedscope's file format, as one sampled profile."""
+    frame_index: dict[str, int] = {}
+    samples, weights = [], []
+    for stack, count in profile.stacks.items():
+        samples.append(
+            [frame_index.setdefault(frame, len(frame_index)) for frame in stack]
+        )
+        weights.append(count * PROFILE_INTERVAL_MS)
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "splitzy-backend",
+        "activeProfileIndex": 0,
+        "shared": {"frames": [{"name": frame} for frame in frame_index]},
+        "profiles": [
+            {
+                "type": "sampled",
+                "name": name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round(duration_ms, 3),
+                "samples": samples,
+                "weights": weights,
+            }
+        ],
+    }
+
+
+def to_collapsed(stacks: Counter) -> str:
+    """Stacks in the collapsed format of flamegraph.pl and speedscope."""
+    return "".join(
+        f"{';'.join(stack)} {count}\n" for stack, count in stacks.most_common()
+    )
+
+
+def _write(path: str, content: str) -> None:
+    # Written next to the target and renamed, so readers never see half a file.
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(partial, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(partial, path)
+
+
+def _route() -> str:
+    rule = request.url_rule.rule if request.url_rule is not None else request.path
+    return f"{request.method} {rule}"
+
+
+def _requested() -> bool:
+    supplied = request.headers.get("X-Profile-Token")
+    return bool(
+        PROFILE_TOKEN
+        and supplied
+        and hmac.compare_digest(supplied.encode(), PROFILE_TOKEN.encode())
+    )
+
+
+def _start_request() -> None:
+    if _requested():
+        g.profile_mode = "request"
+    elif PROFILE_SAMPLE_EVERY > 0 and random.randrange(PROFILE_SAMPLE_EVERY) == 0:
+        g.profile_mode = "rolling"
+    else:
+        return
+    g.profile = _sampler.start()
+
+
+def _finish(response: Response) -> Response:
+    profile = g.pop("profile", None)
+    mode = g.pop("profile_mode", None)
+    if profile is None:
+        return response
+    _sampler.stop(profile)
+    duration_ms = (time.perf_counter() - profile.started) * 1000
+    route = _route()
+    if mode == "request":
+        name = f"{route} {response.status_code} {duration_ms:.1f} ms"
+        filename = _UNSAFE_FILENAME.sub(
+            "_",
+            f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S.%fZ}-{route}-"
+            f"{response.status_code}-{duration_ms:.0f}ms",
+        )
+        filename = f"{filename}.speedscope.json"
+        _write(
+            os.path.join(PROFILE_DIR, filename),
+            json.dumps(to_speedscope(profile, name, duration_ms)),
+        )
+        response.headers["X-Profile"] = filename
+    else:
+        stacks = Counter(
+            {(route, *stack): count for stack, count in profile.stacks.items()}
+        )
+        with _rolling_lock:
+            if len(_rolling) == _rolling.maxlen:
+                dropped = _rolling[0]
+                _rolling_total.subtract(dropped)
+                # Forget stacks only the dropped request had, or the total
+                # grows with every stack ever sampled.
+                for stack in dropped:
+                    if _rolling_total[stack] <= 0:
+                        del _rolling_total[stack]
+            _rolling.append(stacks)
+            _rolling_total.update(stacks)
+            total = _rolling_total.copy()
+        # Formatted and written outside the lock, which only guards the counts.
+        _write(
+            os.path.join(PROFILE_DIR, f"worker-{os.getpid()}.collapsed"),
+            to_collapsed(total),
+        )
+    return response
+
+
+def _end_request(_error) -> None:
+    # Requests that never reached after_request.
+    profile = g.pop("profile", None)
+    g.pop("profile_mode", None)
+    if profile is not None:
+        _sampler.stop(profile)
+
+
+def init_profiling(app: Flask) -> None:
+    """Profile requests that ask for it, and one in PROFILE_SAMPLE_EVERY."""
+    app.before_request(_start_request)
+    app.after_request(_finish)
+    app.teardown_request(_end_request)
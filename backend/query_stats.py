@@ -0,0 +1,189 @@
+"""
+Per-request SQL statistics and N+1 detection.
+
+SQLAlchemy engine events time every statement a request runs. When the
+request ends:
+
+- its Server-Timing header gets an "sql" entry with the time spent in the
+  database and the number of statements (sql;desc="3 statements";dur=4.2);
+- the statement count, total time and the slowest statements are logged at
+  DEBUG;
+- a statement shape run QUERY_REPEAT_THRESHOLD times or more is logged at
+  WARNING as a likely N+1, such as Assignment.receipt_user or
+  ReceiptUser.user being lazy-loaded once per row.
+
+Statements are kept by shape only. Bound parameters are never recorded,
+literals become "?" and expanded IN lists collapse to "(?)", so the logs
+carry no user data and an IN list of any length counts as one shape.
+
+`capture()` collects the same statistics for any block. Tests use it through
+the query_budget fixture (tests/conftest.py) to hold endpoints to a
+statement budget.
+"""
+
+import heapq
+import logging
+import os
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from flask import Flask, Response, g, request
+from sqlalchemy import event
+
+from models import db
+from server_timing import record_phase
+
+
+logger = logging.getLogger(__name__)
+
+# Runs of one statement shape within a request reported as a likely N+1.
+QUERY_REPEAT_THRESHOLD: int = int(os.getenv("QUERY_REPEAT_THRESHOLD", "5"))
+
+# Slowest statements of a request kept for the debug log.
+_SLOWEST_KEPT = 3
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w.$])-?\d+(?:\.\d+)?\b")
+# qmark (SQLite), pyformat/format (psycopg) and named placeholders; "::"
+# casts are not placeholders.
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|\?|(?<!:):\w+|\$\d+")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+_active: ContextVar[tuple["QueryStats", ...]] = ContextVar("query_stats", default=())
+
+
+def statement_shape(statement: str) -> str:
+    """The statement with literals and parameters replaced by "?"."""
+    shape = _STRING_LITERAL.sub("?", statement)
+    shape = _PLACEHOLDER.sub("?", shape)
+    shape = _NUMBER_LITERAL.sub("?", shape)
+    shape = _PLACEHOLDER_LIST.sub("(?)", shape)
+    return _WHITESPACE.sub(" ", shape).strip()
+
+
+class QueryStats:
+    """Statements run during one request or capture() block."""
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.shapes: Counter = Counter()
+        self._slowest: list[tuple[float, int, str]] = []
+
+    def record(self, statement: str, duration_ms: float) -> None:
+        shape = statement_shape(statement)
+        self.count += 1
+        self.total_ms += duration_ms
+        self.shapes[shape] += 1
+        # The count breaks ties so shapes are never compared.
+        entry = (duration_ms, self.count, shape)
+        if len(self._slowest) < _SLOWEST_KEPT:
+            heapq.heappush(self._slowest, entry)
+        else:
+            heapq.heappushpop(self._slowest, entry)
+
+    @property
+    def slowest(self) -> list[tuple[float, str]]:
+        """The slowest statements as (milliseconds, shape), slowest first."""
+        return [
+            (duration_ms, shape)
+            for duration_ms, _, shape in sorted(self._slowest, reverse=True)
+        ]
+
+    def repeated(
+        self, threshold: int = QUERY_REPEAT_THRESHOLD
+    ) -> list[tuple[str, int]]:
+        """Shapes run at least `threshold` times, most frequent first."""
+        return [
+            (shape, count)
+            for shape, count in self.shapes.most_common()
+            if count >= threshold
+        ]
+
+
+@contextmanager
+def capture() -> Iterator[QueryStats]:
+    """Collect the statements run in the block, including by nested requests."""
+    stats = QueryStats()
+    token = _active.set(_active.get() + (stats,))
+    try:
+        yield stats
+    finally:
+        _active.reset(token)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _active.get() and context is not None:
+        context._query_stats_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_query_stats_start", None)
+    if start is None:
+        return
+    context._query_stats_start = None
+    duration_ms = (time.perf_counter() - start) * 1000
+    for stats in _active.get():
+        stats.record(statement, duration_ms)
+
+
+def _start_request() -> None:
+    stats = QueryStats()
+    g.query_stats = stats
+    g.query_stats_token = _active.set(_active.get() + (stats,))
+
+
+def _report(response: Response) -> Response:
+    stats: Optional[QueryStats] = g.get("query_stats")
+    if stats is None or stats.count == 0:
+        return response
+    record_phase("sql", stats.total_ms, f"{stats.count} statements")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "[sql] %s %s: %d statements in %.1f ms; slowest: %s",
+            request.method,
+            request.path,
+            stats.count,
+            stats.total_ms,
+            "; ".join(f"{ms:.1f} ms {shape}" for ms, shape in stats.slowest),
+        )
+    for shape, count in stats.repeated():
+        logger.warning(
+            "[sql] Likely N+1 in %s %s: %d runs of %s",
+            request.method,
+            request.path,
+            count,
+            shape,
+        )
+    return response
+
+
+def _end_request(_error) -> None:
+    g.pop("query_stats", None)
+    token = g.pop("query_stats_token", None)
+    if token is None:
+        return
+    try:
+        _active.reset(token)
+    except ValueError:
+        # Torn down in another context than the one the request started in.
+        _active.set(())
+
+
+def init_query_stats(app: Flask) -> None:
+    """
+    Collect the SQL statistics of every request. Call after
+    init_server_timing, so the "sql" phase is recorded before the
+    Server-Timing header is written.
+    """
+    app.before_request(_start_request)
+    app.after_request(_report)
+    app.teardown_request(_end_request)
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(db.engine, "after_cursor_execute", _after_cursor_execute)
@@ -0,0 +1,267 @@
+"""
+Automatic cropping of the receipt region out of a phone photo.
+
+Most of a receipt photo is table, background and hands. The receipt is
+located on a small grayscale thumbnail with vectorized NumPy analysis: an
+Otsu threshold separates the bright paper from the background, and row and
+column projections of that mask give the paper's extent. With
+RECEIPT_CROP_DESKEW the skew angle is estimated from the second-order moments
+of the mask and the photo is rotated upright before cropping.
+
+Only the cropped region is sent to the model. CropTransform maps the
+bounding boxes the model returns back into original-image coordinates, so
+BoundingBox consumers keep working against the uploaded photo.
+"""
+
+import io
+import logging
+import math
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from schemas.receipt import BoundingBox, ReceiptFieldsMetadata
+
+
+logger = logging.getLogger(__name__)
+
+RECEIPT_AUTO_CROP_ENABLED: bool = os.getenv(
+    "RECEIPT_AUTO_CROP_ENABLED", "true"
+).strip().lower() in ("1", "true", "yes")
+
+RECEIPT_CROP_DESKEW: bool = os.getenv(
+    "RECEIPT_CROP_DESKEW", "false"
+).strip().lower() in ("1", "true", "yes")
+
+# Crop only when it removes at least this share of the image area.
+RECEIPT_CROP_MIN_AREA_REDUCTION: float = float(
+    os.getenv("RECEIPT_CROP_MIN_AREA_REDUCTION", "0.2")
+)
+
+_ANALYSIS_SIZE = 400
+_MARGIN_FRACTION = 0.02
+# Share of paper pixels above which a row/column counts as paper: a coarse
+# level for the first pass over whole columns, then a strict one.
+_COARSE_PROJECTION_LEVEL = 0.25
+_PROJECTION_LEVEL = 0.5
+# The paper must cover this share of the photo to be trusted as a receipt.
+_MIN_PAPER_FRACTION = 0.05
+_MAX_PAPER_FRACTION = 0.9
+# Skew angles outside this range (degrees) are left alone.
+_MIN_SKEW = 1.0
+_MAX_SKEW = 20.0
+_JPEG_QUALITY = 90
+
+
+@dataclass(frozen=True)
+class CropTransform:
+    """
+    Maps coordinates in the cropped image back to the original image.
+
+    The original was optionally rotated counter-clockwise by `angle` degrees
+    about its centre (canvas expanded to `rotated_size`), then cropped at
+    (`left`, `top`).
+    """
+
+    left: int
+    top: int
+    angle: float
+    original_size: tuple[int, int]
+    rotated_size: tuple[int, int]
+
+    def to_original_point(self, x: float, y: float) -> tuple[float, float]:
+        x, y = x + self.left, y + self.top
+        if not self.angle:
+            return x, y
+        rw, rh = self.rotated_size
+        ow, oh = self.original_size
+        dx, dy = x - rw / 2, y - rh / 2
+        theta = math.radians(self.angle)
+        cos, sin = math.cos(theta), math.sin(theta)
+        return ow / 2 + dx * cos - dy * sin, oh / 2 + dx * sin + dy * cos
+
+    def to_original(self, bbox: BoundingBox) -> BoundingBox:
+        # Rounded so that float noise from the rotation (e.g. 9.9999) does not
+        # grow the box by a pixel on floor/ceil.
+        corners = [
+            tuple(round(v, 6) for v in self.to_original_point(x, y))
+            for x in (bbox.x, bbox.x + bbox.width)
+            for y in (bbox.y, bbox.y + bbox.height)
+        ]
+        ow, oh = self.original_size
+        x1 = max(0, min(ow - 1, math.floor(min(x for x, _ in corners))))
+        y1 = max(0, min(oh - 1, math.floor(min(y for _, y in corners))))
+        x2 = min(ow, math.ceil(max(x for x, _ in corners)))
+        y2 = min(oh, math.ceil(max(y for _, y in corners)))
+        return BoundingBox(x=x1, y=y1, width=max(1, x2 - x1), height=max(1, y2 - y1))
+
+    def map_to_original(self, receipt_model):
+        """Rewrite fields_metadata bboxes of an analysis result in place."""
+        metadata = getattr(receipt_model, "fields_metadata", None)
+        if metadata is not None:
+            receipt_model.fields_metadata = ReceiptFieldsMetadata(
+                fields=[
+                    entry.model_copy(update={"bbox": self.to_original(entry.bbox)})
+                    for entry in metadata.fields
+                ]
+            )
+        return receipt_model
+
+
+@dataclass(frozen=True)
+class CroppedImage:
+    data: bytes
+    transform: CropTransform
+    mime_type: str = "image/jpeg"
+
+    def map_to_original(self, receipt_model):
+        return self.transform.map_to_original(receipt_model)
+
+
+def _otsu_threshold(gray: np.ndarray) -> Optional[float]:
+    """Otsu's threshold, or None for an image of a single gray level."""
+    histogram = np.bincount(gray.astype(np.uint8).ravel(), minlength=256)
+    p = histogram / histogram.sum()
+    omega = np.cumsum(p)
+    mu = np.cumsum(p * np.arange(256))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between = (mu[-1] * omega - mu) ** 2 / (omega * (1.0 - omega))
+    between[~np.isfinite(between)] = 0.0
+    if not between.any():
+        return None
+    return float(np.argmax(between))
+
+
+def _longest_run(selected: np.ndarray) -> Optional[tuple[int, int]]:
+    """[start, end) of the longest run of True values."""
+    padded = np.concatenate(([False], selected, [False])).astype(np.int8)
+    changes = np.flatnonzero(np.diff(padded))
+    if changes.size == 0:
+        return None
+    starts, ends = changes[::2], changes[1::2]
+    longest = int(np.argmax(ends - starts))
+    return int(starts[longest]), int(ends[longest])
+
+
+def _paper_extent(mask: np.ndarray) -> Optional[tuple[int, int, int, int]]:
+    """(left, top, right, bottom) of the paper in mask coordinates."""
+    columns = _longest_run(mask.mean(axis=0) > _COARSE_PROJECTION_LEVEL)
+    if columns is None:
+        return None
+    left, right = columns
+    rows = _longest_run(mask[:, left:right].mean(axis=1) > _PROJECTION_LEVEL)
+    if rows is None:
+        return None
+    top, bottom = rows
+    # Refine the columns against the paper rows only.
+    columns = _longest_run(mask[top:bottom].mean(axis=0) > _PROJECTION_LEVEL)
+    if columns is None:
+        return None
+    left, right = columns
+    return left, top, right, bottom
+
+
+def _skew_angle(mask: np.ndarray) -> float:
+    """Degrees to rotate counter-clockwise so the paper's long axis is upright."""
+    ys, xs = np.nonzero(mask)
+    if xs.size < 100:
+        return 0.0
+    xs = xs - xs.mean()
+    ys = ys - ys.mean()
+    mu20, mu02, mu11 = (xs * xs).mean(), (ys * ys).mean(), (xs * ys).mean()
+    # Orientation of the principal axis, measured from the x axis (y down).
+    orientation = 0.5 * math.degrees(math.atan2(2 * mu11, mu20 - mu02))
+    skew = orientation - 90.0 if orientation > 0 else orientation + 90.0
+    return skew
+
+
+def crop_receipt(image_data: bytes) -> Optional[CroppedImage]:
+    """
+    Crop *image_data* to the receipt region.
+    Returns None when no confident, worthwhile crop was found; the caller
+    then analyzes the original image.
+    """
+    try:
+        with Image.open(io.BytesIO(image_data)) as opened:
+            image = ImageOps.exif_transpose(opened).convert("RGB")
+    except (UnidentifiedImageError, OSError, ValueError):
+        return None
+
+    original_size = image.size
+    angle = 0.0
+    if RECEIPT_CROP_DESKEW:
+        mask = _paper_mask(image)
+        if mask is not None:
+            skew = _skew_angle(mask)
+            if _MIN_SKEW <= abs(skew) <= _MAX_SKEW:
+                angle = skew
+                image = image.rotate(
+                    angle,
+                    resample=Image.Resampling.BICUBIC,
+                    expand=True,
+                    fillcolor=(0, 0, 0),
+                )
+
+    mask = _paper_mask(image)
+    if mask is None:
+        return None
+    extent = _paper_extent(mask)
+    if extent is None:
+        return None
+
+    scale_x = image.width / mask.shape[1]
+    scale_y = image.height / mask.shape[0]
+    left, top, right, bottom = extent
+    margin_x = int(image.width * _MARGIN_FRACTION)
+    margin_y = int(image.height * _MARGIN_FRACTION)
+    box = (
+        max(0, int(left * scale_x) - margin_x),
+        max(0, int(top * scale_y) - margin_y),
+        min(image.width, math.ceil(right * scale_x) + margin_x),
+        min(image.height, math.ceil(bottom * scale_y) + margin_y),
+    )
+
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    if area > (1.0 - RECEIPT_CROP_MIN_AREA_REDUCTION) * image.width * image.height:
+        return None
+
+    buffer = io.BytesIO()
+    image.crop(box).save(buffer, format="JPEG", quality=_JPEG_QUALITY)
+    logger.info(
+        "[crop] Cropped %dx%d image to %dx%d (angle=%.1f)",
+        original_size[0],
+        original_size[1],
+        box[2] - box[0],
+        box[3] - box[1],
+        angle,
+    )
+    return CroppedImage(
+        data=buffer.getvalue(),
+        transform=CropTransform(
+            left=box[0],
+            top=box[1],
+            angle=angle,
+            original_size=original_size,
+            rotated_size=image.size,
+        ),
+    )
+
+
+def _paper_mask(image: Image.Image) -> Optional[np.ndarray]:
+    """Boolean mask of bright paper pixels on a small thumbnail."""
+    thumbnail = image.convert("L")
+    thumbnail.thumbnail((_ANALYSIS_SIZE, _ANALYSIS_SIZE))
+    gray = np.asarray(thumbnail, dtype=np.float32)
+    if min(gray.shape) < 8:
+        return None
+    threshold = _otsu_threshold(gray)
+    if threshold is None:
+        return None
+    mask = gray > threshold
+    paper_fraction = mask.mean()
+    if not _MIN_PAPER_FRACTION <= paper_fraction <= _MAX_PAPER_FRACTION:
+        return None
+    return mask
@@ -0,0 +1,259 @@
+"""
+Tiling support for very tall receipt images.
+
+Long grocery and restaurant receipts photographed top to bottom have an
+aspect ratio the model handles poorly: it downsamples until the text is
+unreadable or takes a long time. These images are split into overlapping
+horizontal segments that are analyzed concurrently (see
+ImageAnalyzer._analyze_tall_receipt), and the per-segment payloads are merged
+here into a single receipt payload. Line items repeated in the overlap
+between neighbouring segments are dropped, and bounding boxes are shifted
+back into full-image coordinates.
+"""
+
+import io
+import logging
+import math
+import os
+import re
+from dataclasses import dataclass
+from decimal import Decimal, InvalidOperation
+from typing import Optional
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+
+logger = logging.getLogger(__name__)
+
+RECEIPT_TILING_ENABLED: bool = os.getenv(
+    "RECEIPT_TILING_ENABLED", "true"
+).strip().lower() in ("1", "true", "yes")
+
+# Images at least this many times taller than wide are tiled.
+RECEIPT_TILING_MIN_ASPECT_RATIO: float = float(
+    os.getenv("RECEIPT_TILING_MIN_ASPECT_RATIO", "2.5")
+)
+
+# Target height of one segment, as a multiple of the image width.
+RECEIPT_TILING_SEGMENT_ASPECT_RATIO: float = float(
+    os.getenv("RECEIPT_TILING_SEGMENT_ASPECT_RATIO", "1.5")
+)
+
+# Fraction of a segment shared with its neighbour, so that no printed line is
+# only ever seen cut in half.
+RECEIPT_TILING_OVERLAP: float = float(os.getenv("RECEIPT_TILING_OVERLAP", "0.15"))
+
+RECEIPT_TILING_MAX_SEGMENTS: int = int(os.getenv("RECEIPT_TILING_MAX_SEGMENTS", "6"))
+
+_SEGMENT_JPEG_QUALITY = 90
+
+# Header fields come from the first segment that prints them, totals from the
+# last one (the totals block sits at the bottom of a receipt).
+_HEADER_FIELDS = ("merchant", "date", "payment_method")
+_TOTAL_FIELDS = ("subtotal", "tax", "tip", "gratuity", "total")
+
+_LINE_ITEM_FIELD_RE = re.compile(r"^(?:line_items|items)\.(\d+)\.(.+)$")
+
+
+@dataclass(frozen=True)
+class Segment:
+    """One horizontal strip of a tall receipt image, encoded as JPEG."""
+
+    index: int
+    top: int
+    bottom: int
+    data: bytes
+    mime_type: str = "image/jpeg"
+
+
+def plan_segments(width: int, height: int) -> list[tuple[int, int]]:
+    """
+    Compute overlapping (top, bottom) pixel bands for an image.
+    Returns an empty list when the image is not tall enough to tile.
+    """
+    if width <= 0 or height <= 0:
+        return []
+    if height / width < RECEIPT_TILING_MIN_ASPECT_RATIO:
+        return []
+
+    target = max(1, int(width * RECEIPT_TILING_SEGMENT_ASPECT_RATIO))
+    overlap = int(target * RECEIPT_TILING_OVERLAP)
+    count = math.ceil((height - overlap) / max(1, target - overlap))
+    count = max(2, min(count, RECEIPT_TILING_MAX_SEGMENTS))
+
+    # Stretch segments evenly so that `count` of them cover the full height.
+    segment_height = math.ceil((height + (count - 1) * overlap) / count)
+    step = segment_height - overlap
+    bands = []
+    for i in range(count):
+        top = i * step
+        bottom = height if i == count - 1 else min(height, top + segment_height)
+        bands.append((top, bottom))
+    return bands
+
+
+def split_tall_image(image_data: bytes) -> list[Segment]:
+    """
+    Split a tall receipt image into overlapping segments.
+    Returns an empty list when the image is not tall or cannot be decoded, in
+    which case the caller analyzes the whole image as usual.
+    """
+    try:
+        with Image.open(io.BytesIO(image_data)) as image:
+            # Phone photos carry their orientation in EXIF; the aspect ratio
+            # only means something once the image is upright.
+            upright = ImageOps.exif_transpose(image)
+            bands = plan_segments(upright.width, upright.height)
+            if not bands:
+                return []
+            rgb = upright.convert("RGB")
+            segments = []
+            for index, (top, bottom) in enumerate(bands):
+                buffer = io.BytesIO()
+                rgb.crop((0, top, rgb.width, bottom)).save(
+                    buffer, format="JPEG", quality=_SEGMENT_JPEG_QUALITY
+                )
+                segments.append(
+                    Segment(index=index, top=top, bottom=bottom, data=buffer.getvalue())
+                )
+    except (UnidentifiedImageError, OSError, ValueError) as e:
+        logger.debug("[tiling] Could not decode image for tiling: %s", e)
+        return []
+
+    logger.info(
+        "[tiling] Split %dx%d image into %d segments",
+        rgb.width,
+        rgb.height,
+        len(segments),
+    )
+    return segments
+
+
+def _line_item_key(item: dict) -> tuple[str, Optional[Decimal]]:
+    """Identity of a line item for overlap de-duplication."""
+    name = re.sub(r"[^a-z0-9]+", " ", str(item.get("name") or "").lower()).strip()
+    try:
+        total = Decimal(str(item.get("total_price"))).quantize(Decimal("0.01"))
+    except (InvalidOperation, ValueError, TypeError):
+        total = None
+    return name, total
+
+
+def _overlap_length(previous: list[dict], current: list[dict]) -> int:
+    """Longest run of items ending `previous` that also starts `current`."""
+    previous_keys = [_line_item_key(item) for item in previous]
+    current_keys = [_line_item_key(item) for item in current]
+    for k in range(min(len(previous_keys), len(current_keys)), 0, -1):
+        if previous_keys[-k:] == current_keys[:k]:
+            return k
+    return 0
+
+
+def _is_present(value) -> bool:
+    return value not in (None, "", 0, 0.0)
+
+
+def _shift_bbox(bbox, dy: int):
+    if isinstance(bbox, dict) and isinstance(bbox.get("y"), (int, float)):
+        return {**bbox, "y": bbox["y"] + dy}
+    if isinstance(bbox, (list, tuple)) and len(bbox) == 4:
+        x1, y1, x2, y2 = bbox
+        # Only the y components move; BoundingBox decides later whether the
+        # list is corners or origin+size, and both keep y at positions 1 (and 3).
+        is_corners = x2 > x1 and y2 > y1 and (x2 - x1) > 1 and (y2 - y1) > 1
+        return [x1, y1 + dy, x2, y2 + dy] if is_corners else [x1, y1 + dy, x2, y2]
+    return bbox
+
+
+def merge_segment_payloads(
+    segments: list[Segment], payloads: list[dict], dedupe_overlap: bool = True
+) -> Optional[dict]:
+    """
+    Merge per-segment receipt payloads (raw model JSON) into one payload.
+
+    Args:
+        segments: The segments, in top-to-bottom order
+        payloads: The parsed model response for each segment
+        dedupe_overlap: Drop line items repeated across neighbouring segments.
+            Disable for segments that do not overlap, such as PDF pages.
+    Returns a receipt payload in the same shape as a whole-image response,
+    or None when no segment produced any line items.
+    """
+    merged: dict = {"is_receipt": True}
+    line_items: list[dict] = []
+    item_metadata: list[dict] = []
+    # Metadata for top-level fields, keyed by field name: (segment index, entry)
+    field_metadata: dict[str, tuple[int, dict]] = {}
+    previous_items: list[dict] = []
+    chosen_segment: dict[str, int] = {}
+
+    for segment, payload in zip(segments, payloads):
+        if not isinstance(payload, dict):
+            continue
+
+        for name in _HEADER_FIELDS:
+            if name not in chosen_segment and _is_present(payload.get(name)):
+                merged[name] = payload[name]
+                chosen_segment[name] = segment.index
+        for name in _TOTAL_FIELDS:
+            if _is_present(payload.get(name)):
+                merged[name] = payload[name]
+                chosen_segment[name] = segment.index
+        if payload.get("tax_included_in_items"):
+            merged["tax_included_in_items"] = True
+
+        items = payload.get("line_items")
+        if items is None:
+            items = payload.get("items")
+        items = [item for item in (items or []) if isinstance(item, dict)]
+
+        skipped = _overlap_length(previous_items, items) if dedupe_overlap else 0
+        if skipped:
+            logger.debug(
+                "[tiling] Dropped %d line item(s) repeated in overlap before "
+                "segment %d",
+                skipped,
+                segment.index,
+            )
+        # Segment-local line item index -> merged index
+        index_map = {
+            local: len(line_items) + local - skipped
+            for local in range(skipped, len(items))
+        }
+        line_items.extend(items[skipped:])
+        previous_items = items
+
+        for entry in payload.get("fields_metadata") or []:
+            if not isinstance(entry, dict):
+                continue
+            field_name = str(entry.get("field_name", ""))
+            shifted = {**entry, "bbox": _shift_bbox(entry.get("bbox"), segment.top)}
+            match = _LINE_ITEM_FIELD_RE.match(field_name)
+            if match:
+                local_index = int(match.group(1))
+                if local_index in index_map:
+                    shifted["field_name"] = (
+                        f"line_items.{index_map[local_index]}.{match.group(2)}"
+                    )
+                    item_metadata.append(shifted)
+            elif field_name in chosen_segment:
+                if chosen_segment[field_name] == segment.index:
+                    field_metadata[field_name] = (segment.index, shifted)
+            else:
+                # Other printed fields (e.g. cardholder name) may show up in
+                # two segments' overlap; keep the first sighting.
+                field_metadata.setdefault(field_name, (segment.index, shifted))
+
+    if not line_items:
+        return None
+
+    fields_metadata = [
+        entry
+        for name, (index, entry) in field_metadata.items()
+        if chosen_segment.get(name, index) == index
+    ] + item_metadata
+
+    merged["line_items"] = line_items
+    if fields_metadata:
+        merged["fields_metadata"] = fields_metadata
+    return merged
@@ -0,0 +1,50 @@
+"""
+Money handling shared by the receipt schemas.
+
+Amounts are Decimal on the models and in the database (Numeric(12, 2)) and
+float in JSON. `Money` fields are rounded to cents while pydantic-core
+validates the input, so validators see amounts that are already exact cents
+and can add them without re-quantizing or re-assigning every field.
+Comparisons and tolerances work on integer cents (`to_cents`).
+
+Rounding is half-even, as Decimal.quantize uses with the default context.
+"""
+
+from decimal import ROUND_HALF_EVEN, Decimal
+from typing import Annotated
+
+from pydantic import AfterValidator
+
+
+CENT = Decimal("0.01")
+ZERO = Decimal("0.00")
+
+
+def quantize_cents(value: Decimal) -> Decimal:
+    """Round an amount to cents."""
+    return value.quantize(CENT, rounding=ROUND_HALF_EVEN)
+
+
+def to_cents(value) -> int:
+    """Amount (Decimal, int, float or numeric string) as integer cents."""
+    if value is None:
+        return 0
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return int(value.scaleb(2).to_integral_value(rounding=ROUND_HALF_EVEN))
+
+
+def from_cents(cents: int) -> Decimal:
+    """Integer cents as a two-place Decimal."""
+    return Decimal(cents).scaleb(-2)
+
+
+def line_total(price_per_item: Decimal, quantity: float) -> Decimal:
+    """price_per_item x quantity, rounded to cents."""
+    if float(quantity).is_integer():
+        return quantize_cents(price_per_item * int(quantity))
+    return quantize_cents(price_per_item * Decimal(str(quantity)))
+
+
+# A Decimal amount rounded to cents on validation.
+Money = Annotated[Decimal, AfterValidator(quantize_cents)]
@@ -17,6 +17,9 @@ from pydantic import (
     model_validator,
 )
 
+from schemas.money import ZERO, Money, line_total, quantize_cents
+
+
 logger = logging.getLogger(__name__)
 
 
@@ -33,7 +36,7 @@ class DecimalValidatorMixin:
     def safe_decimal(self, value) -> Decimal:
         """Convert None values to Decimal("0.00") for calculations"""
         if value is None:
-            return Decimal("0.00")
+            return ZERO
         return Decimal(value)
 
 
@@ -198,23 +201,22 @@ class LineItem(BaseModel, LineItemDecimalSerializerMixin):
 
     name: str
     quantity: float = Field(1.0, ge=0.0)
-    price_per_item: Decimal = Field(Decimal("0.00"), ge=Decimal("0.00"))
-    total_price: Decimal = Field(Decimal("0.00"), ge=Decimal("0.00"))
+    # Rounded in the validator: a computed total uses the unrounded unit price
+    # (e.g. fuel at 3.459/gal).
+    price_per_item: Decimal = Field(ZERO, ge=ZERO)
+    total_price: Money = Field(ZERO, ge=ZERO)
     assignments: List[str] = Field(default_factory=list)
 
     @model_validator(mode="after")
     def _compute_total_price(self):
         # Only compute if not explicitly provided
-        if self.total_price == Decimal("0"):
-            # Convert quantity to Decimal for calculation
-            quantity_decimal = Decimal(str(self.quantity))
-            self.total_price = (self.price_per_item * quantity_decimal).quantize(
-                Decimal("0.01")
-            )
-        else:
-            # Normalize any provided total_price to 2 decimals
-            self.total_price = Decimal(self.total_price).quantize(Decimal("0.01"))
-        self.price_per_item = Decimal(self.price_per_item).quantize(Decimal("0.01"))
+        if self.total_price == 0:
+            self.total_price = line_total(self.price_per_item, self.quantity)
+        # Assigning a field is much slower than the arithmetic; skip it when
+        # the price is already in cents (as it is for most items).
+        price_per_item = quantize_cents(self.price_per_item)
+        if price_per_item.compare_total(self.price_per_item):
+            self.price_per_item = price_per_item
         return self
 
 
@@ -299,78 +301,56 @@ class RegularReceiptBase(
     line_items: List[LineItem] = Field(
         default_factory=list, exclude=True
     )  # Exclude from database creation
-    subtotal: Optional[Decimal] = Field(Decimal("0.00"), ge=Decimal("0.00"))
-    tax: Optional[Decimal] = Field(Decimal("0.00"), ge=Decimal("0.00"))
-    original_tax: Optional[Decimal] = Field(Decimal("0.00"), ge=Decimal("0.00"))
-    tip: Optional[Decimal] = Field(Decimal("0.00"), ge=Decimal("0.00"))
-    original_tip: Optional[Decimal] = Field(Decimal("0.00"), ge=Decimal("0.00"))
-    gratuity: Optional[Decimal] = Field(Decimal("0.00"), ge=Decimal("0.00"))
-    total: Optional[Decimal] = Field(Decimal("0.00"), ge=Decimal("0.00"))
+    subtotal: Optional[Money] = Field(ZERO, ge=ZERO)
+    tax: Optional[Money] = Field(ZERO, ge=ZERO)
+    original_tax: Optional[Money] = Field(ZERO, ge=ZERO)
+    tip: Optional[Money] = Field(ZERO, ge=ZERO)
+    original_tip: Optional[Money] = Field(ZERO, ge=ZERO)
+    gratuity: Optional[Money] = Field(ZERO, ge=ZERO)
+    total: Optional[Money] = Field(ZERO, ge=ZERO)
     payment_method: Optional[str] = None
     tax_included_in_items: Optional[bool] = False
     tip_after_tax: Optional[bool] = Field(False)
-    display_subtotal: Optional[Decimal] = Field(Decimal("0.00"), ge=Decimal("0.00"))
-    items_total: Optional[Decimal] = Field(Decimal("0.00"), ge=Decimal("0.00"))
-    pretax_total: Optional[Decimal] = Field(Decimal("0.00"), ge=Decimal("0.00"))
-    posttax_total: Optional[Decimal] = Field(Decimal("0.00"), ge=Decimal("0.00"))
-    final_total: Optional[Decimal] = Field(Decimal("0.00"), ge=Decimal("0.00"))
+    display_subtotal: Optional[Money] = Field(ZERO, ge=ZERO)
+    items_total: Optional[Money] = Field(ZERO, ge=ZERO)
+    pretax_total: Optional[Money] = Field(ZERO, ge=ZERO)
+    posttax_total: Optional[Money] = Field(ZERO, ge=ZERO)
+    final_total: Optional[Money] = Field(ZERO, ge=ZERO)
 
     @model_validator(mode="after")
     def _recompute_aggregates(self):
-        items_sum = sum((li.total_price for li in self.line_items), start=Decimal("0"))
+        # Money fields are already in cents, so these sums are exact and need
+        # no re-quantizing; only the derived fields are assigned.
+        items_sum = sum((li.total_price for li in self.line_items), start=ZERO)
 
         # Fill missing or zeroed derived fields
-        self.items_total = self.safe_decimal(self.items_total or items_sum).quantize(
-            Decimal("0.01")
-        )
+        self.items_total = self.items_total or items_sum
 
-        if not self.subtotal or self.subtotal == 0:
-            tax_value = self.safe_decimal(self.tax)
+        tax_value = self.safe_decimal(self.tax)
+        if not self.subtotal:
             self.subtotal = (
                 items_sum if not self.tax_included_in_items else (items_sum - tax_value)
-            ).quantize(Decimal("0.01"))
+            )
+        if self.subtotal < ZERO:
+            self.subtotal = ZERO
 
-        self.subtotal = self.safe_decimal(self.subtotal)
-        if self.subtotal < Decimal("0.00"):
-            self.subtotal = Decimal("0.00")
+        self.pretax_total = self.subtotal
+        self.posttax_total = self.pretax_total + tax_value
 
-        self.pretax_total = self.subtotal.quantize(Decimal("0.01"))
-        tax_value = self.safe_decimal(self.tax)
-        self.posttax_total = (self.pretax_total + tax_value).quantize(Decimal("0.01"))
-
-        if self.posttax_total < Decimal("0.00"):
-            self.posttax_total = Decimal("0.00")
+        if self.posttax_total < ZERO:
+            self.posttax_total = ZERO
 
         # Prefer explicit total/final_total if provided, else compute
-        tip_value = self.safe_decimal(self.tip)
-        gratuity_value = self.safe_decimal(self.gratuity)
-        computed_total = (self.posttax_total + tip_value + gratuity_value).quantize(
-            Decimal("0.01")
+        computed_total = (
+            self.posttax_total
+            + self.safe_decimal(self.tip)
+            + self.safe_decimal(self.gratuity)
         )
 
-        if not self.total or self.total == 0:
+        if not self.total:
             self.total = computed_total
-        if not self.final_total or self.final_total == 0:
+        if not self.final_total:
             self.final_total = self.total
-
-        # Normalize inputs to 2 decimals
-        for attr in (
-            "subtotal",
-            "tax",
-            "original_tax",
-            "tip",
-            "original_tip",
-            "gratuity",
-            "total",
-            "display_subtotal",
-            "items_total",
-            "pretax_total",
-            "posttax_total",
-            "final_total",
-        ):
-            value = getattr(self, attr)
-            if value is not None:
-                setattr(self, attr, self.safe_decimal(value).quantize(Decimal("0.01")))
         return self
 
 
@@ -398,6 +378,61 @@ class RegularReceiptResponse(RegularReceipt):
     line_items: List[LineItemWithAssignmentsResponse]
 
 
+class ReceiptAnalysisResponse(BaseModel):
+    """
+    Response envelope for a receipt saved by /api/analyze-receipt.
+    Serialized straight to JSON bytes by pydantic-core; build it with
+    model_construct() around an already validated RegularReceiptResponse.
+    """
+
+    success: bool = True
+    is_receipt: bool = True
+    receipt_data: RegularReceiptResponse
+
+
+class ReceiptDetailResponse(BaseModel):
+    """
+    Response envelope for GET /api/receipts/<id>.
+    Serialized straight to JSON bytes by pydantic-core, like
+    ReceiptAnalysisResponse.
+    """
+
+    success: bool = True
+    receipt_data: RegularReceiptResponse
+
+
+class ReceiptSummaryResponse(BaseModel):
+    """
+    Slim receipt row for the receipt history list, without line items.
+    """
+
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    merchant: Optional[str] = None
+    date: Optional[date_type] = None
+    total: Optional[Decimal] = None
+    created_at: datetime
+    item_count: int = 0
+
+    @field_serializer("total")
+    def _serialize_total(self, v: Optional[Decimal]) -> float:
+        if v is None:
+            return 0.0
+        return float(v)
+
+
+class ReceiptHistoryResponse(BaseModel):
+    """
+    Response envelope for one page of GET /api/receipts. next_cursor is
+    None on the last page.
+    """
+
+    success: bool = True
+    receipts: List[ReceiptSummaryResponse]
+    next_cursor: Optional[str] = None
+
+
 # ============================================================================
 # TRANSPORTATION TICKET MODELS: Alternative receipt type
 # ============================================================================
@@ -424,21 +459,19 @@ class TransportationTicketBase(
     class_: Optional[str] = Field(
         None, alias="class", validation_alias=AliasChoices("class_", "class")
     )
-    fare: Optional[Decimal] = Field(Decimal("0.00"), ge=Decimal("0.00"))
+    fare: Optional[Money] = Field(ZERO, ge=ZERO)
     currency: Optional[str] = None
-    taxes: Optional[Decimal] = Field(Decimal("0.00"), ge=Decimal("0.00"))
-    total: Optional[Decimal] = Field(Decimal("0.00"), ge=Decimal("0.00"))
+    taxes: Optional[Money] = Field(ZERO, ge=ZERO)
+    total: Optional[Money] = Field(ZERO, ge=ZERO)
 
     @model_validator(mode="after")
     def _reconcile_totals(self):
-        # Normalize components to cents
-        self.fare = self.safe_decimal(self.fare).quantize(Decimal("0.01"))
-        self.taxes = self.safe_decimal(self.taxes).quantize(Decimal("0.01"))
+        # Components are already in cents (Money); fill in missing ones
+        self.fare = self.safe_decimal(self.fare)
+        self.taxes = self.safe_decimal(self.taxes)
         # Prefer explicit total; else compute
-        if not self.total or self.total == 0:
-            self.total = (self.fare + self.taxes).quantize(Decimal("0.01"))
-        else:
-            self.total = self.safe_decimal(self.total).quantize(Decimal("0.01"))
+        if not self.total:
+            self.total = self.fare + self.taxes
         return self
 
 
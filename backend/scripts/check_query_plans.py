@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Check that the hot queries are served by indexes.
+
+Runs EXPLAIN on the lookups every request makes (current user, a receipt's
+live line items and assignments, the receipt history page) and exits
+non-zero if any of them plans a sequential scan or does not use the partial
+index built for it (see the models' __table_args__). Sequential scans are
+disabled for the check (SET LOCAL enable_seqscan = off), so on a small
+development database a Seq Scan still in the plan means no index can
+answer the query, not just that the table is tiny.
+
+Needs PostgreSQL: point DATABASE_URL at the database to check.
+
+Usage:
+    cd backend
+    source venv/bin/activate
+    python scripts/check_query_plans.py
+"""
+
+import sys
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+from sqlalchemy import text
+
+
+# Add the backend directory to the path
+# Script is in scripts/; .parent called 2x: file → scripts → backend
+backend_dir = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(backend_dir))
+
+# Placeholder arguments; the plan does not depend on the rows existing.
+SAMPLE_AUTH_USER_ID = "user_query_plan_check"
+SAMPLE_ID = 1
+SAMPLE_LINE_ITEM_ID = str(uuid.uuid4())
+SAMPLE_RECEIPT_USER_ID = "01JQUERYPLANCHECK000000000"
+
+
+def hot_queries():
+    """Each hot query by name, with the partial index meant to answer it."""
+    # Imported once the backend directory is on the path.
+    from models import db
+    from models.assignment import Assignment
+    from models.receipt_line_item import ReceiptLineItem
+    from models.user import User
+    from models.user_receipt import UserReceipt
+
+    return {
+        "current user by auth_user_id": (
+            "ix_users_auth_user_id_live",
+            db.select(User)
+            .filter_by(auth_user_id=SAMPLE_AUTH_USER_ID, deleted_at=None)
+            .limit(1),
+        ),
+        "live line items of a receipt": (
+            "ix_receipt_line_items_receipt_id_live",
+            db.select(ReceiptLineItem)
+            .where(
+                ReceiptLineItem.receipt_id.in_([SAMPLE_ID]),
+                ReceiptLineItem.deleted_at.is_(None),
+            )
+            .order_by(ReceiptLineItem.id),
+        ),
+        "live assignments of a line item": (
+            "ix_assignments_receipt_line_item_id_live",
+            db.select(Assignment).where(
+                Assignment.receipt_line_item_id.in_([SAMPLE_LINE_ITEM_ID]),
+                Assignment.deleted_at.is_(None),
+            ),
+        ),
+        "live assignments of a receipt user": (
+            "ix_assignments_receipt_user_id_live",
+            db.select(Assignment).where(
+                Assignment.receipt_user_id == SAMPLE_RECEIPT_USER_ID,
+                Assignment.deleted_at.is_(None),
+            ),
+        ),
+        "receipt history page": (
+            "ix_user_receipts_user_history",
+            db.select(
+                UserReceipt.id,
+                UserReceipt.merchant,
+                UserReceipt.date,
+                UserReceipt.total,
+                UserReceipt.created_at,
+            )
+            .where(
+                UserReceipt.user_id == SAMPLE_ID,
+                UserReceipt.deleted_at.is_(None),
+                UserReceipt.created_at < datetime.now(timezone.utc),
+            )
+            .order_by(UserReceipt.created_at.desc(), UserReceipt.id)
+            .limit(21),
+        ),
+    }
+
+
+def plan_nodes(node):
+    """Yield a plan node and all of its descendants."""
+    yield node
+    for child in node.get("Plans", ()):
+        yield from plan_nodes(child)
+
+
+def explain(connection, statement):
+    """The JSON plan of a SQLAlchemy statement."""
+    compiled = statement.compile(
+        dialect=connection.dialect, compile_kwargs={"render_postcompile": True}
+    )
+    result = connection.exec_driver_sql(
+        f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params
+    )
+    return result.scalar()[0]["Plan"]
+
+
+def check_query_plans(connection):
+    """
+    Print each hot query's scans; return the names of those that seq scan or
+    do not use their index.
+    """
+    failures = []
+    for name, (expected_index, statement) in hot_queries().items():
+        with connection.begin():
+            connection.execute(text("SET LOCAL enable_seqscan = off"))
+            plan = explain(connection, statement)
+        nodes = list(plan_nodes(plan))
+        seq_scans = [n["Relation Name"] for n in nodes if n["Node Type"] == "Seq Scan"]
+        indexes = [n["Index Name"] for n in nodes if "Index Name" in n]
+        if seq_scans:
+            failures.append(name)
+            print(f"❌ {name}: Seq Scan on {', '.join(seq_scans)}")
+        elif expected_index not in indexes:
+            failures.append(name)
+            print(f"❌ {name}: {', '.join(indexes)} instead of {expected_index}")
+        else:
+            print(f"✅ {name}: {', '.join(indexes)}")
+    return failures
+
+
+def main():
+    from __init__ import create_app
+    from models import db
+
+    app = create_app()
+
+    with app.app_context():
+        if db.engine.dialect.name != "postgresql":
+            print("❌ Query plans can only be checked against PostgreSQL")
+            return 2
+        with db.engine.connect() as connection:
+            failures = check_query_plans(connection)
+
+    if failures:
+        print(f"\n{len(failures)} hot queries are not served by their index")
+        return 1
+    print("\nAll hot queries use their indexes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
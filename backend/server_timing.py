@@ -0,0 +1,104 @@
+"""
+Server-Timing response headers.
+
+Code on the request path records how long its phase took with `timed`, as a
+context manager or a decorator:
+
+    with timed("db", "Receipt insert"):
+        ...
+
+    @timed("auth", "Authentication")
+    def get_current_user(): ...
+
+Every response then carries the phases of its request, plus the total time
+spent in the app, as a Server-Timing header, e.g.
+
+    Server-Timing: auth;desc="Authentication";dur=3.2, blob;desc="Blob
+    upload";dur=241.7, ..., total;dur=2310.4
+
+which browser devtools show in the request's Timing tab. A phase entered
+several times in one request (e.g. response parsing on a retry) is reported
+once with the summed duration. Phases timed outside a request, such as in
+the worker threads of a segmented analysis, are not reported.
+
+Every timed phase is also observed in the splitzy_phase_duration_seconds
+histogram (see metrics), traced as a span (see tracing) and, with
+MEMORY_TRACKING_ENABLED, measured for peak allocations (see
+memory_tracking), with or without SERVER_TIMING_ENABLED.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from flask import Flask, Response, g, has_request_context
+
+from memory_tracking import track_phase
+from metrics import observe_phase
+from tracing import span
+
+
+SERVER_TIMING_ENABLED: bool = os.getenv(
+    "SERVER_TIMING_ENABLED", "true"
+).strip().lower() in ("1", "true", "yes")
+
+
+@contextmanager
+def timed(name: str, description: Optional[str] = None) -> Iterator[None]:
+    """Record the block (or decorated call) as a Server-Timing phase."""
+    start = time.perf_counter()
+    with span(name), track_phase(name):
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            observe_phase(name, seconds)
+            record_phase(name, seconds * 1000, description)
+
+
+def record_phase(
+    name: str, duration_ms: float, description: Optional[str] = None
+) -> None:
+    """Add a duration to a phase of the current request."""
+    if not has_request_context():
+        return
+    phases = g.get("server_timing")
+    if phases is None:
+        return
+    if name in phases:
+        phases[name][0] += duration_ms
+    else:
+        phases[name] = [duration_ms, description]
+
+
+def _start_request() -> None:
+    g.server_timing = {}
+    g.server_timing_start = time.perf_counter()
+
+
+def _add_header(response: Response) -> Response:
+    phases = g.pop("server_timing", None)
+    start = g.pop("server_timing_start", None)
+    if phases is None or start is None:
+        return response
+    entries = [
+        f'{name};desc="{description}";dur={duration_ms:.1f}'
+        if description
+        else f"{name};dur={duration_ms:.1f}"
+        for name, (duration_ms, description) in phases.items()
+    ]
+    entries.append(f"total;dur={(time.perf_counter() - start) * 1000:.1f}")
+    response.headers["Server-Timing"] = ", ".join(entries)
+    # Lets the frontend's own Resource Timing entries (and synthetic
+    # monitors running in a browser) read the phases across origins.
+    response.headers["Timing-Allow-Origin"] = "*"
+    return response
+
+
+def init_server_timing(app: Flask) -> None:
+    """Time every request of the app and report its phases in a header."""
+    if not SERVER_TIMING_ENABLED:
+        return
+    app.before_request(_start_request)
+    app.after_request(_add_header)
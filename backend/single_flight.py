@@ -0,0 +1,284 @@
+"""
+Single-flight coalescing of identical in-flight receipt analyses.
+
+When several requests carry the same image bytes at the same time (two
+members of a group uploading the same shared photo), only the first one runs
+the Gemini analysis. Followers in the same process wait on an in-memory call
+record; followers in other gunicorn workers poll a lease row in the
+analysis_leases table and read the shared result from it once the leader
+stores it. Only the analysis is shared: every caller still creates its own
+receipt row from the result.
+
+A follower that outwaits SINGLE_FLIGHT_WAIT_SECONDS gives up with
+SingleFlightTimeout rather than starting a model call of its own, which
+would run past the gunicorn worker timeout; the upload endpoint answers 503
+and the client's retry picks up the leader's result.
+
+A lease row is used instead of a Postgres advisory lock so that no pooled
+connection has to be held for the duration of a 30-60s model call.
+"""
+
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+from pydantic import BaseModel
+from sqlalchemy import and_, delete, or_, select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, dialect_insert
+from models.analysis_lease import AnalysisLease
+from schemas.receipt import NotAReceipt, RegularReceipt, TransportationTicket
+
+
+logger = logging.getLogger(__name__)
+
+SINGLE_FLIGHT_ENABLED: bool = os.getenv(
+    "SINGLE_FLIGHT_ENABLED", "true"
+).strip().lower() in ("1", "true", "yes")
+
+# How long a follower waits for the leader before giving up. Kept well under
+# the gunicorn worker timeout (120s) so the request can still answer.
+SINGLE_FLIGHT_WAIT_SECONDS: float = float(os.getenv("SINGLE_FLIGHT_WAIT_SECONDS", "60"))
+
+# Lease on a running analysis; must exceed the gunicorn worker timeout.
+SINGLE_FLIGHT_LEASE_SECONDS: int = int(os.getenv("SINGLE_FLIGHT_LEASE_SECONDS", "180"))
+
+# How long a finished result stays readable by followers polling the lease.
+# Kept short: this coalesces in-flight work, it is not a result cache.
+SINGLE_FLIGHT_RESULT_SECONDS: int = int(os.getenv("SINGLE_FLIGHT_RESULT_SECONDS", "10"))
+
+_POLL_INTERVAL_SECONDS = 0.5
+
+_STATUS_RUNNING = "running"
+_STATUS_COMPLETED = "completed"
+
+_RESULT_TYPES = {
+    cls.__name__: cls for cls in (RegularReceipt, TransportationTicket, NotAReceipt)
+}
+
+_table = AnalysisLease.__table__
+
+
+class SingleFlightTimeout(Exception):
+    """The analysis of the same image by another request did not finish in time."""
+
+
+class _InProcessCall:
+    """An analysis being run by one thread on behalf of all waiting threads."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[BaseModel] = None
+        self.error: Optional[BaseException] = None
+
+
+_calls: dict[str, _InProcessCall] = {}
+_calls_lock = threading.Lock()
+
+
+@dataclass
+class _LeaseState:
+    status: str
+    result_type: Optional[str] = None
+    result: Optional[dict] = None
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def analyze_once(image_sha256: str, analyze: Callable[[], BaseModel]) -> BaseModel:
+    """
+    Run *analyze* once for all concurrent callers with the same image hash.
+
+    Args:
+        image_sha256: Hex sha256 of the image bytes
+        analyze: Zero-argument callable returning the analysis Pydantic model
+    Returns the analysis result. Followers receive a deep copy so that no two
+    requests share a mutable model instance. If the leader raised, in-process
+    followers re-raise the same exception.
+
+    Raises:
+        SingleFlightTimeout: The leader did not finish within
+            SINGLE_FLIGHT_WAIT_SECONDS
+    """
+    if not SINGLE_FLIGHT_ENABLED:
+        return analyze()
+
+    with _calls_lock:
+        call = _calls.get(image_sha256)
+        is_leader = call is None
+        if is_leader:
+            call = _calls[image_sha256] = _InProcessCall()
+
+    if not is_leader:
+        if not call.done.wait(timeout=SINGLE_FLIGHT_WAIT_SECONDS):
+            logger.warning(
+                "[single_flight] Timed out waiting for in-process leader on %s",
+                image_sha256[:12],
+            )
+            raise SingleFlightTimeout(image_sha256)
+        if call.error is not None:
+            raise call.error
+        logger.info(
+            "[single_flight] Reused in-process analysis for %s", image_sha256[:12]
+        )
+        return call.result.model_copy(deep=True)
+
+    try:
+        call.result = _analyze_across_workers(image_sha256, analyze)
+        return call.result
+    except BaseException as e:
+        call.error = e
+        raise
+    finally:
+        with _calls_lock:
+            _calls.pop(image_sha256, None)
+        call.done.set()
+
+
+def _analyze_across_workers(
+    image_sha256: str, analyze: Callable[[], BaseModel]
+) -> BaseModel:
+    deadline = time.monotonic() + SINGLE_FLIGHT_WAIT_SECONDS
+    while True:
+        try:
+            state = _claim_lease(image_sha256)
+        except SQLAlchemyError:
+            # Coalescing is an optimisation; never fail an upload over it.
+            logger.exception(
+                "[single_flight] Lease table unavailable; analyzing without coalescing"
+            )
+            return analyze()
+
+        if state is None:
+            return _run_as_leader(image_sha256, analyze)
+
+        if state.status == _STATUS_COMPLETED:
+            result_cls = _RESULT_TYPES.get(state.result_type or "")
+            if result_cls is not None and state.result is not None:
+                logger.info(
+                    "[single_flight] Reused analysis from another worker for %s",
+                    image_sha256[:12],
+                )
+                return result_cls.model_validate(state.result)
+            logger.warning(
+                "[single_flight] Unreadable shared result type=%r for %s",
+                state.result_type,
+                image_sha256[:12],
+            )
+            return analyze()
+
+        if time.monotonic() >= deadline:
+            logger.warning(
+                "[single_flight] Timed out waiting for leader on %s",
+                image_sha256[:12],
+            )
+            raise SingleFlightTimeout(image_sha256)
+        time.sleep(_POLL_INTERVAL_SECONDS)
+
+
+def _run_as_leader(image_sha256: str, analyze: Callable[[], BaseModel]) -> BaseModel:
+    try:
+        result = analyze()
+    except BaseException:
+        # Let a waiting follower take over instead of sitting out the lease.
+        _drop_lease(image_sha256)
+        raise
+
+    try:
+        _store_result(image_sha256, result)
+    except SQLAlchemyError:
+        logger.exception(
+            "[single_flight] Failed to share result for %s", image_sha256[:12]
+        )
+        _drop_lease(image_sha256)
+    return result
+
+
+def _claim_lease(image_sha256: str) -> Optional[_LeaseState]:
+    """
+    Try to take the lease for *image_sha256*.
+
+    Returns None when this worker now holds the lease, otherwise the state of
+    the lease held by someone else.
+    """
+    now = _utcnow()
+    with db.engine.begin() as conn:
+        # Stale results and leases abandoned by a killed worker are reclaimable.
+        conn.execute(
+            delete(_table).where(
+                _table.c.image_sha256 == image_sha256,
+                or_(
+                    _table.c.expires_at < now,
+                    and_(
+                        _table.c.status == _STATUS_RUNNING,
+                        _table.c.locked_until < now,
+                    ),
+                ),
+            )
+        )
+        inserted = conn.execute(
+            dialect_insert(_table)
+            .values(
+                image_sha256=image_sha256,
+                status=_STATUS_RUNNING,
+                created_at=now,
+                locked_until=now + timedelta(seconds=SINGLE_FLIGHT_LEASE_SECONDS),
+                expires_at=now
+                + timedelta(
+                    seconds=SINGLE_FLIGHT_LEASE_SECONDS + SINGLE_FLIGHT_RESULT_SECONDS
+                ),
+            )
+            .on_conflict_do_nothing(index_elements=["image_sha256"])
+        )
+        if inserted.rowcount == 1:
+            return None
+
+        row = conn.execute(
+            select(_table.c.status, _table.c.result_type, _table.c.result).where(
+                _table.c.image_sha256 == image_sha256
+            )
+        ).first()
+
+    if row is None:
+        # Released between our insert and select; poll and claim again.
+        return _LeaseState(status=_STATUS_RUNNING)
+    return _LeaseState(
+        status=row.status, result_type=row.result_type, result=row.result
+    )
+
+
+def _store_result(image_sha256: str, result: BaseModel) -> None:
+    now = _utcnow()
+    with db.engine.begin() as conn:
+        conn.execute(
+            update(_table)
+            .where(_table.c.image_sha256 == image_sha256)
+            .values(
+                status=_STATUS_COMPLETED,
+                result_type=type(result).__name__,
+                result=result.model_dump(mode="json"),
+                expires_at=now + timedelta(seconds=SINGLE_FLIGHT_RESULT_SECONDS),
+            )
+        )
+
+
+def _drop_lease(image_sha256: str) -> None:
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(
+                delete(_table).where(
+                    _table.c.image_sha256 == image_sha256,
+                    _table.c.status == _STATUS_RUNNING,
+                )
+            )
+    except SQLAlchemyError:
+        logger.exception(
+            "[single_flight] Failed to drop lease for %s", image_sha256[:12]
+        )
@@ -1,5 +1,6 @@
 import os
 import sys
+from contextlib import contextmanager
 
 import pytest
 
@@ -14,13 +15,40 @@ parent_dir = os.path.dirname(backend_dir)  # root directory
 sys.path.insert(0, parent_dir)
 sys.path.insert(0, backend_dir)
 
-from werkzeug.security import generate_password_hash
+# create_app() validates these at startup; tests never talk to Clerk or Vercel.
+# The database URL is forced so a developer's .env can never point tests at a
+# real database (Flask-SQLAlchemy binds the engine inside create_app()).
+os.environ.setdefault("VERCEL_ENV", "development")
+os.environ.setdefault("CLERK_SECRET_KEY", "sk_test_dummy")
+os.environ.setdefault("CLERK_WEBHOOK_SECRET", "whsec_dGVzdC13ZWJob29rLXNlY3JldA==")
+os.environ.setdefault("CLERK_AUTHORIZED_PARTIES", "http://localhost:5173")
+os.environ.setdefault("VERCEL_FUNCTION_URL", "http://localhost:3001/api/upload-to-blob")
+os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+# Tests apply recorded Clerk webhook deliveries explicitly.
+os.environ.setdefault("CLERK_WEBHOOK_BATCHER_ENABLED", "false")
+
+from sqlalchemy import BigInteger
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.compiler import compiles
 
 from __init__ import create_app
 from models import db
 from models.receipt_line_item import ReceiptLineItem
 from models.user import User
 from models.user_receipt import UserReceipt
+from query_stats import QUERY_REPEAT_THRESHOLD, capture
+
+
+# The models target PostgreSQL; teach SQLite to create the same tables.
+# SQLite only auto-increments "INTEGER PRIMARY KEY" columns, not BIGINT.
+@compiles(JSONB, "sqlite")
+def _compile_jsonb_sqlite(type_, compiler, **kw):
+    return "JSON"
+
+
+@compiles(BigInteger, "sqlite")
+def _compile_biginteger_sqlite(type_, compiler, **kw):
+    return "INTEGER"
 
 
 @pytest.fixture(scope="function")
@@ -29,6 +57,7 @@ def test_app():
     app.config.update(
         {
             "TESTING": True,
+            "SECRET_KEY": "test-secret-key",
             "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",
             "WTF_CSRF_ENABLED": False,
             "SQLALCHEMY_ENGINE_OPTIONS": {"connect_args": {"check_same_thread": False}},
@@ -50,10 +79,7 @@ def test_client(test_app):
 @pytest.fixture(scope="function")
 def new_user(test_app):
     with test_app.app_context():
-        hashed_password = generate_password_hash("password", method="pbkdf2:sha256")
-        user = User(
-            username="testuser", email="test@example.com", password=hashed_password
-        )
+        user = User(auth_user_id="user_test123", display_name="testuser")
         db.session.add(user)
         db.session.commit()
         yield user
@@ -128,3 +154,28 @@ def mock_receipt_data():
         "posttax_total": 69.80,
         "final_total": 82.60,
     }
+
+
+@pytest.fixture(scope="function")
+def query_budget(test_app):
+    """
+    Fail unless the block runs at most `max_statements` SQL statements and
+    no statement shape QUERY_REPEAT_THRESHOLD times or more (an N+1):
+
+        with query_budget(3):
+            test_client.get(f"/api/receipts/{receipt_id}")
+    """
+
+    @contextmanager
+    def budget(max_statements, repeat_threshold=QUERY_REPEAT_THRESHOLD):
+        with capture() as stats:
+            yield stats
+        shapes = "\n".join(
+            f"  {count} x {shape}" for shape, count in stats.shapes.most_common()
+        )
+        assert stats.count <= max_statements, (
+            f"{stats.count} SQL statements, budget {max_statements}:\n{shapes}"
+        )
+        assert not stats.repeated(repeat_threshold), f"Likely N+1:\n{shapes}"
+
+    return budget
@@ -0,0 +1,157 @@
+"""
+Tests for `flask users backfill`, against a local fake of the Clerk user list.
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from clerk_backfill import ClerkUserPages, backfill_users
+from models import db
+from models.user import User
+
+
+class FakeClerk(ThreadingHTTPServer):
+    """GET /v1/users with limit/offset over a fixed list of user ids."""
+
+    def __init__(self, user_ids):
+        super().__init__(("127.0.0.1", 0), _FakeClerkHandler)
+        self.user_ids = user_ids
+        self.offsets = []
+        self.fail_next = 0
+        self.lock = threading.Lock()
+
+    @property
+    def api_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+
+class _FakeClerkHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path != "/v1/users" or self.headers["Authorization"] != (
+            "Bearer sk_test_dummy"
+        ):
+            self.send_error(404)
+            return
+        with server.lock:
+            if server.fail_next:
+                server.fail_next -= 1
+                self.send_response(429)
+                self.send_header("Retry-After", "0")
+                self.end_headers()
+                return
+            offset, limit = int(query["offset"][0]), int(query["limit"][0])
+            server.offsets.append(offset)
+        body = json.dumps(
+            [
+                {"id": uid, "object": "user"}
+                for uid in server.user_ids[offset : offset + limit]
+            ]
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def clerk_api():
+    server = FakeClerk([f"user_{i:04d}" for i in range(1, 1031)])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _backfill(test_app, clerk_api, *args):
+    runner = test_app.test_cli_runner()
+    return runner.invoke(
+        args=["users", "backfill", "--api-url", clerk_api.api_url, *args]
+    )
+
+
+def _auth_user_ids():
+    return set(db.session.scalars(db.select(User.auth_user_id)))
+
+
+class TestClerkUserPages:
+    def test_pages_until_a_short_page(self, clerk_api):
+        pages = list(
+            ClerkUserPages(
+                "sk_test_dummy", clerk_api.api_url, page_size=100, concurrency=4
+            )
+        )
+
+        ids = [uid for page in pages for uid in page]
+        assert sorted(ids) == clerk_api.user_ids
+        # 11 pages hold users; the pages already in flight past the end are empty
+        assert max(clerk_api.offsets) <= 1300
+
+    def test_rate_limits_are_retried(self, clerk_api):
+        clerk_api.fail_next = 2
+        pages = ClerkUserPages("sk_test_dummy", clerk_api.api_url, concurrency=1)
+
+        assert pages.fetch(0) == clerk_api.user_ids[:500]
+
+
+class TestBackfillCommand:
+    def test_creates_missing_users(self, test_app, clerk_api, new_user):
+        clerk_api.user_ids.append("user_test123")
+
+        result = _backfill(test_app, clerk_api, "--page-size", "100")
+
+        assert result.exit_code == 0, result.output
+        assert _auth_user_ids() == set(clerk_api.user_ids)
+        assert "only in Clerk: user_0001 (created)" in result.output
+        assert "only in Clerk: user_test123" not in result.output
+        assert result.output.endswith(
+            "1031 Clerk users, 1030 created, 0 live users not in Clerk\n"
+        )
+
+    def test_reports_users_missing_from_clerk(self, test_app, clerk_api, new_user):
+        result = _backfill(test_app, clerk_api)
+
+        assert result.exit_code == 0, result.output
+        assert "only in database: user_test123" in result.output
+
+    def test_dry_run_creates_nothing(self, test_app, clerk_api, new_user):
+        result = _backfill(test_app, clerk_api, "--dry-run")
+
+        assert result.exit_code == 0, result.output
+        assert _auth_user_ids() == {"user_test123"}
+        assert "only in Clerk: user_0001\n" in result.output
+        assert result.output.endswith(
+            "1030 Clerk users, 1030 missing, 1 live users not in Clerk\n"
+        )
+
+    def test_rerun_is_a_no_op(self, test_app, clerk_api):
+        _backfill(test_app, clerk_api)
+
+        result = _backfill(test_app, clerk_api)
+
+        assert result.exit_code == 0, result.output
+        assert (
+            result.output == "1030 Clerk users, 0 created, 0 live users not in Clerk\n"
+        )
+
+
+def test_deleted_users_are_not_reported(test_app, new_user):
+    new_user.deleted_at = db.func.now()
+    db.session.commit()
+    reported = []
+
+    counts = backfill_users([["user_a"]], report=lambda *r: reported.append(r))
+
+    assert reported == [("clerk", "user_a")]
+    assert counts["database_only"] == 0
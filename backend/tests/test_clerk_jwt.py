@@ -0,0 +1,165 @@
+"""
+Tests for local verification of Clerk session tokens.
+"""
+
+import time
+from unittest.mock import MagicMock, patch
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwt.algorithms import RSAAlgorithm
+
+from blueprints.auth import get_current_user
+from clerk_jwt import ClerkJWTVerifier, JWKSCache
+from principal_cache import clear_principal_cache
+
+
+PARTY = "http://localhost:5173"
+
+
+def _key_pair(kid):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = RSAAlgorithm.to_jwk(private_key.public_key(), as_dict=True)
+    return private_key, {**jwk, "kid": kid, "alg": "RS256", "use": "sig"}
+
+
+KEY_1, JWK_1 = _key_pair("ins_key_1")
+KEY_2, JWK_2 = _key_pair("ins_key_2")
+
+
+def _token(private_key=KEY_1, kid="ins_key_1", **claims):
+    now = int(time.time())
+    payload = {"sub": "user_test123", "iat": now, "exp": now + 60, "azp": PARTY}
+    payload.update(claims)
+    payload = {k: v for k, v in payload.items() if v is not None}
+    return jwt.encode(payload, private_key, algorithm="RS256", headers={"kid": kid})
+
+
+class FakeJWKS:
+    """A JWKS endpoint serving whichever keys are currently published."""
+
+    def __init__(self, *keys):
+        self.keys = list(keys)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return {"keys": self.keys}
+
+
+@pytest.fixture
+def endpoint():
+    return FakeJWKS(JWK_1)
+
+
+@pytest.fixture
+def verifier(endpoint):
+    return ClerkJWTVerifier(JWKSCache(endpoint, refresh_seconds=0), [PARTY], leeway=0)
+
+
+class TestVerify:
+    def test_valid_token(self, verifier, endpoint):
+        claims = verifier.verify(_token())
+
+        assert claims["sub"] == "user_test123"
+        assert endpoint.calls == 1
+
+    def test_verified_token_is_remembered(self, verifier):
+        token = _token()
+        verifier.verify(token)
+
+        with patch("clerk_jwt.jwt.decode") as decode:
+            assert verifier.verify(token)["sub"] == "user_test123"
+        decode.assert_not_called()
+
+    def test_remembered_token_still_expires(self, verifier):
+        token = _token()
+        verifier.verify(token)
+
+        with patch("clerk_jwt.time.time", return_value=time.time() + 61):
+            with pytest.raises(jwt.ExpiredSignatureError):
+                verifier.verify(token)
+
+    @pytest.mark.parametrize(
+        "claims",
+        [
+            {"azp": "https://evil.example"},
+            {"azp": None},
+            {"exp": int(time.time()) - 10},
+            {"sub": None},
+        ],
+        ids=["other-party", "no-party", "expired", "no-subject"],
+    )
+    def test_rejected_claims(self, verifier, claims):
+        with pytest.raises(jwt.InvalidTokenError):
+            verifier.verify(_token(**claims))
+
+    def test_forged_signature(self, verifier):
+        with pytest.raises(jwt.InvalidSignatureError):
+            verifier.verify(_token(private_key=KEY_2, kid="ins_key_1"))
+
+    def test_garbage(self, verifier):
+        with pytest.raises(jwt.InvalidTokenError):
+            verifier.verify("not.a.jwt")
+
+
+def _later(seconds=31):
+    """Move the JWKS refetch clock past its rate limit."""
+    return patch("clerk_jwt.time.monotonic", return_value=time.monotonic() + seconds)
+
+
+class TestKeyRotation:
+    def test_new_kid_refetches_the_jwks(self, verifier, endpoint):
+        verifier.verify(_token())
+        endpoint.keys = [JWK_1, JWK_2]
+
+        with _later():
+            claims = verifier.verify(_token(private_key=KEY_2, kid="ins_key_2"))
+
+        assert claims["sub"] == "user_test123"
+        assert endpoint.calls == 2
+
+    def test_unknown_kids_refetch_at_most_once(self, verifier, endpoint):
+        verifier.verify(_token())
+
+        with _later():
+            for kid in ("made_up_1", "made_up_2", "made_up_3"):
+                with pytest.raises(jwt.InvalidTokenError):
+                    verifier.verify(_token(private_key=KEY_2, kid=kid))
+
+        assert endpoint.calls == 2
+
+    def test_failed_fetch_keeps_serving_known_keys(self, verifier, endpoint):
+        token = _token(iat=int(time.time()) - 1)
+        verifier.verify(_token())
+        endpoint.keys = [{"kty": "garbage"}]
+
+        with _later(), pytest.raises(jwt.InvalidTokenError):
+            verifier.verify(_token(kid="made_up"))
+        assert endpoint.calls == 2
+        assert verifier.verify(token)["sub"] == "user_test123"
+
+
+class TestGetCurrentUser:
+    def test_local_verification_skips_the_sdk(self, test_app, new_user, verifier):
+        clear_principal_cache()
+        sdk = MagicMock()
+        test_app.config.update(CLERK_SDK=sdk, CLERK_JWT_VERIFIER=verifier)
+
+        with test_app.test_request_context(
+            headers={"Authorization": f"Bearer {_token()}"}
+        ):
+            user = get_current_user()
+
+        assert user.id == new_user.id
+        sdk.authenticate_request.assert_not_called()
+        clear_principal_cache()
+
+    def test_rejected_token(self, test_app, new_user, verifier):
+        test_app.config.update(CLERK_SDK=MagicMock(), CLERK_JWT_VERIFIER=verifier)
+
+        with test_app.test_request_context(
+            headers={"Authorization": f"Bearer {_token(azp='https://evil.example')}"}
+        ):
+            assert get_current_user() is None
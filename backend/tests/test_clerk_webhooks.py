@@ -0,0 +1,218 @@
+"""
+Tests for asynchronous, deduplicated ingestion of Clerk webhooks.
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import count
+from unittest.mock import patch
+
+from sqlalchemy import event, update
+from svix.webhooks import Webhook
+
+import clerk_webhooks
+from clerk_webhooks import (
+    drain_pending_deliveries,
+    get_clerk_webhook_counts,
+    process_pending_deliveries,
+)
+from models import db
+from models.clerk_webhook_delivery import ClerkWebhookDelivery
+from models.user import User
+
+
+_message_ids = count()
+
+
+def _send(test_client, event_type, clerk_user_id, svix_id=None, signature=None):
+    svix_id = svix_id or f"msg_{next(_message_ids)}"
+    payload = json.dumps({"type": event_type, "data": {"id": clerk_user_id}})
+    timestamp = datetime.now(timezone.utc)
+    if signature is None:
+        signature = Webhook(os.environ["CLERK_WEBHOOK_SECRET"]).sign(
+            svix_id, timestamp, payload
+        )
+    return test_client.post(
+        "/api/webhooks/clerk",
+        data=payload,
+        headers={
+            "svix-id": svix_id,
+            "svix-timestamp": str(int(timestamp.timestamp())),
+            "svix-signature": signature,
+        },
+    )
+
+
+def _live_users():
+    return set(
+        db.session.scalars(
+            db.select(User.auth_user_id).where(User.deleted_at.is_(None))
+        )
+    )
+
+
+def _pending():
+    return db.session.scalar(
+        db.select(db.func.count()).where(ClerkWebhookDelivery.processed_at.is_(None))
+    )
+
+
+class TestEndpoint:
+    def test_delivery_is_queued_not_applied(self, test_app, test_client):
+        response = _send(test_client, "user.created", "user_a")
+
+        assert response.status_code == 202
+        assert _pending() == 1
+        assert "user_a" not in _live_users()
+
+    def test_retried_delivery_is_acknowledged_once(self, test_app, test_client):
+        before = get_clerk_webhook_counts()
+
+        first = _send(test_client, "user.created", "user_a", svix_id="msg_retry")
+        retry = _send(test_client, "user.created", "user_a", svix_id="msg_retry")
+
+        assert first.status_code == 202
+        assert retry.status_code == 200
+        assert retry.get_json()["duplicate"] is True
+        assert _pending() == 1
+        after = get_clerk_webhook_counts()
+        assert after["accepted"] - before["accepted"] == 1
+        assert after["duplicates"] - before["duplicates"] == 1
+
+    def test_processed_delivery_is_still_recognised(self, test_app, test_client):
+        _send(test_client, "user.created", "user_a", svix_id="msg_done")
+        process_pending_deliveries()
+
+        retry = _send(test_client, "user.created", "user_a", svix_id="msg_done")
+
+        assert retry.status_code == 200
+        assert _pending() == 0
+
+    def test_invalid_signature_is_not_recorded(self, test_app, test_client):
+        response = _send(test_client, "user.created", "user_a", signature="v1,Zm9v")
+
+        assert response.status_code == 401
+        assert _pending() == 0
+
+    def test_other_event_types_are_ignored(self, test_app, test_client):
+        response = _send(test_client, "session.created", "sess_1")
+
+        assert response.status_code == 200
+        assert _pending() == 0
+
+
+class TestBatcher:
+    def test_burst_is_applied_in_constant_statements(self, test_app, test_client):
+        for i in range(25):
+            _send(test_client, "user.created", f"user_{i}")
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            applied = process_pending_deliveries()
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+
+        assert applied == 25
+        # SELECT the batch, INSERT the users, UPDATE processed_at
+        assert len(statements) == 3
+        assert {f"user_{i}" for i in range(25)} <= _live_users()
+        assert _pending() == 0
+
+    def test_latest_event_per_user_wins(self, test_app, test_client, new_user):
+        _send(test_client, "user.created", "user_gone")
+        _send(test_client, "user.deleted", "user_gone")
+        _send(test_client, "user.updated", "user_test123")
+        _send(test_client, "user.deleted", "user_test123")
+
+        process_pending_deliveries()
+
+        assert db.session.get(User, new_user.id).deleted_at is not None
+        assert not _live_users() & {"user_gone", "user_test123"}
+
+    def test_existing_user_is_left_alone(self, test_app, test_client, new_user):
+        _send(test_client, "user.created", "user_test123")
+        _send(test_client, "user.updated", "user_test123")
+
+        process_pending_deliveries()
+
+        users = db.session.scalars(
+            db.select(User).filter_by(auth_user_id="user_test123")
+        ).all()
+        assert [u.id for u in users] == [new_user.id]
+        assert users[0].display_name == "testuser"
+
+    def test_batches_are_bounded(self, test_app, test_client):
+        for i in range(3):
+            _send(test_client, "user.created", f"user_{i}")
+
+        assert process_pending_deliveries(limit=2) == 2
+        assert _pending() == 1
+        assert process_pending_deliveries(limit=2) == 1
+
+    def test_drain_prunes_expired_deliveries(self, test_app, test_client):
+        _send(test_client, "user.created", "user_old", svix_id="msg_old")
+        _send(test_client, "user.created", "user_new", svix_id="msg_new")
+        db.session.execute(
+            update(ClerkWebhookDelivery)
+            .where(ClerkWebhookDelivery.svix_id == "msg_old")
+            .values(expires_at=datetime.now(timezone.utc) - timedelta(seconds=1))
+        )
+        db.session.commit()
+
+        assert drain_pending_deliveries() == 2
+
+        remaining = db.session.scalars(db.select(ClerkWebhookDelivery.svix_id)).all()
+        assert remaining == ["msg_new"]
+
+
+def test_batcher_thread_applies_deliveries(test_app, test_client):
+    with (
+        patch.object(clerk_webhooks, "CLERK_WEBHOOK_BATCHER_ENABLED", True),
+        patch.object(clerk_webhooks, "CLERK_WEBHOOK_BATCH_LINGER_SECONDS", 0),
+    ):
+        before = get_clerk_webhook_counts()["applied"]
+        _send(test_client, "user.created", "user_async")
+
+        deadline = time.monotonic() + 5
+        while get_clerk_webhook_counts()["applied"] == before:
+            assert time.monotonic() < deadline, "batcher did not run"
+            time.sleep(0.01)
+
+    db.session.expire_all()
+    assert "user_async" in _live_users()
+
+
+class _StopBatcher(BaseException):
+    """Escapes the batcher's exception handler to end its loop."""
+
+
+def test_failed_drain_is_retried_without_a_new_delivery(test_app):
+    def run():
+        try:
+            clerk_webhooks._run_batcher(test_app)
+        except _StopBatcher:
+            pass
+
+    with (
+        patch.object(
+            clerk_webhooks,
+            "drain_pending_deliveries",
+            side_effect=[RuntimeError("database unavailable"), 1, _StopBatcher],
+        ) as drain,
+        patch.object(clerk_webhooks, "CLERK_WEBHOOK_SWEEP_SECONDS", 0.01),
+        patch.object(clerk_webhooks, "_wakeup", threading.Event()),
+    ):
+        batcher = threading.Thread(target=run)
+        batcher.start()
+        batcher.join(timeout=5)
+
+    assert not batcher.is_alive()
+    # Swept at start, retried after the failure, then stopped: never woken.
+    assert drain.call_count == 3
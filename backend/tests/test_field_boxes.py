@@ -0,0 +1,116 @@
+"""
+Tests for packed storage of fields_metadata.
+"""
+
+import io
+import json
+from unittest.mock import patch
+
+from field_boxes import (
+    load_fields_metadata,
+    pack_fields_metadata,
+    unpack_fields_metadata,
+)
+from models import db
+from models.receipt_field_boxes import ReceiptFieldBoxes
+from schemas.receipt import ReceiptFieldsMetadata, RegularReceipt
+
+
+def _entry(field_name, x=1, y=2, width=30, height=10, **flags):
+    return {
+        "field_name": field_name,
+        "bbox": {"x": x, "y": y, "width": width, "height": height},
+        **flags,
+    }
+
+
+def _metadata(*entries) -> ReceiptFieldsMetadata:
+    return ReceiptFieldsMetadata.model_validate({"fields": list(entries)})
+
+
+class TestPacking:
+    def test_round_trip(self):
+        metadata = _metadata(
+            _entry("merchant"),
+            _entry("line_items.0.name", y=100),
+            _entry("line_items.12.total_price", x=500, y=900),
+            _entry("line_items.3.discount"),
+            _entry("line_items.4.discount"),
+            _entry(
+                "cardholder_name",
+                is_pii=True,
+                pii_category="personal_names",
+            ),
+            _entry("total", pii_category="payment_card_details"),
+        )
+
+        assert unpack_fields_metadata(pack_fields_metadata(metadata)) == metadata
+
+    def test_large_coordinates_round_trip(self):
+        metadata = _metadata(_entry("total", y=70000, height=12))
+
+        assert unpack_fields_metadata(pack_fields_metadata(metadata)) == metadata
+
+    def test_much_smaller_than_json(self):
+        metadata = _metadata(
+            *(
+                _entry(f"line_items.{i}.{name}", x=40 * k, y=30 * i)
+                for i in range(200)
+                for k, name in enumerate(
+                    ("name", "quantity", "price_per_item", "total_price")
+                )
+            )
+        )
+
+        packed = pack_fields_metadata(metadata)
+
+        assert len(packed) == 6 + 800 * 13
+        assert len(packed) * 8 < len(metadata.model_dump_json())
+
+
+BLOB_URL = "https://fake-blob-storage.com/receipt.jpg"
+
+
+@patch("blueprints.receipts.upload_to_blob_storage", return_value=BLOB_URL)
+@patch("blueprints.receipts.ImageAnalyzer")
+class TestStoredWithReceipt:
+    def _post(self, test_client):
+        return test_client.post(
+            "/api/analyze-receipt",
+            data={"file": (io.BytesIO(b"receipt"), "receipt.jpg")},
+            content_type="multipart/form-data",
+        )
+
+    def test_metadata_is_stored_and_loaded_lazily(
+        self, mock_analyzer_cls, mock_upload, test_client, test_app, mock_receipt_data
+    ):
+        metadata = _metadata(
+            _entry("merchant"),
+            _entry("line_items.1.name", y=200),
+            _entry("card_last4", is_pii=True, pii_category="payment_card_details"),
+        )
+        mock_analyzer_cls.return_value.analyze_image.return_value = (
+            RegularReceipt.model_validate(mock_receipt_data).model_copy(
+                update={"fields_metadata": metadata}
+            )
+        )
+
+        response = self._post(test_client)
+
+        receipt_id = json.loads(response.data)["receipt_data"]["id"]
+        with test_app.app_context():
+            assert load_fields_metadata(receipt_id) == metadata
+
+    def test_nothing_stored_without_metadata(
+        self, mock_analyzer_cls, mock_upload, test_client, test_app, mock_receipt_data
+    ):
+        mock_analyzer_cls.return_value.analyze_image.return_value = (
+            RegularReceipt.model_validate(mock_receipt_data)
+        )
+
+        response = self._post(test_client)
+
+        receipt_id = json.loads(response.data)["receipt_data"]["id"]
+        with test_app.app_context():
+            assert db.session.get(ReceiptFieldBoxes, receipt_id) is None
+            assert load_fields_metadata(receipt_id) is None
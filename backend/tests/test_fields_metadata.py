@@ -0,0 +1,72 @@
+"""
+Tests for fields_metadata handling in ImageAnalyzer._with_structured_output.
+"""
+
+import json
+import logging
+
+import pytest
+
+from image_analyzer import ImageAnalyzer
+
+
+def _receipt(fields_metadata) -> str:
+    return json.dumps(
+        {
+            "is_receipt": True,
+            "line_items": [
+                {"name": "Tea", "quantity": 1, "price_per_item": 3, "total_price": 3}
+            ],
+            "subtotal": 3,
+            "total": 3,
+            "fields_metadata": fields_metadata,
+        }
+    )
+
+
+@pytest.fixture()
+def analyzer():
+    return ImageAnalyzer.__new__(ImageAnalyzer)
+
+
+class TestFieldsMetadata:
+    def test_corner_list_is_coerced_and_logged_once(self, analyzer, caplog):
+        raw = _receipt([{"field_name": "merchant", "bbox": [10, 20, 110, 60]}])
+
+        with caplog.at_level(logging.WARNING, logger="schemas.receipt"):
+            result = analyzer._with_structured_output(raw)
+
+        bbox = result.fields_metadata.fields[0].bbox
+        assert (bbox.x, bbox.y, bbox.width, bbox.height) == (10, 20, 100, 40)
+        coercions = [r for r in caplog.records if "corner-coordinate" in r.message]
+        assert len(coercions) == 1
+
+    def test_invalid_entries_are_dropped(self, analyzer):
+        raw = _receipt(
+            [
+                {
+                    "field_name": "items.0.name",
+                    "bbox": {"x": 1, "y": 2, "width": 3, "height": 4},
+                },
+                {
+                    "field_name": "total",
+                    "bbox": {"x": -1, "y": 0, "width": 5, "height": 5},
+                },
+                {
+                    "field_name": "card",
+                    "bbox": {"x": 0, "y": 0, "width": 5, "height": 5},
+                    "is_pii": True,
+                },
+            ]
+        )
+
+        result = analyzer._with_structured_output(raw)
+
+        assert [f.field_name for f in result.fields_metadata.fields] == [
+            "line_items.0.name"
+        ]
+
+    def test_no_valid_entries_clears_metadata(self, analyzer):
+        raw = _receipt([{"field_name": "total", "bbox": "nowhere"}])
+
+        assert analyzer._with_structured_output(raw).fields_metadata is None
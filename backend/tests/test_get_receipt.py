@@ -0,0 +1,127 @@
+"""
+Tests for GET /api/receipts/<id>.
+"""
+
+import json
+from datetime import datetime, timezone
+
+from models import db
+from models.assignment import Assignment
+from models.receipt_line_item import ReceiptLineItem
+from models.receipt_user import ReceiptUser
+from models.user_receipt import UserReceipt
+
+
+def _create_receipt(user, items, assignments_per_item):
+    """A receipt whose line items are each split between receipt users."""
+    receipt = UserReceipt(user_id=user.id, merchant="Split Diner", total=10)
+    db.session.add(receipt)
+    db.session.flush()
+    receipt_users = [
+        ReceiptUser(
+            id=f"01RU{receipt.id:04d}{index:018d}",
+            user_id=user.id if index == 0 else None,
+            display_name=f"Guest {index}",
+        )
+        for index in range(assignments_per_item)
+    ]
+    db.session.add_all(receipt_users)
+    db.session.flush()
+    for item_index in range(items):
+        line_item = ReceiptLineItem(
+            receipt_id=receipt.id,
+            name=f"Dish {item_index}",
+            quantity=1,
+            price_per_item=4,
+            total_price=4,
+        )
+        db.session.add(line_item)
+        db.session.flush()
+        db.session.add_all(
+            Assignment(
+                id=f"01AS{receipt.id:04d}{item_index:04d}{index:014d}",
+                receipt_line_item_id=line_item.id,
+                receipt_user_id=receipt_user.id,
+                share_percentage=100 / assignments_per_item,
+            )
+            for index, receipt_user in enumerate(receipt_users)
+        )
+    db.session.commit()
+    return receipt.id
+
+
+class TestGetReceipt:
+    def test_returns_receipt_with_assignments(self, test_app, test_client, new_user):
+        with test_app.app_context():
+            receipt_id = _create_receipt(new_user, items=2, assignments_per_item=2)
+
+        response = test_client.get(f"/api/receipts/{receipt_id}")
+
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data["success"] is True
+        receipt = data["receipt_data"]
+        assert receipt["id"] == receipt_id
+        assert receipt["merchant"] == "Split Diner"
+        assert len(receipt["line_items"]) == 2
+        assignments = receipt["line_items"][0]["assignments"]
+        assert sorted(a["display_name"] for a in assignments) == ["Guest 0", "Guest 1"]
+        users = [a["user"] for a in assignments]
+        assert {"auth_user_id": "user_test123"}.items() <= next(
+            user for user in users if user is not None
+        ).items()
+
+    def test_query_count_is_constant(
+        self, test_app, test_client, new_user, query_budget
+    ):
+        with test_app.app_context():
+            small_id = _create_receipt(new_user, items=1, assignments_per_item=1)
+            large_id = _create_receipt(new_user, items=25, assignments_per_item=4)
+
+        with query_budget(3) as small_stats:
+            small = test_client.get(f"/api/receipts/{small_id}")
+        with query_budget(3) as large_stats:
+            large = test_client.get(f"/api/receipts/{large_id}")
+
+        assert small.status_code == large.status_code == 200
+        assert len(json.loads(large.data)["receipt_data"]["line_items"]) == 25
+        assert small_stats.count == large_stats.count == 3
+
+    def test_soft_deleted_rows_are_filtered(self, test_app, test_client, new_user):
+        now = datetime.now(timezone.utc)
+        with test_app.app_context():
+            receipt_id = _create_receipt(new_user, items=3, assignments_per_item=2)
+            line_items = db.session.scalars(
+                db.select(ReceiptLineItem)
+                .filter_by(receipt_id=receipt_id)
+                .order_by(ReceiptLineItem.name)
+            ).all()
+            line_items[0].deleted_at = now
+            line_items[1].assignments[0].deleted_at = now
+            db.session.commit()
+            live_item_ids = {str(item.id) for item in line_items[1:]}
+
+        response = test_client.get(f"/api/receipts/{receipt_id}")
+
+        receipt = json.loads(response.data)["receipt_data"]
+        assert {item["id"] for item in receipt["line_items"]} == live_item_ids
+        assert sorted(len(item["assignments"]) for item in receipt["line_items"]) == [
+            1,
+            2,
+        ]
+
+    def test_deleted_receipt_not_found(self, test_app, test_client, new_receipt):
+        with test_app.app_context():
+            receipt = db.session.get(UserReceipt, new_receipt.id)
+            receipt.deleted_at = datetime.now(timezone.utc)
+            db.session.commit()
+
+        response = test_client.get(f"/api/receipts/{new_receipt.id}")
+
+        assert response.status_code == 404
+        assert json.loads(response.data)["success"] is False
+
+    def test_unknown_receipt_not_found(self, test_client):
+        response = test_client.get("/api/receipts/999999")
+
+        assert response.status_code == 404
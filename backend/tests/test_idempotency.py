@@ -0,0 +1,138 @@
+"""
+Tests for Idempotency-Key handling on /api/analyze-receipt.
+"""
+
+import hashlib
+import io
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+import pytest
+
+import idempotency
+from models import db
+from models.idempotency_key import IdempotencyKey
+from models.user_receipt import UserReceipt
+from schemas.receipt import RegularReceipt
+
+
+BLOB_URL = "https://fake-blob-storage.com/receipt.jpg"
+
+
+@pytest.fixture(autouse=True)
+def _clear_completed_cache():
+    idempotency._completed_cache.clear()
+    yield
+    idempotency._completed_cache.clear()
+
+
+def _post(test_client, image_bytes=b"receipt-bytes", key="key-1"):
+    headers = {"Idempotency-Key": key} if key is not None else {}
+    return test_client.post(
+        "/api/analyze-receipt",
+        data={"file": (io.BytesIO(image_bytes), "receipt.jpg")},
+        content_type="multipart/form-data",
+        headers=headers,
+    )
+
+
+@patch("blueprints.receipts.upload_to_blob_storage", return_value=BLOB_URL)
+@patch("blueprints.receipts.ImageAnalyzer")
+class TestAnalyzeReceiptIdempotency:
+    def test_duplicate_replays_stored_response(
+        self, mock_analyzer_cls, mock_upload, test_client, mock_receipt_data
+    ):
+        mock_analyzer_cls.return_value.analyze_image.return_value = (
+            RegularReceipt.model_validate(mock_receipt_data)
+        )
+
+        first = _post(test_client)
+        second = _post(test_client)
+
+        assert first.status_code == 200
+        assert second.status_code == 200
+        assert second.headers.get("Idempotent-Replayed") == "true"
+        assert second.get_json() == first.get_json()
+        mock_upload.assert_called_once()
+        mock_analyzer_cls.return_value.analyze_image.assert_called_once()
+        assert UserReceipt.query.count() == 1
+
+    def test_replay_survives_cold_cache(
+        self, mock_analyzer_cls, mock_upload, test_client, mock_receipt_data
+    ):
+        """Another worker has no cached copy and must read the stored body."""
+        mock_analyzer_cls.return_value.analyze_image.return_value = (
+            RegularReceipt.model_validate(mock_receipt_data)
+        )
+
+        first = _post(test_client)
+        idempotency._completed_cache.clear()
+        second = _post(test_client)
+
+        assert second.get_json() == first.get_json()
+        mock_analyzer_cls.return_value.analyze_image.assert_called_once()
+
+    def test_key_reused_with_different_payload_is_rejected(
+        self, mock_analyzer_cls, mock_upload, test_client, mock_receipt_data
+    ):
+        mock_analyzer_cls.return_value.analyze_image.return_value = (
+            RegularReceipt.model_validate(mock_receipt_data)
+        )
+
+        _post(test_client, image_bytes=b"first-image")
+        response = _post(test_client, image_bytes=b"second-image")
+
+        assert response.status_code == 422
+        mock_analyzer_cls.return_value.analyze_image.assert_called_once()
+
+    @patch("idempotency.IDEMPOTENCY_WAIT_SECONDS", 0)
+    def test_concurrent_duplicate_gets_409(
+        self, mock_analyzer_cls, mock_upload, test_client
+    ):
+        now = datetime.now(timezone.utc)
+        db.session.add(
+            IdempotencyKey(
+                key="anonymous:key-1",
+                request_fingerprint=hashlib.sha256(b"receipt-bytes").hexdigest(),
+                status="in_progress",
+                locked_until=now + timedelta(minutes=3),
+                expires_at=now + timedelta(days=1),
+            )
+        )
+        db.session.commit()
+
+        response = _post(test_client)
+
+        assert response.status_code == 409
+        mock_upload.assert_not_called()
+
+    def test_server_error_releases_key(
+        self, mock_analyzer_cls, mock_upload, test_client, mock_receipt_data
+    ):
+        """A 5xx is retryable: the next attempt with the same key runs again."""
+        mock_upload.side_effect = [None, BLOB_URL]
+        mock_analyzer_cls.return_value.analyze_image.return_value = (
+            RegularReceipt.model_validate(mock_receipt_data)
+        )
+
+        failed = _post(test_client)
+        retried = _post(test_client)
+
+        assert failed.status_code == 500
+        assert retried.status_code == 200
+        assert "Idempotent-Replayed" not in retried.headers
+        assert mock_upload.call_count == 2
+
+    @patch("single_flight.SINGLE_FLIGHT_ENABLED", False)
+    def test_without_header_requests_are_not_deduplicated(
+        self, mock_analyzer_cls, mock_upload, test_client, mock_receipt_data
+    ):
+        mock_analyzer_cls.return_value.analyze_image.return_value = (
+            RegularReceipt.model_validate(mock_receipt_data)
+        )
+
+        _post(test_client, key=None)
+        _post(test_client, key=None)
+
+        assert mock_analyzer_cls.return_value.analyze_image.call_count == 2
+        assert IdempotencyKey.query.count() == 0
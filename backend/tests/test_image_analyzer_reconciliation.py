@@ -13,6 +13,7 @@ from types import SimpleNamespace
 from unittest.mock import MagicMock, patch
 
 import pytest
+from prometheus_client import REGISTRY
 
 from image_analyzer import (
     RECONCILIATION_TOLERANCE,
@@ -270,3 +271,62 @@ class TestAnalyzeImageWithGemini:
         # No retry warning; mismatch was silently accepted
         assert "retrying" not in caplog.text
         assert isinstance(result, RegularReceipt)
+
+
+class TestReconciliationMetrics:
+    """Outcomes and token usage counted in the Prometheus metrics."""
+
+    IMAGE_BYTES = b"fake-image-data"
+
+    @staticmethod
+    def _outcomes():
+        return {
+            outcome: REGISTRY.get_sample_value(
+                "splitzy_reconciliation_total", {"outcome": outcome}
+            )
+            or 0
+            for outcome in ("ok", "retried", "reconciled_on_retry", "unreconciled")
+        }
+
+    def _analyze(self, analyzer, *payloads):
+        before = self._outcomes()
+        with patch("image_analyzer.genai.GenerativeModel") as mock_gm_cls:
+            mock_gm_cls.return_value.generate_content.side_effect = [
+                _gemini_response(payload) for payload in payloads
+            ]
+            analyzer._analyze_image_with_gemini(self.IMAGE_BYTES)
+        after = self._outcomes()
+        return {k: after[k] - before[k] for k in after if after[k] != before[k]}
+
+    def test_ok(self, analyzer):
+        assert self._analyze(analyzer, _good_receipt()) == {"ok": 1}
+
+    def test_reconciled_on_retry(self, analyzer):
+        assert self._analyze(analyzer, _bad_receipt(), _corrected_receipt()) == {
+            "retried": 1,
+            "reconciled_on_retry": 1,
+        }
+
+    def test_unreconciled(self, analyzer):
+        assert self._analyze(analyzer, _bad_receipt(), _bad_receipt()) == {
+            "retried": 1,
+            "unreconciled": 1,
+        }
+
+    def test_token_usage(self, analyzer):
+        def tokens(call, kind):
+            return REGISTRY.get_sample_value(
+                "splitzy_gemini_tokens_total", {"call": call, "kind": kind}
+            ) or 0
+
+        before = tokens("first_pass", "prompt"), tokens("first_pass", "total")
+        response = _gemini_response(_good_receipt())
+        response.usage_metadata = SimpleNamespace(
+            prompt_token_count=1200, candidates_token_count=300, total_token_count=1500
+        )
+        with patch("image_analyzer.genai.GenerativeModel") as mock_gm_cls:
+            mock_gm_cls.return_value.generate_content.return_value = response
+            analyzer._analyze_image_with_gemini(self.IMAGE_BYTES)
+
+        after = tokens("first_pass", "prompt"), tokens("first_pass", "total")
+        assert (after[0] - before[0], after[1] - before[1]) == (1200, 1500)
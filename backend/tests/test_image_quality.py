@@ -0,0 +1,152 @@
+"""
+Tests for the local image quality gate on /api/analyze-receipt.
+"""
+
+import io
+from unittest.mock import patch
+
+from PIL import Image, ImageDraw, ImageEnhance, ImageFilter
+from prometheus_client import REGISTRY
+
+from image_quality import assess_image
+from schemas.receipt import RegularReceipt
+
+
+def _receipt_photo() -> Image.Image:
+    image = Image.new("RGB", (600, 1400), (235, 235, 230))
+    draw = ImageDraw.Draw(image)
+    for line in range(40):
+        draw.text(
+            (40, 30 + line * 33),
+            f"ITEM {line:02d} ............ {line * 1.37:6.2f}",
+            fill=(20, 20, 20),
+            font_size=22,
+        )
+    return image
+
+
+def _jpeg(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def _failures(check, mode):
+    return (
+        REGISTRY.get_sample_value(
+            "splitzy_image_quality_failures_total", {"check": check, "mode": mode}
+        )
+        or 0
+    )
+
+
+class TestAssessImage:
+    def test_sharp_receipt_passes(self):
+        assert assess_image(_jpeg(_receipt_photo())).ok
+
+    def test_blurry_photo_is_flagged(self):
+        blurry = _receipt_photo().filter(ImageFilter.GaussianBlur(4))
+
+        assert assess_image(_jpeg(blurry)).reasons == ["blurry"]
+
+    def test_dark_photo_is_flagged(self):
+        dark = ImageEnhance.Brightness(_receipt_photo()).enhance(0.1)
+
+        assert "too_dark" in assess_image(_jpeg(dark)).reasons
+
+    def test_blank_photo_is_flagged(self):
+        blank = Image.new("RGB", (600, 1400), "white")
+
+        assert assess_image(_jpeg(blank)).reasons == ["overexposed", "no_content"]
+
+    @patch("PIL.Image.MAX_IMAGE_PIXELS", 100_000)
+    def test_decompression_bomb_is_unreadable(self):
+        assert assess_image(_jpeg(_receipt_photo())).reasons == ["unreadable"]
+
+    def test_non_image_is_not_assessed(self):
+        assert assess_image(b"%PDF-1.7 ...") is None
+
+
+CHECKS = ("blurry", "too_dark", "overexposed", "no_content")
+BLOB_URL = "https://fake-blob-storage.com/receipt.jpg"
+
+
+def _post(test_client, image_bytes):
+    return test_client.post(
+        "/api/analyze-receipt",
+        data={"file": (io.BytesIO(image_bytes), "receipt.jpg")},
+        content_type="multipart/form-data",
+    )
+
+
+@patch("blueprints.receipts.upload_to_blob_storage", return_value=BLOB_URL)
+@patch("blueprints.receipts.ImageAnalyzer")
+class TestQualityGateRoute:
+    @patch("image_quality.RECEIPT_QUALITY_GATE", "reject")
+    def test_reject_mode_returns_422_without_model_call(
+        self, mock_analyzer_cls, mock_upload, test_client
+    ):
+        blurry = _receipt_photo().filter(ImageFilter.GaussianBlur(4))
+        before = _failures("blurry", "reject")
+
+        response = _post(test_client, _jpeg(blurry))
+
+        assert response.status_code == 422
+        body = response.get_json()
+        assert body["success"] is False
+        assert body["quality_issues"] == ["blurry"]
+        mock_upload.assert_not_called()
+        mock_analyzer_cls.return_value.analyze_image.assert_not_called()
+        assert _failures("blurry", "reject") == before + 1
+
+    @patch("image_quality.RECEIPT_QUALITY_GATE", "warn")
+    def test_warn_mode_counts_but_analyzes(
+        self, mock_analyzer_cls, mock_upload, test_client, mock_receipt_data
+    ):
+        mock_analyzer_cls.return_value.analyze_image.return_value = (
+            RegularReceipt.model_validate(mock_receipt_data)
+        )
+        blank = Image.new("RGB", (600, 1400), "white")
+        before = {check: _failures(check, "warn") for check in CHECKS}
+
+        response = _post(test_client, _jpeg(blank))
+
+        assert response.status_code == 200
+        mock_analyzer_cls.return_value.analyze_image.assert_called_once()
+        assert {
+            check: _failures(check, "warn") - before[check] for check in CHECKS
+        } == {
+            "blurry": 0,
+            "too_dark": 0,
+            "overexposed": 1,
+            "no_content": 1,
+        }
+
+    @patch("image_quality.RECEIPT_QUALITY_GATE", "reject")
+    def test_sharp_photo_passes_reject_mode(
+        self, mock_analyzer_cls, mock_upload, test_client, mock_receipt_data
+    ):
+        mock_analyzer_cls.return_value.analyze_image.return_value = (
+            RegularReceipt.model_validate(mock_receipt_data)
+        )
+        before = {check: _failures(check, "reject") for check in CHECKS}
+
+        response = _post(test_client, _jpeg(_receipt_photo()))
+
+        assert response.status_code == 200
+        assert {check: _failures(check, "reject") for check in CHECKS} == before
+
+    @patch("PIL.Image.MAX_IMAGE_PIXELS", 100_000)
+    @patch("image_quality.RECEIPT_QUALITY_GATE", "warn")
+    def test_decompression_bomb_is_rejected_in_warn_mode(
+        self, mock_analyzer_cls, mock_upload, test_client
+    ):
+        before = _failures("unreadable", "warn")
+
+        response = _post(test_client, _jpeg(_receipt_photo()))
+
+        assert response.status_code == 422
+        assert response.get_json()["quality_issues"] == ["unreadable"]
+        mock_upload.assert_not_called()
+        mock_analyzer_cls.return_value.analyze_image.assert_not_called()
+        assert _failures("unreadable", "warn") == before + 1
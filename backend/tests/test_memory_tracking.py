@@ -0,0 +1,132 @@
+"""
+Tests for per-phase allocation tracking and the RSS watchdog.
+"""
+
+import logging
+import tracemalloc
+from unittest.mock import patch
+
+import pytest
+from prometheus_client import REGISTRY
+
+import memory_tracking
+from memory_tracking import recent_rss_growth, track_phase
+from server_timing import timed
+
+
+MB = 1024 * 1024
+
+
+def _peak_sum(phase):
+    return (
+        REGISTRY.get_sample_value(
+            "splitzy_phase_peak_memory_bytes_sum", {"phase": phase}
+        )
+        or 0
+    )
+
+
+@pytest.fixture
+def tracking():
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    with patch("memory_tracking.MEMORY_TRACKING_ENABLED", True):
+        yield
+    if not was_tracing:
+        tracemalloc.stop()
+
+
+def test_phase_peaks(test_app, tracking, caplog):
+    @test_app.route("/_allocate")
+    def allocate():
+        with timed("blob"):
+            upload = bytearray(8 * MB)
+            del upload
+        with timed("analyze"):
+            held = bytearray(4 * MB)
+            with timed("gemini"):
+                encoded = bytearray(2 * MB)
+                del encoded
+            del held
+        return "ok"
+
+    before = {phase: _peak_sum(phase) for phase in ("blob", "analyze", "gemini")}
+    with caplog.at_level(logging.INFO, logger="memory_tracking"):
+        response = test_app.test_client().get("/_allocate")
+
+    assert response.status_code == 200
+    blob, analyze, gemini = (
+        _peak_sum(phase) - before[phase] for phase in ("blob", "analyze", "gemini")
+    )
+    assert 8 * MB <= blob < 9 * MB
+    # The 4 MB held across the nested phase counts towards analyze only.
+    assert 6 * MB <= analyze < 7 * MB
+    assert 2 * MB <= gemini < 3 * MB
+    assert "[memory] GET /_allocate: peak 8." in caplog.text
+    assert "blob 8.0 MB, analyze 6.0 MB, gemini 2.0 MB" in caplog.text
+
+
+def test_tracking_is_off_by_default(test_client):
+    before = _peak_sum("request")
+
+    test_client.get("/api/health")
+
+    assert _peak_sum("request") == before
+
+
+def test_track_phase_outside_requests(tracking):
+    with track_phase("analyze"):
+        pass
+
+
+def test_rss_growth_is_recorded(test_client, caplog):
+    labels = {"endpoint": "GET /api/health"}
+    before = REGISTRY.get_sample_value("splitzy_rss_growth_bytes_total", labels) or 0
+
+    with (
+        patch("memory_tracking._max_rss", side_effect=[100 * MB, 120 * MB]),
+        patch("memory_tracking._recent_growth", memory_tracking.deque(maxlen=5)),
+        caplog.at_level(logging.WARNING, logger="memory_tracking"),
+    ):
+        test_client.get("/api/health")
+        events = recent_rss_growth()
+
+    assert REGISTRY.get_sample_value(
+        "splitzy_rss_growth_bytes_total", labels
+    ) == before + (20 * MB)
+    assert REGISTRY.get_sample_value("splitzy_worker_max_rss_bytes") == 120 * MB
+    assert [(e["route"], e["growth_bytes"]) for e in events] == [
+        ("GET /api/health", 20 * MB)
+    ]
+    assert "GET /api/health grew worker peak RSS by 20.0 MB to 120.0 MB" in (
+        caplog.text
+    )
+
+
+def test_small_growth_is_not_an_event(test_client):
+    with (
+        patch("memory_tracking._max_rss", side_effect=[100 * MB, 101 * MB]),
+        patch("memory_tracking._recent_growth", memory_tracking.deque(maxlen=5)),
+    ):
+        test_client.get("/api/health")
+        assert recent_rss_growth() == []
+
+
+def test_limit_reports_largest_growth_once(test_client, caplog):
+    rss = [100 * MB, 150 * MB, 150 * MB, 160 * MB, 160 * MB, 170 * MB]
+    with (
+        patch("memory_tracking._max_rss", side_effect=rss),
+        patch("memory_tracking._recent_growth", memory_tracking.deque(maxlen=5)),
+        patch("memory_tracking._limit_reported", False),
+        patch("memory_tracking.MEMORY_RSS_LIMIT_MB", 155),
+        caplog.at_level(logging.ERROR, logger="memory_tracking"),
+    ):
+        for _ in range(3):
+            test_client.get("/api/health")
+
+    errors = [r.getMessage() for r in caplog.records if r.levelno == logging.ERROR]
+    assert errors == [
+        "[memory] Worker peak RSS 160.0 MB passed MEMORY_RSS_LIMIT_MB=155; "
+        "largest recent growth: GET /api/health +50.0 MB; GET /api/health +10.0 MB"
+    ]
@@ -0,0 +1,118 @@
+"""
+Tests for the Prometheus metrics endpoint.
+"""
+
+import io
+import os
+import subprocess
+import sys
+from unittest.mock import patch
+
+from prometheus_client import REGISTRY, CollectorRegistry, multiprocess
+
+import metrics
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _sample(name, labels=None):
+    return REGISTRY.get_sample_value(name, labels or {}) or 0
+
+
+def test_metrics_endpoint(test_client):
+    test_client.get("/api/health")
+
+    response = test_client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    body = response.get_data(as_text=True)
+    for family in (
+        "splitzy_phase_duration_seconds",
+        "splitzy_http_request_duration_seconds",
+        "splitzy_http_requests_in_progress",
+        "splitzy_db_pool_checkouts_total",
+    ):
+        assert f"# HELP {family} " in body
+
+
+def test_requests_are_labelled_by_route(test_client):
+    labels = {
+        "endpoint": "/api/receipts/<int:receipt_id>",
+        "method": "GET",
+        "status": "404",
+    }
+    before = _sample("splitzy_http_request_duration_seconds_count", labels)
+
+    test_client.get("/api/receipts/12345")
+
+    assert _sample("splitzy_http_request_duration_seconds_count", labels) == before + 1
+    assert (
+        _sample(
+            "splitzy_http_requests_in_progress",
+            {"endpoint": "/api/receipts/<int:receipt_id>"},
+        )
+        == 0
+    )
+
+
+def test_token_protects_the_endpoint(test_client):
+    with patch.object(metrics, "METRICS_TOKEN", "scrape-secret"):
+        assert test_client.get("/metrics").status_code == 401
+        response = test_client.get(
+            "/metrics", headers={"Authorization": "Bearer scrape-secret"}
+        )
+
+    assert response.status_code == 200
+
+
+def test_pool_checkouts_are_counted(test_app, new_user):
+    from models import db
+
+    before = _sample("splitzy_db_pool_checkouts_total")
+
+    with db.engine.connect() as conn:
+        conn.exec_driver_sql("SELECT 1")
+
+    assert _sample("splitzy_db_pool_checkouts_total") == before + 1
+    assert _sample("splitzy_db_connections_checked_out") >= 0
+
+
+@patch("blueprints.receipts.upload_to_blob_storage", return_value=None)
+def test_blob_upload_failures_are_counted(mock_blob_upload, test_client):
+    before = _sample("splitzy_blob_upload_failures_total")
+
+    response = test_client.post(
+        "/api/analyze-receipt",
+        data={"file": (io.BytesIO(b"metrics receipt"), "r.jpg")},
+        content_type="multipart/form-data",
+    )
+
+    assert response.status_code == 500
+    assert _sample("splitzy_blob_upload_failures_total") == before + 1
+
+
+def test_workers_are_aggregated(tmp_path):
+    """Values written by separate processes are summed into one scrape."""
+    script = (
+        "import metrics\n"
+        "metrics.record_blob_upload_failure()\n"
+        "metrics.observe_phase('gemini', 2.0)\n"
+    )
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path)}
+    for _ in range(2):
+        subprocess.run(
+            [sys.executable, "-c", script], cwd=BACKEND_DIR, env=env, check=True
+        )
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=str(tmp_path))
+
+    assert registry.get_sample_value("splitzy_blob_upload_failures_total") == 2
+    assert (
+        registry.get_sample_value(
+            "splitzy_phase_duration_seconds_sum", {"phase": "gemini"}
+        )
+        == 4.0
+    )
@@ -0,0 +1,76 @@
+"""
+Tests for cents handling in the receipt schemas.
+"""
+
+from decimal import Decimal
+
+from schemas.money import from_cents, line_total, to_cents
+from schemas.receipt import LineItem, RegularReceipt, TransportationTicket
+
+
+class TestCents:
+    def test_to_cents_rounds_half_even(self):
+        assert to_cents(Decimal("1.005")) == 100
+        assert to_cents(Decimal("1.015")) == 102
+        assert to_cents("12.34") == 1234
+        assert to_cents(3) == 300
+        assert to_cents(None) == 0
+
+    def test_from_cents_has_two_places(self):
+        assert str(from_cents(1234)) == "12.34"
+        assert str(from_cents(0)) == "0.00"
+        assert str(from_cents(-5)) == "-0.05"
+
+    def test_line_total_matches_decimal_arithmetic(self):
+        assert line_total(Decimal("2.50"), 3) == Decimal("7.50")
+        assert line_total(Decimal("3.459"), 10.5) == Decimal("36.32")
+
+
+class TestLineItemMoney:
+    def test_total_uses_unrounded_unit_price(self):
+        item = LineItem(name="Fuel", quantity=10.5, price_per_item="3.459")
+
+        assert item.total_price == Decimal("36.32")
+        assert str(item.price_per_item) == "3.46"
+
+    def test_amounts_are_normalized_to_two_places(self):
+        item = LineItem(name="Tea", quantity=2, price_per_item="1.5", total_price=3)
+
+        assert str(item.price_per_item) == "1.50"
+        assert str(item.total_price) == "3.00"
+
+
+class TestReceiptAggregates:
+    def test_derived_totals(self):
+        receipt = RegularReceipt(
+            line_items=[
+                {"name": "A", "quantity": 2, "price_per_item": "1.25"},
+                {"name": "B", "price_per_item": "3.333"},
+            ],
+            tax="0.425",
+            tip="1",
+        )
+
+        assert str(receipt.items_total) == "5.83"
+        assert str(receipt.subtotal) == "5.83"
+        assert str(receipt.tax) == "0.42"
+        assert str(receipt.posttax_total) == "6.25"
+        assert str(receipt.total) == "7.25"
+        assert receipt.final_total == receipt.total
+        assert receipt.model_dump(mode="json")["total"] == 7.25
+
+    def test_tax_included_in_items(self):
+        receipt = RegularReceipt(
+            line_items=[{"name": "A", "price_per_item": "10.00"}],
+            tax="0.80",
+            tax_included_in_items=True,
+        )
+
+        assert receipt.subtotal == Decimal("9.20")
+        assert receipt.total == Decimal("10.00")
+
+    def test_transportation_total(self):
+        ticket = TransportationTicket(fare="99.995", taxes="10.10")
+
+        assert str(ticket.fare) == "100.00"
+        assert str(ticket.total) == "110.10"
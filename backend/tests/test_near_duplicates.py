@@ -0,0 +1,254 @@
+"""
+Tests for perceptual-hash detection of re-photographed receipts.
+"""
+
+import io
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from unittest.mock import patch
+
+import pytest
+from PIL import Image, ImageDraw, ImageEnhance
+from sqlalchemy import func, select
+
+from models import db
+from models.receipt_image_hash import ReceiptImageHash
+from models.receipt_line_item import ReceiptLineItem
+from models.user import User
+from models.user_receipt import UserReceipt
+from near_duplicates import (
+    _detail_distance,
+    bands,
+    find_near_duplicate,
+    hamming_distance,
+    image_hashes,
+    record_hashes,
+)
+from schemas.receipt import RegularReceipt
+
+
+TABLE = (70, 50, 40)
+
+
+def _receipt(seed: int) -> Image.Image:
+    paper = Image.new("RGB", (400, 1100), (240, 240, 235))
+    draw = ImageDraw.Draw(paper)
+    for line in range(30):
+        name = f"ITEM {(line * 7 + seed * 13) % 97:02d}" + "." * ((line + seed) % 9)
+        draw.text(
+            (20, 20 + line * 34),
+            f"{name} {(line + 1) * (seed + 1.7):6.2f}",
+            fill=(20, 20, 20),
+            font_size=20,
+        )
+    return paper
+
+
+def _photo(seed: int, origin=(300, 200), brightness=1.0) -> bytes:
+    photo = Image.new("RGB", (1400, 1700), TABLE)
+    photo.paste(_receipt(seed), origin)
+    photo = ImageEnhance.Brightness(photo).enhance(brightness)
+    buffer = io.BytesIO()
+    photo.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def _distances(a, b):
+    return hamming_distance(a.phash, b.phash), _detail_distance(a.detail, b.detail)
+
+
+class TestImageHashes:
+    def test_same_receipt_photographed_again_is_close(self):
+        first = image_hashes(_photo(1))
+        second = image_hashes(_photo(1, origin=(520, 330), brightness=0.9))
+
+        coarse, detail = _distances(first, second)
+        assert coarse <= 6
+        assert detail <= 4
+
+    def test_different_receipts_differ_in_detail(self):
+        hashes = [image_hashes(_photo(seed)) for seed in range(4)]
+
+        for i in range(len(hashes)):
+            for j in range(i + 1, len(hashes)):
+                assert _distances(hashes[i], hashes[j])[1] > 4
+
+    def test_non_image_has_no_hash(self):
+        assert image_hashes(b"%PDF-1.7 ...") is None
+
+    def test_bands_cover_the_hash(self):
+        phash = -0x123456789ABCDEF
+        assert bands(phash) == [
+            (phash & 0xFFFFFFFFFFFFFFFF) >> shift & 0xFFFF for shift in (0, 16, 32, 48)
+        ]
+
+
+def _saved_receipt(image_data, user):
+    receipt = UserReceipt(
+        user_id=user.id,
+        merchant="Corner Store",
+        subtotal=Decimal("10.00"),
+        tax=Decimal("0.80"),
+        original_tax=Decimal("0.80"),
+        total=Decimal("10.80"),
+    )
+    receipt.line_items.append(
+        ReceiptLineItem(
+            name="Milk",
+            quantity=2,
+            price_per_item=Decimal("5.00"),
+            total_price=Decimal("10.00"),
+        )
+    )
+    db.session.add(receipt)
+    db.session.flush()
+    record_hashes(receipt, image_hashes(image_data))
+    db.session.commit()
+    return receipt
+
+
+@pytest.fixture
+def other_user(test_app):
+    user = User(auth_user_id="user_other", display_name="other")
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+class TestFindNearDuplicate:
+    def test_finds_receipt_within_radius(self, test_app, new_user):
+        saved = _saved_receipt(_photo(1), new_user)
+
+        match = find_near_duplicate(
+            image_hashes(_photo(1, origin=(500, 300))), new_user.id
+        )
+
+        assert match is not None
+        assert match.id == saved.id
+
+    def test_different_receipt_is_not_matched(self, test_app, new_user):
+        _saved_receipt(_photo(1), new_user)
+
+        assert find_near_duplicate(image_hashes(_photo(2)), new_user.id) is None
+
+    def test_other_users_receipts_are_not_matched(self, test_app, new_user, other_user):
+        _saved_receipt(_photo(1), other_user)
+
+        assert find_near_duplicate(image_hashes(_photo(1)), new_user.id) is None
+
+    def test_deleted_and_old_receipts_are_ignored(self, test_app, new_user):
+        deleted = _saved_receipt(_photo(1), new_user)
+        deleted.deleted_at = datetime.now(timezone.utc)
+        old = _saved_receipt(_photo(3), new_user)
+        db.session.get(ReceiptImageHash, old.id).created_at = datetime.now(
+            timezone.utc
+        ) - timedelta(days=30)
+        db.session.commit()
+
+        assert find_near_duplicate(image_hashes(_photo(1)), new_user.id) is None
+        assert find_near_duplicate(image_hashes(_photo(3)), new_user.id) is None
+
+
+BLOB_URL = "https://fake-blob-storage.com/receipt.jpg"
+
+
+def _post(test_client, user, image_bytes, **form):
+    with patch("blueprints.receipts.get_current_user", return_value=user):
+        return test_client.post(
+            "/api/analyze-receipt",
+            data={"file": (io.BytesIO(image_bytes), "receipt.jpg"), **form},
+            content_type="multipart/form-data",
+        )
+
+
+@patch("blueprints.receipts.upload_to_blob_storage", return_value=BLOB_URL)
+@patch("blueprints.receipts.ImageAnalyzer")
+def test_disabled_by_default(
+    mock_analyzer_cls, mock_upload, test_client, new_user, mock_receipt_data
+):
+    analyze = mock_analyzer_cls.return_value.analyze_image
+    analyze.return_value = RegularReceipt.model_validate(mock_receipt_data)
+
+    _post(test_client, new_user, _photo(1))
+    second = _post(test_client, new_user, _photo(1, origin=(480, 260)))
+
+    assert second.status_code == 200
+    assert db.session.scalar(select(func.count(UserReceipt.id))) == 2
+    assert db.session.scalar(select(func.count()).select_from(ReceiptImageHash)) == 0
+
+
+@patch("blueprints.receipts.RECEIPT_NEAR_DUP_ENABLED", True)
+@patch("blueprints.receipts.upload_to_blob_storage", return_value=BLOB_URL)
+@patch("blueprints.receipts.ImageAnalyzer")
+class TestNearDuplicateRoute:
+    def test_second_photo_is_suggested_not_saved(
+        self, mock_analyzer_cls, mock_upload, test_client, new_user, mock_receipt_data
+    ):
+        analyze = mock_analyzer_cls.return_value.analyze_image
+        analyze.return_value = RegularReceipt.model_validate(mock_receipt_data)
+
+        first = _post(test_client, new_user, _photo(1))
+        second = _post(
+            test_client, new_user, _photo(1, origin=(480, 260), brightness=0.95)
+        )
+
+        assert second.status_code == 409
+        assert (
+            second.get_json()["near_duplicate_of"]
+            == (first.get_json()["receipt_data"]["id"])
+        )
+        assert "receipt_data" not in second.get_json()
+        assert analyze.call_count == 1
+        assert mock_upload.call_count == 1
+        assert db.session.scalar(select(func.count(UserReceipt.id))) == 1
+
+    def test_force_analysis_calls_the_model(
+        self, mock_analyzer_cls, mock_upload, test_client, new_user, mock_receipt_data
+    ):
+        analyze = mock_analyzer_cls.return_value.analyze_image
+        analyze.return_value = RegularReceipt.model_validate(mock_receipt_data)
+
+        _post(test_client, new_user, _photo(1))
+        response = _post(
+            test_client, new_user, _photo(1, origin=(480, 260)), force_analysis="true"
+        )
+
+        assert response.status_code == 200
+        assert analyze.call_count == 2
+        assert "near_duplicate_of" not in response.get_json()
+
+    def test_different_receipt_is_analyzed(
+        self, mock_analyzer_cls, mock_upload, test_client, new_user, mock_receipt_data
+    ):
+        analyze = mock_analyzer_cls.return_value.analyze_image
+        analyze.return_value = RegularReceipt.model_validate(mock_receipt_data)
+
+        _post(test_client, new_user, _photo(1))
+        _post(test_client, new_user, _photo(2))
+
+        assert analyze.call_count == 2
+
+    def test_same_photo_from_another_user_is_not_matched(
+        self,
+        mock_analyzer_cls,
+        mock_upload,
+        test_client,
+        new_user,
+        other_user,
+        mock_receipt_data,
+    ):
+        analyze = mock_analyzer_cls.return_value.analyze_image
+        analyze.return_value = RegularReceipt.model_validate(mock_receipt_data)
+
+        first = _post(test_client, new_user, _photo(1))
+        second = _post(test_client, other_user, _photo(1))
+
+        assert first.status_code == second.status_code == 200
+        assert "near_duplicate_of" not in second.get_json()
+        # Identical bytes may share one model call (single_flight); each user
+        # still gets a receipt of their own.
+        second_receipt = db.session.get(
+            UserReceipt, second.get_json()["receipt_data"]["id"]
+        )
+        assert second_receipt.id != first.get_json()["receipt_data"]["id"]
+        assert second_receipt.user_id == other_user.id
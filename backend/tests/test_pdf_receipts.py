@@ -0,0 +1,209 @@
+"""
+Tests for PDF receipt support: page rasterization and the pipelined
+per-page analysis path in ImageAnalyzer.
+"""
+
+import io
+import json
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pypdfium2 as pdfium
+import pytest
+from PIL import Image
+
+import pdf_receipts
+from image_analyzer import ImageAnalysisError, ImageAnalyzer
+from schemas.receipt import RegularReceipt
+
+
+def _pdf(page_count, width=200, height=600) -> bytes:
+    document = pdfium.PdfDocument.new()
+    for _ in range(page_count):
+        document.new_page(width, height)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    document.close()
+    return buffer.getvalue()
+
+
+def _item(name, total):
+    return {"name": name, "quantity": 1, "price_per_item": total, "total_price": total}
+
+
+@pytest.fixture(autouse=True)
+def _render_in_process():
+    """Keep tests off the shared process pool."""
+    with patch("pdf_receipts.PDF_RASTER_WORKERS", 0):
+        yield
+
+
+@pytest.fixture()
+def analyzer():
+    with patch("image_analyzer._configured", True):
+        yield ImageAnalyzer()
+
+
+class TestRasterization:
+    def test_is_pdf_by_mime_type_or_magic_bytes(self):
+        assert pdf_receipts.is_pdf(b"anything", "application/pdf")
+        assert pdf_receipts.is_pdf(_pdf(1), "application/octet-stream")
+        assert not pdf_receipts.is_pdf(b"\xff\xd8\xff\xe0", "image/jpeg")
+
+    @patch("pdf_receipts.PDF_MAX_PAGES", 2)
+    def test_page_count_is_capped(self):
+        assert pdf_receipts.count_pages(_pdf(5)) == 2
+
+    def test_invalid_pdf_raises(self):
+        with pytest.raises(pdf_receipts.PDFError):
+            pdf_receipts.count_pages(b"%PDF-1.7 truncated")
+
+    @patch("pdf_receipts.PDF_RENDER_SCALE", 2.0)
+    def test_pages_render_to_jpeg(self):
+        futures = pdf_receipts.submit_page_renders(_pdf(2), 2)
+
+        assert len(futures) == 2
+        with Image.open(io.BytesIO(futures[1].result())) as page:
+            assert page.format == "JPEG"
+            assert page.size == (400, 1200)
+
+    def test_pages_render_in_worker_processes(self):
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            futures = pdf_receipts.submit_page_renders(_pdf(2), 2, executor=executor)
+            pages = [future.result(timeout=60) for future in futures]
+
+        assert all(page[:2] == b"\xff\xd8" for page in pages)
+
+
+PAGE_PAYLOADS = [
+    {
+        "is_receipt": True,
+        "merchant": "Supplier Inc",
+        "date": "2025-02-01",
+        "line_items": [_item("Widget", 10.00), _item("Gadget", 5.00)],
+        "fields_metadata": [
+            {
+                "field_name": "line_items.1.name",
+                "bbox": {"x": 10, "y": 500, "width": 80, "height": 20},
+                "is_pii": False,
+                "pii_category": None,
+            }
+        ],
+    },
+    {
+        "is_receipt": True,
+        # The same product on consecutive pages is a real second line.
+        "line_items": [_item("Gadget", 5.00)],
+        "fields_metadata": [
+            {
+                "field_name": "line_items.0.name",
+                "bbox": {"x": 10, "y": 50, "width": 80, "height": 20},
+                "is_pii": False,
+                "pii_category": None,
+            }
+        ],
+    },
+    {
+        "is_receipt": True,
+        "line_items": [_item("Service fee", 2.00)],
+        "subtotal": 22.00,
+        "tax": 2.00,
+        "total": 24.00,
+    },
+]
+
+
+def _page_responses(payloads):
+    """generate_content side effect answering each page by its prompt."""
+
+    def generate_content(parts):
+        match = re.search(r"page (\d+) of", parts[1])
+        if match is None:
+            return SimpleNamespace(text=json.dumps(payloads[0]))
+        return SimpleNamespace(text=json.dumps(payloads[int(match.group(1)) - 1]))
+
+    return generate_content
+
+
+class TestAnalyzePDF:
+    @patch("pdf_receipts.PDF_RENDER_SCALE", 1.0)
+    def test_pages_are_analyzed_and_merged(self, analyzer):
+        with patch("image_analyzer.genai.GenerativeModel") as mock_model_cls:
+            mock_model_cls.return_value.generate_content.side_effect = _page_responses(
+                PAGE_PAYLOADS
+            )
+            result = analyzer.analyze_image(_pdf(3), mime_type="application/pdf")
+
+        assert isinstance(result, RegularReceipt)
+        assert result.merchant == "Supplier Inc"
+        assert [item.name for item in result.line_items] == [
+            "Widget",
+            "Gadget",
+            "Gadget",
+            "Service fee",
+        ]
+        assert float(result.subtotal) == 22.00
+        assert float(result.total) == 24.00
+        assert mock_model_cls.return_value.generate_content.call_count == 3
+
+        boxes = {
+            entry.field_name: entry.bbox.y for entry in result.fields_metadata.fields
+        }
+        # Second page starts below the 600pt first page.
+        assert boxes == {"line_items.1.name": 500, "line_items.2.name": 650}
+
+    def test_single_page_pdf_uses_image_path(self, analyzer):
+        with patch("image_analyzer.genai.GenerativeModel") as mock_model_cls:
+            mock_model_cls.return_value.generate_content.return_value = SimpleNamespace(
+                text=json.dumps(
+                    {
+                        "is_receipt": True,
+                        "line_items": [_item("Widget", 10.00)],
+                        "subtotal": 10.00,
+                        "total": 10.00,
+                    }
+                )
+            )
+            result = analyzer.analyze_image(
+                _pdf(1, height=300), mime_type="application/pdf"
+            )
+
+        assert [item.name for item in result.line_items] == ["Widget"]
+        mock_model_cls.return_value.generate_content.assert_called_once()
+        parts = mock_model_cls.return_value.generate_content.call_args.args[0]
+        assert parts[2]["mime_type"] == "image/jpeg"
+
+    def test_unreadable_pdf_is_an_analysis_error(self, analyzer):
+        with pytest.raises(ImageAnalysisError):
+            analyzer.analyze_image(b"%PDF-1.7 truncated", mime_type="application/pdf")
+
+    def test_page_that_fails_to_render_is_an_analysis_error(self, analyzer):
+        render_page = pdf_receipts.render_page
+
+        def render_corrupt_second_page(pdf_data, page_index, scale):
+            if page_index == 1:
+                raise pdfium.PdfiumError("Failed to load page.")
+            return render_page(pdf_data, page_index, scale)
+
+        with (
+            patch("pdf_receipts.render_page", render_corrupt_second_page),
+            patch("image_analyzer.genai.GenerativeModel") as mock_model_cls,
+        ):
+            mock_model_cls.return_value.generate_content.side_effect = _page_responses(
+                PAGE_PAYLOADS
+            )
+            with pytest.raises(ImageAnalysisError, match="Failed to load page"):
+                analyzer.analyze_image(_pdf(3), mime_type="application/pdf")
+
+    def test_corrupt_single_page_is_an_analysis_error(self, analyzer):
+        with patch(
+            "pdf_receipts.render_page",
+            side_effect=pdfium.PdfiumError("Failed to load page."),
+        ):
+            with pytest.raises(ImageAnalysisError, match="could not be rendered"):
+                analyzer.analyze_image(_pdf(1), mime_type="application/pdf")
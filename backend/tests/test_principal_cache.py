@@ -0,0 +1,180 @@
+"""
+Tests for the principal cache behind get_current_user.
+"""
+
+import json
+import os
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy import event
+from svix.webhooks import Webhook
+
+from blueprints.auth import get_current_user
+from clerk_webhooks import process_pending_deliveries
+from models import db
+from models.user import User
+from principal_cache import (
+    PRINCIPAL_CACHE_MAX_TTL_SECONDS,
+    _cache,
+    cache_user,
+    clear_principal_cache,
+)
+
+
+AUTH_USER_ID = "user_test123"
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    clear_principal_cache()
+    yield
+    clear_principal_cache()
+
+
+@pytest.fixture
+def clerk(test_app):
+    """A Clerk SDK stub whose tokens verify with the given payload."""
+    sdk = MagicMock()
+    test_app.config["CLERK_SDK"] = sdk
+
+    def issue(sub=AUTH_USER_ID, exp=None):
+        payload = {"sub": sub, "exp": time.time() + 60 if exp is None else exp}
+        sdk.authenticate_request.return_value = SimpleNamespace(payload=payload)
+
+    issue()
+    return issue
+
+
+def _lookups(result):
+    return (
+        REGISTRY.get_sample_value(
+            "splitzy_principal_cache_lookups_total", {"result": result}
+        )
+        or 0
+    )
+
+
+def _invalidations():
+    return REGISTRY.get_sample_value("splitzy_principal_cache_invalidations_total") or 0
+
+
+def _authenticate(test_app):
+    """get_current_user in a fresh request, and the SELECTs it issued."""
+    selects = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("SELECT"):
+            selects.append(statement)
+
+    engine = db.engine
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        with test_app.test_request_context(headers={"Authorization": "Bearer t"}):
+            user = get_current_user()
+            user_id = user.id if user is not None else None
+            db.session.remove()
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    return user_id, len(selects)
+
+
+class TestPrincipalCache:
+    def test_second_request_skips_the_lookup(self, test_app, new_user, clerk):
+        hits, misses = _lookups("hit"), _lookups("miss")
+
+        first = _authenticate(test_app)
+        second = _authenticate(test_app)
+
+        assert first == (new_user.id, 1)
+        assert second == (new_user.id, 0)
+        assert (_lookups("hit") - hits, _lookups("miss") - misses) == (1, 1)
+        assert len(_cache) == 1
+
+    def test_token_is_still_verified(self, test_app, new_user, clerk):
+        _authenticate(test_app)
+        test_app.config["CLERK_SDK"].authenticate_request.side_effect = Exception(
+            "expired"
+        )
+
+        assert _authenticate(test_app) == (None, 0)
+
+    def test_expired_token_is_not_cached(self, test_app, new_user, clerk):
+        clerk(exp=time.time() - 1)
+
+        _authenticate(test_app)
+
+        assert len(_cache) == 0
+
+    def test_lifetime_bounded_by_exp_and_max_ttl(self, test_app, new_user):
+        now = time.time()
+        cache_user("short", new_user, now + 5)
+        cache_user("long", new_user, now + 86400)
+
+        assert _cache["short"].expires_at == pytest.approx(now + 5)
+        assert _cache["long"].expires_at == pytest.approx(
+            now + PRINCIPAL_CACHE_MAX_TTL_SECONDS, abs=1
+        )
+
+    def test_cached_user_is_usable_in_the_session(self, test_app, new_user, clerk):
+        _authenticate(test_app)
+
+        with test_app.test_request_context(headers={"Authorization": "Bearer t"}):
+            user = get_current_user()
+            assert user in db.session
+            assert user.display_name == "testuser"
+
+
+def _send_webhook(test_client, event_type, clerk_user_id):
+    payload = json.dumps({"type": event_type, "data": {"id": clerk_user_id}})
+    timestamp = datetime.now(timezone.utc)
+    signature = Webhook(os.environ["CLERK_WEBHOOK_SECRET"]).sign(
+        "msg_1", timestamp, payload
+    )
+    return test_client.post(
+        "/api/webhooks/clerk",
+        data=payload,
+        headers={
+            "svix-id": "msg_1",
+            "svix-timestamp": str(int(timestamp.timestamp())),
+            "svix-signature": signature,
+        },
+    )
+
+
+class TestWebhookInvalidation:
+    def test_user_updated_evicts(self, test_app, test_client, new_user, clerk):
+        _authenticate(test_app)
+        before = _invalidations()
+
+        response = _send_webhook(test_client, "user.updated", AUTH_USER_ID)
+        process_pending_deliveries()
+
+        assert response.status_code == 202
+        assert _invalidations() == before + 1
+        assert _authenticate(test_app) == (new_user.id, 1)
+
+    def test_user_deleted_evicts_and_soft_deletes(
+        self, test_app, test_client, new_user, clerk
+    ):
+        _authenticate(test_app)
+
+        response = _send_webhook(test_client, "user.deleted", AUTH_USER_ID)
+        process_pending_deliveries()
+
+        assert response.status_code == 202
+        assert _authenticate(test_app) == (None, 1)
+        assert db.session.get(User, new_user.id).deleted_at is not None
+
+    def test_user_created_still_creates(self, test_app, test_client):
+        response = _send_webhook(test_client, "user.created", "user_new")
+        process_pending_deliveries()
+
+        assert response.status_code == 202
+        assert db.session.scalars(
+            db.select(User).filter_by(auth_user_id="user_new")
+        ).one()
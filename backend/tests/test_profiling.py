@@ -0,0 +1,127 @@
+"""
+Tests for the on-demand request profiler.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import Counter
+from unittest.mock import patch
+
+import pytest
+
+import profiling
+
+
+def _busy(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        sum(range(1000))
+
+
+@pytest.fixture
+def profile_dir(tmp_path):
+    with patch("profiling.PROFILE_DIR", str(tmp_path)):
+        yield tmp_path
+
+
+@pytest.fixture
+def busy_app(test_app):
+    @test_app.route("/_busy/<int:n>")
+    def busy(n):
+        _busy(0.1)
+        return "ok"
+
+    return test_app
+
+
+def test_not_profiled_by_default(busy_app, profile_dir):
+    response = busy_app.test_client().get("/_busy/1")
+
+    assert "X-Profile" not in response.headers
+    assert os.listdir(profile_dir) == []
+
+
+def test_token_profiles_the_request(busy_app, profile_dir):
+    with patch("profiling.PROFILE_TOKEN", "secret"):
+        response = busy_app.test_client().get(
+            "/_busy/1", headers={"X-Profile-Token": "secret"}
+        )
+
+    filename = response.headers["X-Profile"]
+    assert filename.endswith(".speedscope.json")
+    assert "-GET__busy_int_n_-200-" in filename
+    data = json.loads((profile_dir / filename).read_text())
+    profile = data["profiles"][0]
+    assert data["name"].startswith("GET /_busy/<int:n> 200 ")
+    assert profile["type"] == "sampled"
+    assert profile["endValue"] >= 100
+    assert len(profile["samples"]) == len(profile["weights"]) > 0
+    frames = [frame["name"] for frame in data["shared"]["frames"]]
+    assert any(name.startswith("_busy (tests/test_profiling.py:") for name in frames)
+
+
+def test_wrong_token_is_ignored(busy_app, profile_dir):
+    with patch("profiling.PROFILE_TOKEN", "secret"):
+        response = busy_app.test_client().get(
+            "/_busy/1", headers={"X-Profile-Token": "guess"}
+        )
+
+    assert "X-Profile" not in response.headers
+    assert os.listdir(profile_dir) == []
+
+
+def test_sampled_requests_build_a_rolling_profile(busy_app, profile_dir):
+    @busy_app.route("/_first")
+    def first():
+        _busy(0.1)
+        return "ok"
+
+    client = busy_app.test_client()
+    with (
+        patch("profiling.PROFILE_SAMPLE_EVERY", 1),
+        patch("profiling._rolling", profiling.deque(maxlen=2)),
+        patch("profiling._rolling_total", Counter()),
+    ):
+        client.get("/_first")
+        for n in range(2):
+            client.get(f"/_busy/{n}")
+        lines = (
+            (profile_dir / f"worker-{os.getpid()}.collapsed").read_text().splitlines()
+        )
+        total = profiling._rolling_total
+        assert sum(total.values()) == sum(
+            sum(stacks.values()) for stacks in profiling._rolling
+        )
+        # The request that fell out of the window left nothing behind.
+        assert all(count > 0 for count in total.values())
+        assert not any(stack[0] == "GET /_first" for stack in total)
+
+    assert lines
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert stack.startswith("GET /_busy/<int:n>;")
+        assert int(count) > 0
+    assert any("_busy (tests/test_profiling.py:" in line for line in lines)
+
+
+def test_stopped_profile_is_not_sampled():
+    sampler = profiling._Sampler()
+    profile = profiling.Profile(threading.get_ident())
+    sampler._profiles[profile.thread_id] = profile
+
+    sampler._sample([profile])
+    sampled = Counter(profile.stacks)
+    # A pass that listed the profile before stop() ends without touching it.
+    sampler.stop(profile)
+    sampler._sample([profile])
+
+    assert sampled
+    assert profile.stacks == sampled
+
+
+def test_collapsed_format():
+    stacks = Counter({("a", "b"): 2, ("a", "b", "c"): 5})
+
+    assert profiling.to_collapsed(stacks) == "a;b;c 5\na;b 2\n"
@@ -0,0 +1,139 @@
+"""
+Tests for per-request SQL statistics and the query_budget fixture.
+"""
+
+import logging
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.orm import lazyload
+
+from models import db
+from models.assignment import Assignment
+from models.receipt_line_item import ReceiptLineItem
+from models.receipt_user import ReceiptUser
+from models.user_receipt import UserReceipt
+from query_stats import QueryStats, capture, statement_shape
+
+
+@pytest.fixture
+def split_receipt(test_app, new_user):
+    """A receipt with six line items, each assigned to its own receipt user."""
+    receipt = UserReceipt(user_id=new_user.id, merchant="Split Diner", total=24)
+    db.session.add(receipt)
+    db.session.flush()
+    for index in range(6):
+        receipt_user = ReceiptUser(
+            id=f"01RU{index:022d}", display_name=f"Guest {index}"
+        )
+        line_item = ReceiptLineItem(
+            receipt_id=receipt.id, name=f"Dish {index}", total_price=4
+        )
+        db.session.add_all([receipt_user, line_item])
+        db.session.flush()
+        db.session.add(
+            Assignment(
+                id=f"01AS{index:022d}",
+                receipt_line_item_id=line_item.id,
+                receipt_user_id=receipt_user.id,
+                share_percentage=100,
+            )
+        )
+    db.session.commit()
+    return receipt.id
+
+
+def test_statement_shape():
+    assert statement_shape(
+        "SELECT users.id FROM users\n  WHERE users.auth_user_id = ? "
+        "AND users.name = 'alice' AND users.id IN (?, ?, ?) LIMIT 10"
+    ) == (
+        "SELECT users.id FROM users WHERE users.auth_user_id = ? "
+        "AND users.name = ? AND users.id IN (?) LIMIT ?"
+    )
+    assert (
+        statement_shape(
+            "SELECT anon_1.id FROM t WHERE t.data::jsonb ? %(key)s AND t.id IN "
+            "(%(id_1_1)s, %(id_1_2)s)"
+        )
+        == "SELECT anon_1.id FROM t WHERE t.data::jsonb ? ? AND t.id IN (?)"
+    )
+
+
+def test_slowest_and_repeated():
+    stats = QueryStats()
+    for duration_ms in (1.0, 7.0, 3.0, 5.0):
+        stats.record("SELECT 1", duration_ms)
+    stats.record("SELECT * FROM users WHERE id = ?", 2.0)
+
+    assert stats.count == 5
+    assert stats.total_ms == 18.0
+    assert stats.slowest == [(7.0, "SELECT ?"), (5.0, "SELECT ?"), (3.0, "SELECT ?")]
+    assert stats.repeated(threshold=4) == [("SELECT ?", 4)]
+
+
+def test_parameters_are_not_recorded(test_app):
+    with capture() as stats:
+        db.session.execute(text("SELECT 'card 4111 1111 1111 1111'"))
+        db.session.execute(text("SELECT :email"), {"email": "someone@example.com"})
+
+    assert list(stats.shapes) == ["SELECT ?"]
+    assert "4111" not in str(stats.slowest)
+
+
+def test_server_timing_reports_statements(test_client, split_receipt):
+    response = test_client.get(f"/api/receipts/{split_receipt}")
+
+    assert response.status_code == 200
+    assert 'sql;desc="3 statements";dur=' in response.headers["Server-Timing"]
+
+
+def test_lazy_loads_are_flagged_as_n_plus_one(test_app, split_receipt, caplog):
+    @test_app.route("/_lazy_assignments")
+    def lazy_assignments():
+        assignments = db.session.scalars(
+            db.select(Assignment).options(lazyload(Assignment.receipt_user))
+        ).all()
+        return {"names": [a.receipt_user.display_name for a in assignments]}
+
+    with caplog.at_level(logging.DEBUG, logger="query_stats"):
+        response = test_app.test_client().get("/_lazy_assignments")
+
+    assert response.status_code == 200
+    assert "7 statements in" in caplog.text
+    warnings = [r for r in caplog.records if r.levelno == logging.WARNING]
+    assert len(warnings) == 1
+    assert "Likely N+1 in GET /_lazy_assignments: 6 runs of" in warnings[0].message
+    assert "FROM receipt_users" in warnings[0].message
+
+
+class TestQueryBudgets:
+    def test_get_receipt(self, test_client, split_receipt, query_budget):
+        with query_budget(3):
+            response = test_client.get(f"/api/receipts/{split_receipt}")
+        assert response.status_code == 200
+
+    def test_receipt_history(self, test_client, split_receipt, new_user, query_budget):
+        with patch("blueprints.receipts.get_current_user", return_value=new_user):
+            # The page, plus reloading the expired new_user fixture.
+            with query_budget(2):
+                response = test_client.get("/api/receipts")
+        assert response.status_code == 200
+
+    def test_health(self, test_client, query_budget):
+        with query_budget(0):
+            test_client.get("/api/health")
+
+    def test_exceeding_the_budget_fails(self, test_client, split_receipt, query_budget):
+        with pytest.raises(AssertionError, match="3 SQL statements, budget 2"):
+            with query_budget(2):
+                test_client.get(f"/api/receipts/{split_receipt}")
+
+    def test_n_plus_one_fails(self, test_app, split_receipt, query_budget):
+        with pytest.raises(AssertionError, match="Likely N\\+1"):
+            with query_budget(20):
+                for assignment in db.session.scalars(
+                    db.select(Assignment).options(lazyload(Assignment.receipt_user))
+                ):
+                    assignment.receipt_user
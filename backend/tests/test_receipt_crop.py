@@ -0,0 +1,156 @@
+"""
+Tests for automatic receipt-region cropping and the mapping of bounding
+boxes back into original-image coordinates.
+"""
+
+import io
+import json
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+import receipt_crop
+from image_analyzer import ImageAnalyzer
+from receipt_crop import CropTransform, crop_receipt
+from schemas.receipt import BoundingBox
+
+
+TABLE = (70, 50, 40)
+MARKER = (255, 0, 0)
+PHOTO_SIZE = (1400, 1700)
+PAPER_ORIGIN = (300, 200)
+
+
+def _receipt_photo(angle=0.0) -> Image.Image:
+    """A 400x1100 receipt with a red marker, lying on a dark table."""
+    paper = Image.new("RGB", (400, 1100), (240, 240, 235))
+    draw = ImageDraw.Draw(paper)
+    for line in range(30):
+        draw.text(
+            (20, 20 + line * 34),
+            f"ITEM {line:02d} ....... {line * 1.1:5.2f}",
+            fill=(20, 20, 20),
+            font_size=20,
+        )
+    draw.rectangle((300, 500, 320, 520), fill=MARKER)
+
+    opaque = Image.new("L", paper.size, 255)
+    photo = Image.new("RGB", PHOTO_SIZE, TABLE)
+    photo.paste(
+        paper.rotate(angle, expand=True, fillcolor=TABLE),
+        PAPER_ORIGIN,
+        opaque.rotate(angle, expand=True, fillcolor=0),
+    )
+    return photo
+
+
+def _jpeg(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=95)
+    return buffer.getvalue()
+
+
+def _marker_centre(image: Image.Image) -> tuple[float, float]:
+    pixels = np.asarray(image).astype(int)
+    red = (pixels[:, :, 0] > 180) & (pixels[:, :, 1] < 80) & (pixels[:, :, 2] < 80)
+    ys, xs = np.nonzero(red)
+    return xs.mean(), ys.mean()
+
+
+class TestCropReceipt:
+    def test_crops_to_the_paper(self):
+        cropped = crop_receipt(_jpeg(_receipt_photo()))
+
+        assert cropped is not None
+        with Image.open(io.BytesIO(cropped.data)) as image:
+            width, height = image.size
+        assert 400 <= width < 500
+        assert 1100 <= height < 1200
+
+    def test_points_map_back_to_original(self):
+        photo = _receipt_photo()
+        cropped = crop_receipt(_jpeg(photo))
+
+        with Image.open(io.BytesIO(cropped.data)) as image:
+            x, y = _marker_centre(image)
+        original_x, original_y = cropped.transform.to_original_point(x, y)
+
+        expected_x, expected_y = _marker_centre(photo)
+        assert original_x == pytest.approx(expected_x, abs=2)
+        assert original_y == pytest.approx(expected_y, abs=2)
+
+    @patch("receipt_crop.RECEIPT_CROP_DESKEW", True)
+    def test_deskews_rotated_receipt(self):
+        photo = _receipt_photo(angle=7)
+        cropped = crop_receipt(_jpeg(photo))
+
+        assert cropped.transform.angle == pytest.approx(-7, abs=0.5)
+        with Image.open(io.BytesIO(cropped.data)) as image:
+            assert image.width < 500
+            x, y = _marker_centre(image)
+        original_x, original_y = cropped.transform.to_original_point(x, y)
+        expected_x, expected_y = _marker_centre(photo)
+        assert original_x == pytest.approx(expected_x, abs=3)
+        assert original_y == pytest.approx(expected_y, abs=3)
+
+    def test_full_frame_scan_is_not_cropped(self):
+        paper = _receipt_photo().crop((300, 200, 700, 1300))
+
+        assert crop_receipt(_jpeg(paper)) is None
+
+    def test_uniform_image_is_not_cropped(self):
+        assert crop_receipt(_jpeg(Image.new("RGB", (300, 300), "white"))) is None
+
+    def test_bbox_is_mapped_through_rotation(self):
+        # Rotated 90 degrees counter-clockwise: the rotated image's x axis runs
+        # down the original, and its y axis runs right to left.
+        transform = CropTransform(
+            left=10, top=20, angle=90, original_size=(200, 100), rotated_size=(100, 200)
+        )
+
+        bbox = transform.to_original(BoundingBox(x=0, y=0, width=10, height=5))
+
+        assert (bbox.x, bbox.y, bbox.width, bbox.height) == (175, 10, 5, 10)
+
+
+class TestAnalyzeCroppedImage:
+    def test_only_the_crop_is_sent_and_bboxes_map_back(self):
+        payload = {
+            "is_receipt": True,
+            "line_items": [
+                {"name": "Milk", "quantity": 1, "price_per_item": 3, "total_price": 3}
+            ],
+            "subtotal": 3,
+            "total": 3,
+            "fields_metadata": [
+                {
+                    "field_name": "merchant",
+                    "bbox": {"x": 5, "y": 6, "width": 100, "height": 20},
+                    "is_pii": False,
+                    "pii_category": None,
+                }
+            ],
+        }
+        with (
+            patch("image_analyzer._configured", True),
+            patch.object(receipt_crop, "RECEIPT_CROP_DESKEW", False),
+            patch("image_analyzer.RECEIPT_TILING_ENABLED", False),
+            patch("image_analyzer.genai.GenerativeModel") as mock_model_cls,
+        ):
+            mock_model_cls.return_value.generate_content.return_value = SimpleNamespace(
+                text=json.dumps(payload)
+            )
+            photo = _jpeg(_receipt_photo())
+            result = ImageAnalyzer().analyze_image(photo)
+
+        parts = mock_model_cls.return_value.generate_content.call_args.args[0]
+        with Image.open(io.BytesIO(parts[2]["data"])) as sent:
+            assert sent.width < PHOTO_SIZE[0] / 2
+
+        expected = crop_receipt(photo).transform
+        bbox = result.fields_metadata.fields[0].bbox
+        assert (bbox.x, bbox.y) == (expected.left + 5, expected.top + 6)
+        assert (bbox.width, bbox.height) == (100, 20)
@@ -0,0 +1,123 @@
+"""
+Tests for the keyset-paginated GET /api/receipts history.
+"""
+
+import json
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+import pytest
+
+from models import db
+from models.receipt_line_item import ReceiptLineItem
+from models.user import User
+from models.user_receipt import UserReceipt
+
+
+START = datetime(2026, 10, 1, 12, 0, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def history(test_app, new_user):
+    """
+    Ten live receipts for new_user, some sharing a created_at, plus a
+    deleted one and one of another user. Returns the live ids in history
+    order (created_at DESC, id).
+    """
+    with test_app.app_context():
+        other = User(auth_user_id="user_other", display_name="other")
+        db.session.add(other)
+        db.session.flush()
+
+        receipts = [
+            UserReceipt(
+                user_id=new_user.id,
+                merchant=f"Shop {index}",
+                total=index,
+                # Pairs of receipts share a timestamp, so pages split ties.
+                created_at=START + timedelta(minutes=index // 2),
+            )
+            for index in range(10)
+        ]
+        deleted = UserReceipt(
+            user_id=new_user.id,
+            merchant="Deleted",
+            created_at=START,
+            deleted_at=START,
+        )
+        foreign = UserReceipt(user_id=other.id, merchant="Other", created_at=START)
+        db.session.add_all([*receipts, deleted, foreign])
+        db.session.flush()
+
+        db.session.add_all(
+            ReceiptLineItem(receipt_id=receipts[0].id, name=name, total_price=1)
+            for name in ("a", "b", "c")
+        )
+        db.session.add(
+            ReceiptLineItem(
+                receipt_id=receipts[0].id, name="gone", total_price=1, deleted_at=START
+            )
+        )
+        db.session.commit()
+
+        ordered = sorted(receipts, key=lambda r: (-r.created_at.timestamp(), r.id))
+        return [receipt.id for receipt in ordered]
+
+
+@pytest.fixture
+def logged_in(new_user):
+    with patch("blueprints.receipts.get_current_user", return_value=new_user):
+        yield
+
+
+class TestReceiptHistory:
+    def test_pages_cover_history_once_in_order(self, test_client, history, logged_in):
+        seen, cursor, pages = [], None, 0
+        while True:
+            query = "?limit=3" + (f"&cursor={cursor}" if cursor else "")
+            data = json.loads(test_client.get(f"/api/receipts{query}").data)
+            seen.extend(receipt["id"] for receipt in data["receipts"])
+            pages += 1
+            cursor = data["next_cursor"]
+            if cursor is None:
+                break
+
+        assert seen == history
+        assert pages == 4
+
+    def test_summary_rows(self, test_client, history, logged_in):
+        response = test_client.get("/api/receipts?limit=100")
+
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data["success"] is True
+        assert data["next_cursor"] is None
+        rows = {row["id"]: row for row in data["receipts"]}
+        first = min(rows)
+        assert rows[first] == {
+            "id": first,
+            "merchant": "Shop 0",
+            "date": None,
+            "total": 0.0,
+            "created_at": rows[first]["created_at"],
+            "item_count": 3,
+        }
+        assert {
+            row["item_count"] for row in data["receipts"] if row["id"] != first
+        } == {0}
+
+    def test_default_page_size(self, test_client, history, logged_in):
+        data = json.loads(test_client.get("/api/receipts").data)
+
+        assert [receipt["id"] for receipt in data["receipts"]] == history
+
+    def test_invalid_cursor(self, test_client, history, logged_in):
+        response = test_client.get("/api/receipts?cursor=not-a-cursor")
+
+        assert response.status_code == 400
+
+    def test_requires_authentication(self, test_client):
+        with patch("blueprints.receipts.get_current_user", return_value=None):
+            response = test_client.get("/api/receipts")
+
+        assert response.status_code == 401
@@ -0,0 +1,235 @@
+"""
+Tests for tall-receipt tiling: segment planning, overlap merging, and the
+parallel per-segment analysis path in ImageAnalyzer.
+"""
+
+import io
+import json
+import re
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+from PIL import Image
+
+import receipt_tiling
+from image_analyzer import ImageAnalyzer
+from receipt_tiling import (
+    Segment,
+    merge_segment_payloads,
+    plan_segments,
+    split_tall_image,
+)
+from schemas.receipt import RegularReceipt
+
+
+def _jpeg(width, height) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "white").save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def _item(name, total):
+    return {"name": name, "quantity": 1, "price_per_item": total, "total_price": total}
+
+
+def _bbox_entry(field_name, y):
+    return {
+        "field_name": field_name,
+        "bbox": {"x": 10, "y": y, "width": 100, "height": 20},
+        "is_pii": False,
+        "pii_category": None,
+    }
+
+
+SEGMENTS = [
+    Segment(index=0, top=0, bottom=600, data=b""),
+    Segment(index=1, top=500, bottom=1100, data=b""),
+    Segment(index=2, top=1000, bottom=1500, data=b""),
+]
+
+SEGMENT_PAYLOADS = [
+    {
+        "is_receipt": True,
+        "merchant": "Long Grocer",
+        "date": "2025-01-01",
+        "line_items": [_item("Milk", 3.00), _item("Bread", 4.00)],
+        "subtotal": None,
+        "total": None,
+        "fields_metadata": [
+            _bbox_entry("merchant", 10),
+            _bbox_entry("line_items.0.name", 100),
+            _bbox_entry("line_items.1.name", 540),
+        ],
+    },
+    {
+        "is_receipt": True,
+        "merchant": None,
+        # "Bread" sits in the overlap and is repeated here.
+        "line_items": [_item("Bread", 4.00), _item("Eggs", 5.00)],
+        "subtotal": 0,
+        "fields_metadata": [
+            _bbox_entry("line_items.0.name", 40),
+            _bbox_entry("line_items.1.name", 300),
+        ],
+    },
+    {
+        "is_receipt": True,
+        "line_items": [_item("Apples", 6.00)],
+        "subtotal": 18.00,
+        "tax": 1.00,
+        "total": 19.00,
+        "fields_metadata": [
+            _bbox_entry("line_items.0.name", 50),
+            _bbox_entry("total", 400),
+        ],
+    },
+]
+
+
+class TestPlanSegments:
+    def test_regular_photo_is_not_tiled(self):
+        assert plan_segments(1000, 1400) == []
+
+    def test_tall_image_is_split_into_overlapping_bands(self):
+        bands = plan_segments(400, 2400)
+
+        assert len(bands) >= 2
+        assert bands[0][0] == 0
+        assert bands[-1][1] == 2400
+        for (_, previous_bottom), (next_top, _) in zip(bands, bands[1:]):
+            assert next_top < previous_bottom
+
+    @patch("receipt_tiling.RECEIPT_TILING_MAX_SEGMENTS", 3)
+    def test_segment_count_is_capped(self):
+        bands = plan_segments(100, 10_000)
+
+        assert len(bands) == 3
+        assert bands[-1][1] == 10_000
+
+
+class TestSplitTallImage:
+    def test_returns_jpeg_segments_for_tall_image(self):
+        segments = split_tall_image(_jpeg(200, 1200))
+
+        assert len(segments) >= 2
+        with Image.open(io.BytesIO(segments[0].data)) as first:
+            assert first.width == 200
+            assert first.height == segments[0].bottom - segments[0].top
+
+    def test_undecodable_data_is_not_tiled(self):
+        assert split_tall_image(b"not-an-image") == []
+
+
+class TestMergeSegmentPayloads:
+    def test_overlapping_items_are_deduplicated(self):
+        merged = merge_segment_payloads(SEGMENTS, SEGMENT_PAYLOADS)
+
+        names = [item["name"] for item in merged["line_items"]]
+        assert names == ["Milk", "Bread", "Eggs", "Apples"]
+
+    def test_header_from_first_segment_and_totals_from_last(self):
+        merged = merge_segment_payloads(SEGMENTS, SEGMENT_PAYLOADS)
+
+        assert merged["merchant"] == "Long Grocer"
+        assert merged["subtotal"] == 18.00
+        assert merged["total"] == 19.00
+
+    def test_metadata_is_reindexed_and_shifted_to_full_image(self):
+        merged = merge_segment_payloads(SEGMENTS, SEGMENT_PAYLOADS)
+
+        boxes = {
+            entry["field_name"]: entry["bbox"]["y"]
+            for entry in merged["fields_metadata"]
+        }
+        assert boxes == {
+            "merchant": 10,
+            "total": 1400,
+            "line_items.0.name": 100,
+            "line_items.1.name": 540,
+            "line_items.2.name": 800,
+            "line_items.3.name": 1050,
+        }
+
+    def test_returns_none_without_line_items(self):
+        payloads = [{"is_receipt": True, "line_items": []}] * len(SEGMENTS)
+
+        assert merge_segment_payloads(SEGMENTS, payloads) is None
+
+
+@pytest.fixture()
+def analyzer():
+    with patch("image_analyzer._configured", True):
+        yield ImageAnalyzer()
+
+
+def _segment_responses(payloads, whole_image_payload=None):
+    """generate_content side effect answering each segment by its prompt."""
+
+    def generate_content(parts):
+        match = re.search(r"segment (\d+) of", parts[1])
+        if match is None:
+            return SimpleNamespace(text=json.dumps(whole_image_payload))
+        return SimpleNamespace(text=json.dumps(payloads[int(match.group(1)) - 1]))
+
+    return generate_content
+
+
+class TestAnalyzeTallReceipt:
+    def test_segments_are_analyzed_and_merged(self, analyzer):
+        segments = SEGMENTS
+        with (
+            patch("image_analyzer.split_tall_image", return_value=segments),
+            patch("image_analyzer.genai.GenerativeModel") as mock_model_cls,
+        ):
+            mock_model_cls.return_value.generate_content.side_effect = (
+                _segment_responses(SEGMENT_PAYLOADS)
+            )
+            result = analyzer._analyze_image_with_gemini(b"tall-image")
+
+        assert isinstance(result, RegularReceipt)
+        assert [item.name for item in result.line_items] == [
+            "Milk",
+            "Bread",
+            "Eggs",
+            "Apples",
+        ]
+        assert mock_model_cls.return_value.generate_content.call_count == 3
+
+    def test_unreconciled_merge_falls_back_to_whole_image(self, analyzer):
+        payloads = [dict(payload) for payload in SEGMENT_PAYLOADS]
+        payloads[2]["subtotal"] = 30.00
+        whole_image = {
+            "is_receipt": True,
+            "merchant": "Long Grocer",
+            "line_items": [_item("Milk", 3.00), _item("Bread", 4.00)],
+            "subtotal": 7.00,
+            "total": 7.00,
+        }
+        with (
+            patch("image_analyzer.split_tall_image", return_value=SEGMENTS),
+            patch("image_analyzer.genai.GenerativeModel") as mock_model_cls,
+        ):
+            mock_model_cls.return_value.generate_content.side_effect = (
+                _segment_responses(payloads, whole_image)
+            )
+            result = analyzer._analyze_image_with_gemini(b"tall-image")
+
+        assert [item.name for item in result.line_items] == ["Milk", "Bread"]
+        assert mock_model_cls.return_value.generate_content.call_count == 4
+
+    @patch.object(receipt_tiling, "RECEIPT_TILING_MIN_ASPECT_RATIO", 100.0)
+    def test_short_image_uses_single_call(self, analyzer):
+        whole_image = {
+            "is_receipt": True,
+            "line_items": [_item("Milk", 3.00)],
+            "subtotal": 3.00,
+            "total": 3.00,
+        }
+        with patch("image_analyzer.genai.GenerativeModel") as mock_model_cls:
+            mock_model_cls.return_value.generate_content.side_effect = (
+                _segment_responses([], whole_image)
+            )
+            analyzer._analyze_image_with_gemini(_jpeg(200, 1200))
+
+        assert mock_model_cls.return_value.generate_content.call_count == 1
@@ -1,11 +1,14 @@
+import io
 import json
 import os
 from unittest.mock import patch
 
 import pytest
 from pydantic import ValidationError
+from sqlalchemy import event
 
 from models import db
+from models.receipt_line_item import ReceiptLineItem
 from schemas.receipt import BoundingBox, FieldMetadata, RegularReceipt
 
 
@@ -117,3 +120,104 @@ def test_analyze_receipt(
     assert data["receipt_data"]["merchant"] == mock_receipt_data["merchant"]
 
     os.remove(file_path)
+
+
+@patch("blueprints.receipts.upload_to_blob_storage")
+@patch("blueprints.receipts.ImageAnalyzer")
+def test_analyze_receipt_response_format(
+    mock_image_analyzer, mock_blob_upload, test_client, mock_receipt_data
+):
+    """
+    GIVEN a saved receipt
+    WHEN the '/api/analyze-receipt' response is serialized by pydantic-core
+    THEN amounts are JSON numbers, dates are ISO 8601 and no null
+    near_duplicate_of is sent
+    """
+    mock_blob_upload.return_value = "https://fake-blob-storage.com/fake-image-url.jpg"
+    mock_image_analyzer.return_value.analyze_image.return_value = (
+        RegularReceipt.model_validate(mock_receipt_data)
+    )
+
+    response = test_client.post(
+        "/api/analyze-receipt",
+        data={"file": (io.BytesIO(b"dummy receipt image"), "receipt.jpg")},
+        content_type="multipart/form-data",
+    )
+
+    assert response.status_code == 200
+    assert response.mimetype == "application/json"
+    data = json.loads(response.data)
+    receipt = data["receipt_data"]
+    assert receipt["date"] == "2025-06-08"
+    assert receipt["total"] == 82.6
+    assert sorted(item["total_price"] for item in receipt["line_items"]) == [18.0, 46.0]
+    assert "near_duplicate_of" not in data
+
+
+@patch("blueprints.receipts.upload_to_blob_storage")
+@patch("blueprints.receipts.ImageAnalyzer")
+def test_analyze_receipt_statements_independent_of_line_items(
+    mock_image_analyzer, mock_blob_upload, test_client, test_app, mock_receipt_data
+):
+    """
+    GIVEN analyzed receipts with 2 and with 40 line items
+    WHEN they are saved through '/api/analyze-receipt'
+    THEN both take the same number of SQL statements, the line items are
+    inserted by one statement and nothing is reloaded for the response
+    """
+    mock_blob_upload.return_value = "https://fake-blob-storage.com/fake-image-url.jpg"
+    many_items = [
+        {"name": f"Item {i}", "quantity": 1, "price_per_item": 2.5, "total_price": 2.5}
+        for i in range(40)
+    ]
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements[-1].append(statement)
+
+    with test_app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        responses = []
+        # Distinct images, so the second upload is not served from the first.
+        for image, line_items in (
+            (b"short receipt", mock_receipt_data["line_items"]),
+            (b"long receipt", many_items),
+        ):
+            mock_image_analyzer.return_value.analyze_image.return_value = (
+                RegularReceipt.model_validate(
+                    {**mock_receipt_data, "line_items": line_items}
+                )
+            )
+            statements.append([])
+            responses.append(
+                test_client.post(
+                    "/api/analyze-receipt",
+                    data={"file": (io.BytesIO(image), "receipt.jpg")},
+                    content_type="multipart/form-data",
+                )
+            )
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+    assert [response.status_code for response in responses] == [200, 200]
+    few, many = statements
+    assert len(few) == len(many)
+    assert len([s for s in many if s.startswith("INSERT INTO receipt_line_items")]) == 1
+    assert not any(
+        s.startswith("SELECT") and ("receipt_line_items" in s or "assignments" in s)
+        for s in many
+    )
+
+    receipt = json.loads(responses[1].data)["receipt_data"]
+    assert [item["name"] for item in receipt["line_items"]] == [
+        item["name"] for item in many_items
+    ]
+    with test_app.app_context():
+        stored = db.session.scalars(
+            db.select(ReceiptLineItem).filter_by(receipt_id=receipt["id"])
+        ).all()
+        assert {str(item.id) for item in stored} == {
+            item["id"] for item in receipt["line_items"]
+        }
@@ -0,0 +1,84 @@
+"""
+Tests for the Server-Timing header.
+"""
+
+import io
+import re
+from unittest.mock import MagicMock, patch
+
+from schemas.receipt import RegularReceipt
+from server_timing import record_phase, timed
+
+
+def _phases(response):
+    """Server-Timing entries as {name: (description, duration)}."""
+    phases = {}
+    for entry in response.headers["Server-Timing"].split(", "):
+        name, *params = entry.split(";")
+        params = dict(param.split("=", 1) for param in params)
+        phases[name] = (params.get("desc", "").strip('"'), float(params["dur"]))
+    return phases
+
+
+def test_every_response_reports_total(test_client):
+    response = test_client.get("/api/health")
+
+    assert list(_phases(response)) == ["total"]
+    assert response.headers["Timing-Allow-Origin"] == "*"
+
+
+def test_phases_are_summed_and_ordered(test_app):
+    @test_app.route("/_timed")
+    def timed_view():
+        with timed("db"):
+            pass
+        record_phase("gemini", 5.0, "Gemini first pass")
+        record_phase("db", 2.5)
+        return "ok"
+
+    response = test_app.test_client().get("/_timed")
+
+    phases = _phases(response)
+    assert list(phases) == ["db", "gemini", "total"]
+    assert phases["db"][1] >= 2.5
+    assert phases["gemini"] == ("Gemini first pass", 5.0)
+
+
+def test_timed_is_a_no_op_outside_requests():
+    with timed("db"):
+        pass
+    record_phase("db", 1.0)
+
+
+@patch("blueprints.receipts.requests.post")
+@patch("blueprints.receipts.ImageAnalyzer")
+def test_analyze_receipt_phases(
+    mock_image_analyzer, mock_post, test_client, new_user, mock_receipt_data
+):
+    mock_post.return_value = MagicMock(
+        json=lambda: {"success": True, "url": "https://blob.example/r.jpg"}
+    )
+    mock_image_analyzer.return_value.analyze_image.return_value = (
+        RegularReceipt.model_validate(mock_receipt_data)
+    )
+
+    with patch("blueprints.receipts.get_current_user", return_value=new_user):
+        response = test_client.post(
+            "/api/analyze-receipt",
+            data={"file": (io.BytesIO(b"server timing receipt"), "receipt.jpg")},
+            content_type="multipart/form-data",
+        )
+
+    assert response.status_code == 200
+    phases = _phases(response)
+    assert list(phases) == ["blob", "analyze", "db", "sql", "total"]
+    assert phases["blob"][0] == "Blob upload"
+    for entry in response.headers["Server-Timing"].split(", "):
+        assert re.fullmatch(r'[\w-]+(;desc="[^"]+")?;dur=\d+\.\d', entry)
+
+
+def test_authentication_is_timed(test_client):
+    response = test_client.get("/api/receipts")
+
+    assert response.status_code == 401
+    assert _phases(response)["auth"][0] == "Authentication"
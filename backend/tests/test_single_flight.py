@@ -0,0 +1,141 @@
+"""
+Tests for single-flight coalescing of identical receipt analyses.
+"""
+
+import io
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import single_flight
+from models import db
+from models.analysis_lease import AnalysisLease
+from schemas.receipt import RegularReceipt
+
+
+IMAGE_SHA = "a" * 64
+
+
+@pytest.fixture()
+def receipt(mock_receipt_data):
+    return RegularReceipt.model_validate(mock_receipt_data)
+
+
+def _add_lease(status, result=None, locked_for=timedelta(minutes=3)):
+    now = datetime.now(timezone.utc)
+    db.session.add(
+        AnalysisLease(
+            image_sha256=IMAGE_SHA,
+            status=status,
+            result_type="RegularReceipt" if result is not None else None,
+            result=result,
+            locked_until=now + locked_for,
+            expires_at=now + timedelta(minutes=5),
+        )
+    )
+    db.session.commit()
+
+
+class TestAnalyzeOnce:
+    def test_concurrent_callers_in_process_share_one_analysis(self, test_app, receipt):
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def analyze():
+            calls.append(1)
+            started.set()
+            release.wait(timeout=5)
+            return receipt
+
+        results = {}
+
+        def worker(name):
+            with test_app.app_context():
+                results[name] = single_flight.analyze_once(IMAGE_SHA, analyze)
+
+        leader = threading.Thread(target=worker, args=("leader",))
+        leader.start()
+        assert started.wait(timeout=5)
+        follower = threading.Thread(target=worker, args=("follower",))
+        follower.start()
+        time.sleep(0.1)
+        release.set()
+        leader.join(timeout=5)
+        follower.join(timeout=5)
+
+        assert len(calls) == 1
+        assert results["follower"] == results["leader"]
+        assert results["follower"] is not results["leader"]
+
+    def test_follower_reuses_result_stored_by_another_worker(self, test_app, receipt):
+        _add_lease("completed", result=receipt.model_dump(mode="json"))
+        analyze = MagicMock()
+
+        result = single_flight.analyze_once(IMAGE_SHA, analyze)
+
+        analyze.assert_not_called()
+        assert isinstance(result, RegularReceipt)
+        assert result.merchant == receipt.merchant
+        assert result.total == receipt.total
+        assert len(result.line_items) == len(receipt.line_items)
+
+    def test_leader_stores_result_for_other_workers(self, test_app, receipt):
+        single_flight.analyze_once(IMAGE_SHA, lambda: receipt)
+
+        lease = db.session.get(AnalysisLease, IMAGE_SHA)
+        assert lease.status == "completed"
+        assert lease.result_type == "RegularReceipt"
+        assert lease.result["merchant"] == receipt.merchant
+
+    def test_leader_failure_releases_lease(self, test_app):
+        def analyze():
+            raise RuntimeError("gemini down")
+
+        with pytest.raises(RuntimeError):
+            single_flight.analyze_once(IMAGE_SHA, analyze)
+
+        assert db.session.get(AnalysisLease, IMAGE_SHA) is None
+
+    @patch("single_flight.SINGLE_FLIGHT_WAIT_SECONDS", 0)
+    def test_follower_gives_up_when_leader_is_too_slow(self, test_app, receipt):
+        _add_lease("running")
+        analyze = MagicMock(return_value=receipt)
+
+        with pytest.raises(single_flight.SingleFlightTimeout):
+            single_flight.analyze_once(IMAGE_SHA, analyze)
+
+        analyze.assert_not_called()
+
+    def test_abandoned_lease_is_taken_over(self, test_app, receipt):
+        _add_lease("running", locked_for=timedelta(seconds=-1))
+        analyze = MagicMock(return_value=receipt)
+
+        single_flight.analyze_once(IMAGE_SHA, analyze)
+
+        analyze.assert_called_once()
+        db.session.expire_all()
+        assert db.session.get(AnalysisLease, IMAGE_SHA).status == "completed"
+
+
+@patch("blueprints.receipts.upload_to_blob_storage", return_value="https://blob/r.jpg")
+@patch("blueprints.receipts.ImageAnalyzer")
+@patch(
+    "blueprints.receipts.analyze_once",
+    side_effect=single_flight.SingleFlightTimeout(IMAGE_SHA),
+)
+def test_upload_waiting_too_long_is_retryable(
+    mock_analyze, mock_analyzer_cls, mock_upload, test_client
+):
+    response = test_client.post(
+        "/api/analyze-receipt",
+        data={"file": (io.BytesIO(b"receipt-bytes"), "receipt.jpg")},
+        content_type="multipart/form-data",
+    )
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
+    assert response.get_json()["success"] is False
@@ -0,0 +1,169 @@
+"""
+Tests for request tracing.
+"""
+
+import io
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import tracing
+from image_analyzer import ImageAnalyzer
+from models import db
+from models.user import User
+from schemas.receipt import RegularReceipt
+
+
+@pytest.fixture
+def spans():
+    finished = []
+    tracing.set_exporter(finished.append)
+    yield finished
+    tracing.set_exporter(None)
+
+
+def _by_name(spans):
+    return {span["name"]: span for span in spans}
+
+
+def test_no_spans_without_an_exporter(test_client):
+    response = test_client.get("/api/health")
+
+    assert "traceresponse" not in response.headers
+    with tracing.span("work") as span:
+        assert span is None
+
+
+def test_request_span_and_children(test_client, spans):
+    response = test_client.get("/api/receipts")
+
+    assert response.status_code == 401
+    request_span = _by_name(spans)["GET /api/receipts"]
+    auth_span = _by_name(spans)["auth"]
+    assert request_span["parent_span_id"] is None
+    assert request_span["attributes"]["http.route"] == "/api/receipts"
+    assert request_span["attributes"]["http.response.status_code"] == 401
+    assert auth_span["trace_id"] == request_span["trace_id"]
+    assert auth_span["parent_span_id"] == request_span["span_id"]
+    assert response.headers["traceresponse"] == (
+        f"00-{request_span['trace_id']}-{request_span['span_id']}-01"
+    )
+
+
+def test_incoming_traceparent_is_continued(test_client, spans):
+    trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+    test_client.get(
+        "/api/health", headers={"traceparent": f"00-{trace_id}-00f067aa0ba902b7-01"}
+    )
+
+    request_span = _by_name(spans)["GET /api/health"]
+    assert request_span["trace_id"] == trace_id
+    assert request_span["parent_span_id"] == "00f067aa0ba902b7"
+
+
+def test_unsampled_traceparent_exports_nothing(test_client, spans):
+    response = test_client.get(
+        "/api/health",
+        headers={
+            "traceparent": "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-00"
+        },
+    )
+
+    assert spans == []
+    assert response.headers["traceresponse"].endswith("-00")
+
+
+def test_sql_statements_are_spans(test_app, spans, new_user):
+    with tracing.span("job") as job:
+        db.session.get(User, new_user.id)
+        db.session.rollback()
+
+    queries = [span for span in spans if span["name"] == "db.query"]
+    assert queries
+    assert all(span["parent_span_id"] == job.span_id for span in queries)
+    assert queries[0]["attributes"]["db.system"] == "sqlite"
+    assert "FROM users" in queries[0]["attributes"]["db.statement"]
+
+
+@patch("blueprints.receipts.requests.post")
+@patch("blueprints.receipts.ImageAnalyzer")
+def test_analyze_receipt_propagates_to_the_upload(
+    mock_image_analyzer, mock_post, test_client, new_user, mock_receipt_data, spans
+):
+    mock_post.return_value = MagicMock(
+        json=lambda: {"success": True, "url": "https://blob.example/r.jpg"}
+    )
+    mock_image_analyzer.return_value.analyze_image.return_value = (
+        RegularReceipt.model_validate(mock_receipt_data)
+    )
+
+    with patch("blueprints.receipts.get_current_user", return_value=new_user):
+        response = test_client.post(
+            "/api/analyze-receipt",
+            data={"file": (io.BytesIO(b"traced receipt"), "receipt.jpg")},
+            content_type="multipart/form-data",
+        )
+
+    assert response.status_code == 200
+    named = _by_name(spans)
+    blob_span = named["blob"]
+    traceparent = mock_post.call_args.kwargs["headers"]["traceparent"]
+    assert traceparent == f"00-{blob_span['trace_id']}-{blob_span['span_id']}-01"
+    request_id = named["POST /api/analyze-receipt"]["span_id"]
+    for phase in ("blob", "analyze", "db"):
+        assert named[phase]["parent_span_id"] == request_id
+    assert any(
+        span["name"] == "db.query" and span["parent_span_id"] == named["db"]["span_id"]
+        for span in spans
+    )
+
+
+@patch("image_analyzer.genai.GenerativeModel")
+def test_generate_content_span(mock_model, spans):
+    mock_model.return_value.generate_content.return_value = MagicMock(
+        text=json.dumps({"is_receipt": False, "reason": "blank"}),
+        usage_metadata=MagicMock(
+            prompt_token_count=120, candidates_token_count=30, total_token_count=150
+        ),
+    )
+
+    with patch("image_analyzer._configured", True), tracing.span("analysis") as root:
+        ImageAnalyzer().analyze_image(b"not really an image", "image/png")
+
+    named = _by_name(spans)
+    call = named["gemini.generate_content"]
+    assert call["trace_id"] == root.trace_id
+    assert call["parent_span_id"] == named["gemini"]["span_id"]
+    assert call["attributes"]["gemini.call"] == "first_pass"
+    assert call["attributes"]["gemini.image_bytes"] == len(b"not really an image")
+    assert call["attributes"]["gen_ai.request.model"].startswith("models/gemini")
+    assert call["attributes"]["gemini.tokens.total"] == 150
+    assert named["receipt.validate"]["parent_span_id"] == named["parse"]["span_id"]
+
+
+def test_errors_mark_the_span(spans):
+    with pytest.raises(ValueError):
+        with tracing.span("failing"):
+            raise ValueError("boom")
+
+    assert spans[0]["status"] == "ERROR"
+    assert spans[0]["attributes"]["exception.type"] == "ValueError"
+
+
+def test_json_lines_exporter(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    tracing.set_exporter(
+        tracing.JsonLinesExporter(lambda: open(path, "a", encoding="utf-8"))
+    )
+    try:
+        with tracing.span("outer", job="sync"):
+            with tracing.span("inner"):
+                pass
+    finally:
+        tracing.set_exporter(None)
+
+    inner, outer = [json.loads(line) for line in path.read_text().splitlines()]
+    assert inner["parent_span_id"] == outer["span_id"]
+    assert outer["attributes"] == {"job": "sync"}
+    assert outer["resource"]["service.name"] == "splitzy-backend"
@@ -0,0 +1,334 @@
+"""
+Request tracing with a local exporter.
+
+Spans follow the OpenTelemetry data model (trace/span ids, parent, start
+and end in unix nanoseconds, attributes, status, links) and propagate
+across services with the W3C `traceparent` header, but are written as JSON
+lines to a file or stdout instead of being sent to a collector:
+
+    TRACING_EXPORTER=file TRACING_FILE=/tmp/splitzy-traces.jsonl
+    jq 'select(.trace_id == "<id>")' /tmp/splitzy-traces.jsonl
+
+Every request is a span, continuing the caller's trace when it sends a
+traceparent; the response carries the trace in a `traceresponse` header so a
+slow request can be looked up afterwards. Inside it, each server_timing
+phase is a child span, and so is every SQL statement. Outgoing calls (the
+blob upload) carry the current traceparent, and work handed to other
+threads keeps its parent when submitted through in_current_context.
+
+With TRACING_EXPORTER unset, no spans are created and span() costs a
+context-variable lookup.
+"""
+
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from typing import Any, Callable, Iterator, Optional, TextIO
+
+from flask import Flask, Response, g, request
+from sqlalchemy import event
+
+from models import db
+
+
+# "stdout" or "file"; anything else disables tracing.
+TRACING_EXPORTER: str = os.getenv("TRACING_EXPORTER", "").strip().lower()
+
+# JSON-lines file the "file" exporter appends to.
+TRACING_FILE: str = os.getenv(
+    "TRACING_FILE", os.path.join(tempfile.gettempdir(), "splitzy-traces.jsonl")
+)
+
+# Share of new traces recorded; traces continued from a traceparent follow
+# the caller's sampled flag.
+TRACING_SAMPLE_RATIO: float = float(os.getenv("TRACING_SAMPLE_RATIO", "1.0"))
+
+SERVICE_NAME = "splitzy-backend"
+
+# SQL statements are recorded up to this many characters.
+_MAX_STATEMENT_LENGTH = 2000
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+class Span:
+    """One timed operation of a trace."""
+
+    __slots__ = (
+        "trace_id",
+        "span_id",
+        "parent_span_id",
+        "name",
+        "sampled",
+        "attributes",
+        "links",
+        "status",
+        "start_ns",
+        "end_ns",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent_span_id: Optional[str],
+        sampled: bool,
+        attributes: Optional[dict[str, Any]] = None,
+        links: Optional[list[str]] = None,
+    ):
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.sampled = sampled
+        self.attributes = dict(attributes or {})
+        self.links = list(links or [])
+        self.status = "OK"
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_error(self, error: BaseException) -> None:
+        self.status = "ERROR"
+        self.attributes["exception.type"] = type(error).__name__
+        self.attributes["exception.message"] = str(error)
+
+    def end(self) -> None:
+        self.end_ns = time.time_ns()
+        if self.sampled and _exporter is not None:
+            _exporter(self.to_dict())
+
+    def to_dict(self) -> dict[str, Any]:
+        end_ns = self.end_ns or time.time_ns()
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "name": self.name,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": end_ns,
+            "duration_ms": round((end_ns - self.start_ns) / 1e6, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+            "links": self.links,
+            "resource": {"service.name": SERVICE_NAME, "process.pid": os.getpid()},
+        }
+
+
+class JsonLinesExporter:
+    """Writes each finished span as one JSON line."""
+
+    def __init__(self, open_stream: Callable[[], TextIO]):
+        self._open_stream = open_stream
+        self._stream: Optional[TextIO] = None
+        self._lock = threading.Lock()
+
+    def __call__(self, span: dict[str, Any]) -> None:
+        line = json.dumps(span, default=str) + "\n"
+        with self._lock:
+            if self._stream is None:
+                # Opened lazily, in the worker that writes.
+                self._stream = self._open_stream()
+            self._stream.write(line)
+            self._stream.flush()
+
+
+def _exporter_from_env() -> Optional[Callable[[dict], None]]:
+    if TRACING_EXPORTER == "stdout":
+        return JsonLinesExporter(lambda: sys.stdout)
+    if TRACING_EXPORTER == "file":
+        return JsonLinesExporter(lambda: open(TRACING_FILE, "a", encoding="utf-8"))
+    return None
+
+
+_exporter: Optional[Callable[[dict], None]] = _exporter_from_env()
+_current: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def set_exporter(exporter: Optional[Callable[[dict], None]]) -> None:
+    """Send finished spans to `exporter` (a callable taking a span dict)."""
+    global _exporter
+    _exporter = exporter
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def set_attributes(**attributes: Any) -> None:
+    """Add attributes to the current span, if there is one."""
+    span = _current.get()
+    if span is not None:
+        span.attributes.update(attributes)
+
+
+def current_traceparent() -> Optional[str]:
+    span = _current.get()
+    return span.traceparent if span is not None else None
+
+
+def inject_headers(headers: dict[str, str]) -> dict[str, str]:
+    """Add the current traceparent to outgoing request headers."""
+    traceparent = current_traceparent()
+    if traceparent is not None:
+        headers["traceparent"] = traceparent
+    return headers
+
+
+def _start_span(
+    name: str,
+    attributes: Optional[dict[str, Any]] = None,
+    traceparent: Optional[str] = None,
+    links: Optional[list[str]] = None,
+) -> Optional[Span]:
+    if _exporter is None:
+        return None
+    parent = _current.get()
+    if parent is not None:
+        return Span(
+            name, parent.trace_id, parent.span_id, parent.sampled, attributes, links
+        )
+    match = _TRACEPARENT.match(traceparent or "")
+    if match:
+        trace_id, parent_id, flags = match.groups()
+        sampled = bool(int(flags, 16) & 1)
+        return Span(name, trace_id, parent_id, sampled, attributes, links)
+    sampled = random.random() < TRACING_SAMPLE_RATIO
+    return Span(
+        name, f"{random.getrandbits(128):032x}", None, sampled, attributes, links
+    )
+
+
+@contextmanager
+def span(
+    name: str, links: Optional[list[str]] = None, **attributes: Any
+) -> Iterator[Optional[Span]]:
+    """
+    Run the block (or decorated call) in a child span of the current one, or
+    in a new trace if there is none. Yields the span, or None when tracing
+    is off.
+    """
+    new_span = _start_span(name, attributes, links=links)
+    if new_span is None:
+        yield None
+        return
+    token = _current.set(new_span)
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.set_error(e)
+        raise
+    finally:
+        _current.reset(token)
+        new_span.end()
+
+
+def in_current_context(fn: Callable) -> Callable:
+    """
+    `fn` bound to a copy of the caller's context, for running in another
+    thread (e.g. executor.submit(in_current_context(fn), ...)) as a child of
+    the current span.
+    """
+    context = copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+def _start_request() -> None:
+    rule = request.url_rule.rule if request.url_rule is not None else None
+    request_span = _start_span(
+        f"{request.method} {rule or request.path}",
+        {
+            "http.request.method": request.method,
+            "url.path": request.path,
+            "http.route": rule,
+        },
+        traceparent=request.headers.get("traceparent"),
+    )
+    if request_span is not None:
+        g.trace_span = request_span
+        g.trace_token = _current.set(request_span)
+
+
+def _annotate_response(response: Response) -> Response:
+    request_span = g.get("trace_span")
+    if request_span is not None:
+        request_span.set_attribute("http.response.status_code", response.status_code)
+        if response.status_code >= 500:
+            request_span.status = "ERROR"
+        response.headers["traceresponse"] = request_span.traceparent
+    return response
+
+
+def _end_request(error: Optional[BaseException]) -> None:
+    request_span = g.pop("trace_span", None)
+    token = g.pop("trace_token", None)
+    if request_span is None:
+        return
+    if error is not None:
+        request_span.set_error(error)
+    try:
+        _current.reset(token)
+    except ValueError:
+        # Torn down in another context than the one the request started in.
+        _current.set(None)
+    request_span.end()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    parent = _current.get()
+    if parent is None or context is None:
+        return
+    statement_span = Span(
+        "db.query",
+        parent.trace_id,
+        parent.span_id,
+        parent.sampled,
+        {
+            "db.system": conn.dialect.name,
+            "db.statement": statement[:_MAX_STATEMENT_LENGTH],
+            "db.executemany": executemany,
+        },
+    )
+    context._trace_span = statement_span
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    statement_span = getattr(context, "_trace_span", None)
+    if statement_span is not None:
+        context._trace_span = None
+        if cursor.rowcount is not None and cursor.rowcount >= 0:
+            statement_span.set_attribute("db.rowcount", cursor.rowcount)
+        statement_span.end()
+
+
+def _handle_error(exception_context) -> None:
+    context = exception_context.execution_context
+    statement_span = getattr(context, "_trace_span", None)
+    if statement_span is not None:
+        context._trace_span = None
+        statement_span.set_error(exception_context.original_exception)
+        statement_span.end()
+
+
+def init_tracing(app: Flask) -> None:
+    """Trace the app's requests and SQL statements."""
+    app.before_request(_start_request)
+    app.after_request(_annotate_response)
+    app.teardown_request(_end_request)
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(db.engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(db.engine, "handle_error", _handle_error)